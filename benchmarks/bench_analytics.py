@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the session analytics.
+# Generates synthetic sessions (one set lap and several confirmation laps each) and times the array build and the
+# vectorized statistics. Some confirmation laps skip a mark press anywhere in the lap. It is checked, that exactly
+# the skipped mark is missed.
+# Run with: python benchmarks/bench_analytics.py [sessions]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from clock import NS_PER_S  # noqa: E402
+from sessionAnalytics import SessionArrays, analyse  # noqa: E402
+
+SESSIONS = 5000
+CONFIRMATION_LAPS = 4
+MARKS = 8
+CONFIGS = ['LCD.cfg', 'GLP_norm.cfg', 'night.cfg']
+
+
+# Get synthetic confirmation lap rows for SessionArrays and the skipped mark of each row (None: all pressed).
+def synthetic_rows(sessions, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    skipped_marks = []
+    for session_id in range(sessions):
+        config_name = CONFIGS[session_id % len(CONFIGS)]
+        n_marks = MARKS - session_id % len(CONFIGS)
+        set_time = int(rng.uniform(90, 150) * NS_PER_S)
+        # Marks spread over the lap, at least a few seconds apart.
+        set_marks = [int((mark_id + rng.uniform(0.75, 1.25)) * set_time / (n_marks + 1)) for mark_id in range(n_marks)]
+
+        for _ in range(CONFIRMATION_LAPS):
+            conf_time = set_time + int(rng.gauss(0, 0.5) * NS_PER_S)
+            conf_marks = [mark + int(rng.gauss(0, 0.3) * NS_PER_S) for mark in set_marks]
+
+            # Some missed mark presses.
+            skipped = None
+            if rng.random() < 0.1:
+                skipped = rng.randrange(n_marks)
+                del conf_marks[skipped]
+            rows.append((config_name, session_id, set_time, set_marks, conf_time, conf_marks))
+            skipped_marks.append(skipped)
+
+    return rows, skipped_marks
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS
+    rows, skipped_marks = synthetic_rows(sessions)
+
+    start = time.perf_counter()
+    arrays = SessionArrays(rows)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats_rows = analyse(arrays)
+    analyse_time = time.perf_counter() - start
+
+    print('{} sessions, {} confirmation laps x {} marks'.format(sessions, len(arrays), arrays.n_marks))
+    print('Array build: {:8.1f} ms'.format(build_time * 1000))
+    print('Statistics:  {:8.1f} ms ({} rows)'.format(analyse_time * 1000, len(stats_rows)))
+
+    # Each lap must miss exactly its skipped mark.
+    wrong = 0
+    for lap_id, skipped in enumerate(skipped_marks):
+        missed = [mark_id for mark_id in range(len(rows[lap_id][3])) if np.isnan(arrays.conf_marks[lap_id, mark_id])]
+        wrong += missed != ([] if skipped is None else [skipped])
+    print('Skipped presses: {}, laps with wrong missed marks: {}'.format(
+        sum(skipped is not None for skipped in skipped_marks), wrong))
+    if wrong:
+        raise RuntimeError('Mark passages matched to the wrong set marks.')
+
+
+if __name__ == '__main__':
+    main()
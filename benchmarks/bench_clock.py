@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the timer clock source.
+# Compares the old wall clock float source (time.time) with the monotonic integer nanosecond source (Clock).
+# Reports per-call overhead, the jitter of back-to-back stamps and the resolution of stored stamps.
+# Run on the target (e.g. the Pi) with: python benchmarks/bench_clock.py
+
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from clock import Clock  # noqa: E402
+
+CALLS = 200000
+
+
+# Get the mean per-call overhead in ns of a time source.
+def call_overhead_ns(source, calls=CALLS):
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        source()
+    return (time.perf_counter_ns() - start) / calls
+
+
+# Get the deltas of back-to-back stamps in ns. Spread of the deltas is the stamp jitter.
+def stamp_deltas_ns(source, to_ns, calls=CALLS):
+    stamps = [source() for _ in range(calls)]
+    return [to_ns(b - a) for a, b in zip(stamps, stamps[1:])]
+
+
+# Get the spacing of two adjacent floats around a value in seconds.
+# This is the best resolution a float time.time() stamp can keep.
+def float_ulp(value):
+    mantissa_bits = sys.float_info.mant_dig - 1
+    exponent = value.hex().split('p')[1]
+    return 2.0 ** (int(exponent) - mantissa_bits)
+
+
+def report(name, overhead, deltas):
+    deltas = sorted(deltas)
+    print('{:<24} overhead {:8.1f} ns/call | delta median {:8.1f} ns  p99 {:8.1f} ns  '
+          'stdev {:8.1f} ns  zero-deltas {:6.2%}'.format(name,
+                                                        overhead,
+                                                        statistics.median(deltas),
+                                                        deltas[int(len(deltas) * 0.99)],
+                                                        statistics.pstdev(deltas),
+                                                        deltas.count(0) / len(deltas)))
+
+
+def main():
+    clock = Clock()
+
+    print('Clock info time: {}'.format(time.get_clock_info('time')))
+    print('Clock info perf_counter: {}'.format(time.get_clock_info('perf_counter')))
+    print()
+
+    report('time.time()', call_overhead_ns(time.time), stamp_deltas_ns(time.time, lambda d: d * 1e9))
+    report('time.perf_counter_ns()', call_overhead_ns(time.perf_counter_ns),
+           stamp_deltas_ns(time.perf_counter_ns, lambda d: d))
+    report('Clock.now()', call_overhead_ns(clock.now), stamp_deltas_ns(clock.now, lambda d: d))
+
+    print()
+    print('Resolution of a stored time.time() stamp: {:.0f} ns'.format(float_ulp(time.time()) * 1e9))
+    print('Resolution of a stored Clock stamp: 1 ns (integer)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the GPS lap detection.
+# Generates an NMEA log (RMC and GGA at 25 Hz) of a car driving laps on a circular track with varying speed over
+# midnight UTC. The log is fed through the GPS input as fast as possible with a jittered reception delay. Reported
+# are the cost per sentence and fix, the share of a 25 Hz budget and the lap time error of the detected finish line
+# crossings, interpolated and taken at the next fix. The log is also replayed by the GPS thread from a file.
+# Run with: python benchmarks/bench_gps.py [LAPS] [HZ]
+
+import os
+import sys
+import math
+import time
+import queue
+import random
+import tempfile
+from functools import reduce
+from operator import xor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from clock import Clock, NS_PER_S, NS_PER_MS  # noqa: E402
+from gpsInput import GpsInput, LocalProjection, KNOTS_TO_MPS  # noqa: E402
+
+LAPS = 10
+HZ = 25
+CENTER = (47.0, 8.0)
+RADIUS = 500.0
+START_UTC = (23 * 3600 + 55 * 60) * NS_PER_S
+STEP_NS = NS_PER_MS
+
+
+# Get the speed (m/s) at a time (s).
+def speed_at(t):
+    return 25 + 8 * math.sin(2 * math.pi * t / 37)
+
+
+# Convert local metres around the center to (lat, lon).
+def to_lat_lon(projection, x, y):
+    return projection.lat + y / projection.m_per_deg_lat, projection.lon + x / projection.m_per_deg_lon
+
+
+# Add $ and the checksum to an NMEA sentence body.
+def nmea(body):
+    return '${}*{:02X}'.format(body, reduce(xor, body.encode(), 0))
+
+
+# Format degrees as NMEA coordinate with hemisphere.
+def nmea_coordinate(degrees, digits, hemispheres):
+    value = abs(degrees)
+    whole = int(value)
+    return '{:0{}d}{:08.5f},{}'.format(whole, digits, (value - whole) * 60, hemispheres[degrees < 0])
+
+
+# Get the RMC and GGA sentences of a fix.
+def fix_sentences(utc_ns, lat, lon, speed, course):
+    seconds = (utc_ns // (NS_PER_S // 100)) % (86400 * 100) / 100
+    utc = '{:02d}{:02d}{:05.2f}'.format(int(seconds // 3600), int(seconds % 3600 // 60), seconds % 60)
+    position = '{},{}'.format(nmea_coordinate(lat, 2, 'NS'), nmea_coordinate(lon, 3, 'EW'))
+    return [nmea('GPRMC,{},A,{},{:.2f},{:.1f},010126,,,A'.format(utc, position, speed / KNOTS_TO_MPS, course)),
+            nmea('GPGGA,{},{},1,12,0.8,400.0,M,48.0,M,,'.format(utc, position))]
+
+
+# Generate the sentences of a session. Returns (lines as (utc_ns, line), true crossing times in ns since start,
+# finish line as ((lat, lon), (lat, lon))).
+def generate_session(laps, hz, projection):
+    fix_ns = NS_PER_S // hz
+    lines = []
+    crossings = []
+
+    # Start slightly before the finish line, so the first crossing starts the first lap.
+    angle = -0.01
+    t_ns = 0
+    while len(crossings) < laps + 1 or t_ns <= crossings[-1] + fix_ns:
+        if t_ns % fix_ns == 0:
+            x, y = RADIUS * math.cos(angle), RADIUS * math.sin(angle)
+            lat, lon = to_lat_lon(projection, x, y)
+            course = (90 - math.degrees(angle + math.pi / 2)) % 360
+            lines += [(t_ns, line) for line in fix_sentences(START_UTC + t_ns, lat, lon,
+                                                              speed_at(t_ns / NS_PER_S), course)]
+
+        # Crossing of the finish line at angle 0. Linear interpolation within the step.
+        last_angle = angle
+        angle += speed_at(t_ns / NS_PER_S) / RADIUS * STEP_NS / NS_PER_S
+        t_ns += STEP_NS
+        turns = math.floor(angle / (2 * math.pi))
+        if turns > math.floor(last_angle / (2 * math.pi)):
+            crossings.append(t_ns - STEP_NS + int(STEP_NS * (turns * 2 * math.pi - last_angle) / (angle - last_angle)))
+
+    finish_line = (to_lat_lon(projection, RADIUS - 15, 0), to_lat_lon(projection, RADIUS + 15, 0))
+    return lines, crossings, finish_line
+
+
+# Get the errors (ms) of lap times against the true lap times.
+def lap_errors(crossings, true_crossings):
+    laps = [b - a for a, b in zip(crossings, crossings[1:])]
+    true_laps = [b - a for a, b in zip(true_crossings, true_crossings[1:])]
+    return sorted(abs(lap - true) / NS_PER_MS for lap, true in zip(laps, true_laps))
+
+
+def main():
+    laps = int(sys.argv[1]) if len(sys.argv) > 1 else LAPS
+    hz = int(sys.argv[2]) if len(sys.argv) > 2 else HZ
+
+    projection = LocalProjection(*CENTER)
+    lines, true_crossings, finish_line = generate_session(laps, hz, projection)
+
+    # Reception with a delay of 30 to 45 ms.
+    rng = random.Random(1)
+    received = [(line, t_ns + 30 * NS_PER_MS + rng.randrange(15 * NS_PER_MS)) for t_ns, line in lines]
+
+    gps = GpsInput('', Clock())
+    gps.set_finish_line(finish_line)
+    start = time.perf_counter_ns()
+    for line, recv_ns in received:
+        gps.handle_line(line, recv_ns)
+    duration = time.perf_counter_ns() - start
+
+    crossings = []
+    while not gps.events.empty():
+        crossings.append(gps.events.get()[1])
+
+    # Without interpolation: time of the first fix after each crossing.
+    fix_ns = NS_PER_S // hz
+    next_fix = [-(-t_ns // fix_ns) * fix_ns for t_ns in true_crossings]
+
+    print('{} laps at {} Hz: {} sentences, {} fixes'.format(laps, hz, gps.sentences, gps.fixes))
+    print('Cost: {:.1f} us per sentence, {:.1f} us per fix, {:.3f} % of a core at {} Hz'.format(
+        duration / 1000 / gps.sentences, duration / 1000 / gps.fixes, duration / gps.fixes * hz / NS_PER_S * 100, hz))
+    print('Crossings: {} detected, {} expected'.format(len(crossings), len(true_crossings)))
+    for name, errors in [('interpolated', lap_errors(crossings, true_crossings)),
+                         ('next fix', lap_errors(next_fix, true_crossings))]:
+        if errors:
+            print('Lap time error {:<12}: p50 {:6.2f} ms, max {:6.2f} ms'.format(name, errors[len(errors) // 2],
+                                                                                errors[-1]))
+
+    # Replay by the GPS thread.
+    replay_file_path = os.path.join(tempfile.mkdtemp(), 'session.nmea')
+    with open(replay_file_path, 'w') as replay_file:
+        replay_file.write('\n'.join(line for _, line in lines) + '\n')
+    events = queue.Queue()
+    gps = GpsInput(replay_file_path, Clock(), events, realtime=False)
+    gps.set_finish_line(finish_line)
+    start = time.perf_counter_ns()
+    gps.start()
+    gps.thread.join()
+    duration = time.perf_counter_ns() - start
+    print('Replay thread: {} crossings in {:.1f} ms. {}'.format(events.qsize(), duration / NS_PER_MS,
+                                                                 gps.stats_string()))
+    os.remove(replay_file_path)
+    os.rmdir(os.path.dirname(replay_file_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the GUI frame cost over a long session.
+# Runs the real Tk GUI with the LCD config and presses a new lap every LAP_MS for LAPS laps. The cost of each
+# gui_update (frame) and one_cb (lap) call is measured and compared between the first and the last laps. The cost
+# should stay flat over the session.
+# Needs a display (e.g. Xvfb on Linux).
+# Run with: python benchmarks/bench_gui.py [LAPS] [LAP_MS]
+
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from tkinter import TclError  # noqa: E402
+from clock import NS_PER_MS  # noqa: E402
+from regularityRallyGUI import RegularityRallyGUI  # noqa: E402
+
+LAPS = 200
+LAP_MS = 100
+WINDOW = 20
+
+
+class BenchGUI(RegularityRallyGUI):
+    # GUI, which drives itself through a session and measures its frames and laps.
+
+    def __init__(self, laps, lap_ms):
+        self.laps = laps
+        self.lap_ms = lap_ms
+        self.driving = False
+
+        # Costs (ns) by lap number.
+        self.frame_costs = []
+        self.lap_costs = []
+        super().__init__()
+
+    def gui_update(self):
+        if not self.driving:
+            self.driving = True
+            self.read_config(os.path.join(ROOT_DIR, 'config', 'LCD.cfg'))
+            self.state = 0
+            self.master.after(self.lap_ms, self.press_lap)
+
+        start = time.perf_counter_ns()
+        super().gui_update()
+        self.frame_costs.append((len(self.lap_costs), time.perf_counter_ns() - start))
+
+    def press_lap(self):
+        start = time.perf_counter_ns()
+        self.one_cb(None)
+        self.lap_costs.append(time.perf_counter_ns() - start)
+
+        if len(self.lap_costs) < self.laps:
+            self.master.after(self.lap_ms, self.press_lap)
+        else:
+            self.master.quit()
+
+    # Do not write the timing statistics of the benchmark session.
+    def write_stats(self):
+        pass
+
+
+# Get p50 and max (ms) of costs.
+def percentiles(costs):
+    costs = sorted(costs)
+    return costs[len(costs) // 2] / NS_PER_MS, costs[-1] / NS_PER_MS
+
+
+def main():
+    laps = int(sys.argv[1]) if len(sys.argv) > 1 else LAPS
+    lap_ms = int(sys.argv[2]) if len(sys.argv) > 2 else LAP_MS
+
+    try:
+        gui = BenchGUI(laps, lap_ms)
+    except TclError as err:
+        print('No display available: {}'.format(err))
+        sys.exit(1)
+
+    print('\n{} laps, {} frames'.format(len(gui.lap_costs), len(gui.frame_costs)))
+    for name, first, last in [('frame', [cost for lap, cost in gui.frame_costs if lap < WINDOW],
+                               [cost for lap, cost in gui.frame_costs if lap >= laps - WINDOW]),
+                              ('lap', gui.lap_costs[:WINDOW], gui.lap_costs[-WINDOW:])]:
+        print('{:<6} first {} laps: p50 {:.3f} ms, max {:.3f} ms   last {} laps: p50 {:.3f} ms, max {:.3f} ms'.format(
+            name, WINDOW, *percentiles(first), WINDOW, *percentiles(last)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the live delta to the set lap.
+# A car drives a set lap and a confirmation lap with another speed profile on a winding closed track of several
+# lengths. The set lap fixes (25 Hz, with position noise) are recorded as lap trace. Each fix of the confirmation lap
+# is projected onto the trace. Reported are the cost per fix of the walking search and of a NumPy scan of all
+# segments, and the error of the delta against the true time behind the set lap at the same place.
+# Run with: python benchmarks/bench_lap_trace.py [LENGTH_KM ...]
+
+import os
+import sys
+import math
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from clock import NS_PER_S, NS_PER_MS  # noqa: E402
+from lapTrace import LapTrace  # noqa: E402
+
+LENGTHS_KM = [2, 5, 20]
+FIX_NS = 40 * NS_PER_MS
+STEP_NS = 4 * NS_PER_MS
+NOISE_M = 1.0
+SEED = 1
+
+
+# Get the point of the track at an angle. Radius r of the base circle. The track winds around it.
+def track_point(r, angle):
+    radius = r * (1 + 0.15 * math.sin(5 * angle) + 0.05 * math.sin(17 * angle))
+    return radius * math.cos(angle), radius * math.sin(angle)
+
+
+# Get the speed (m/s) at a driven distance (m) of a lap. The confirmation lap is slower in the first half and faster
+# in the second half.
+def speed_at(distance, confirmation, length):
+    speed = 24 + 8 * math.sin(2 * math.pi * distance / 700)
+    if confirmation:
+        speed *= 1 - 0.1 * math.cos(2 * math.pi * distance / length)
+    return speed
+
+
+# Drive a lap of the track. Returns the fixes as (t_ns, x, y) and the driven distance by time as arrays.
+def drive_lap(r, length, confirmation, rng):
+    fixes = []
+    times = []
+    distances = []
+
+    angle = 0.0
+    distance = 0.0
+    t_ns = 0
+    while angle < 2 * math.pi:
+        x, y = track_point(r, angle)
+        times.append(t_ns)
+        distances.append(distance)
+        if t_ns % FIX_NS == 0:
+            fixes.append((t_ns, x + rng.gauss(0, NOISE_M), y + rng.gauss(0, NOISE_M)))
+
+        step = speed_at(distance, confirmation, length) * STEP_NS / NS_PER_S
+        x_1, y_1 = track_point(r, angle + 1e-6)
+        angle += step * 1e-6 / math.hypot(x_1 - x, y_1 - y)
+        distance += step
+        t_ns += STEP_NS
+
+    return fixes, np.array(times, dtype=np.int64), np.array(distances)
+
+
+# Get the length (m) of the track of base radius r.
+def track_length(r, steps=100000):
+    points = np.array([track_point(r, 2 * math.pi * step / steps) for step in range(steps + 1)])
+    return float(np.hypot(*np.diff(points, axis=0).T).sum())
+
+
+# Get the trace time (ns) at the nearest point of all segments by a NumPy scan.
+def scan_time(xs, ys, ts, x, y):
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    fraction = np.clip(((x - xs[:-1]) * dx + (y - ys[:-1]) * dy) / (dx * dx + dy * dy), 0, 1)
+    distance_2 = (xs[:-1] + fraction * dx - x) ** 2 + (ys[:-1] + fraction * dy - y) ** 2
+    segment = int(np.argmin(distance_2))
+    return ts[segment] + fraction[segment] * (ts[segment + 1] - ts[segment])
+
+
+def main():
+    lengths_km = [float(arg) for arg in sys.argv[1:]] or LENGTHS_KM
+    rng = random.Random(SEED)
+
+    print('{:>9} {:>7} {:>6}   {:>8} {:>8}   {:>10} {:>10}   {:>9}'.format(
+        'length km', 'points', 'fixes', 'walk us', 'scan us', 'err p50 ms', 'err max ms', 'delta s'))
+    for length_km in lengths_km:
+        # Base radius for the length.
+        r = 1000 * length_km / (2 * math.pi)
+        r *= 1000 * length_km / track_length(r)
+        length = 1000 * length_km
+
+        set_fixes, set_times, set_distances = drive_lap(r, length, False, rng)
+        conf_fixes, conf_times, conf_distances = drive_lap(r, length, True, rng)
+
+        trace = LapTrace()
+        for t_ns, x, y in set_fixes:
+            trace.add(x, y, t_ns)
+        trace.close()
+
+        perf_counter_ns = time.perf_counter_ns
+        deltas = []
+        start = perf_counter_ns()
+        for t_ns, x, y in conf_fixes:
+            deltas.append(trace.delta_ns(x, y, t_ns))
+        walk_ns = (perf_counter_ns() - start) / len(conf_fixes)
+
+        xs = np.frombuffer(trace.x)
+        ys = np.frombuffer(trace.y)
+        ts = np.frombuffer(trace.t_ns, dtype=np.int64)
+        scan_fixes = conf_fixes[::max(1, len(conf_fixes) // 500)]
+        start = perf_counter_ns()
+        for t_ns, x, y in scan_fixes:
+            scan_time(xs, ys, ts, x, y)
+        scan_ns = (perf_counter_ns() - start) / len(scan_fixes)
+
+        # True delta: time of the confirmation lap minus time of the set lap at the same driven distance.
+        fix_times = np.array([t_ns for t_ns, _, _ in conf_fixes])
+        true_deltas = fix_times - np.interp(np.interp(fix_times, conf_times, conf_distances), set_distances, set_times)
+        errors = np.sort(np.abs(np.array([np.nan if delta is None else delta for delta in deltas]) - true_deltas))
+        errors = errors[~np.isnan(errors)] / NS_PER_MS
+
+        print('{:9.1f} {:7} {:6}   {:8.2f} {:8.1f}   {:10.1f} {:10.1f}   {:9.2f}'.format(
+            length_km, len(trace), len(conf_fixes), walk_ns / 1000, scan_ns / 1000, errors[len(errors) // 2],
+            errors[-1], true_deltas[-1] / NS_PER_S))
+        print('          {}, {} fixes off the trace'.format(trace.stats_string(), deltas.count(None)))
+
+
+if __name__ == '__main__':
+    main()
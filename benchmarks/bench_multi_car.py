@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the multi car timing engine against independent RegularityRally instances.
+# A session of N cars (untimed, set and two confirmation laps with marks) is driven tick by tick with a virtual clock.
+# Each tick applies the presses of the tick and updates all cars: with N RegularityRally(audio=False) instances or
+# with one MultiCarTimer. The tick cost is reported for several N. Both must fire the same audio events.
+# Run with: python benchmarks/bench_multi_car.py [N ...]
+
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+import contextlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import numpy as np  # noqa: E402
+from clock import VirtualClock, NS_PER_S, NS_PER_MS  # noqa: E402
+from replay import ReplayRally  # noqa: E402
+from multiCarTimer import MultiCarTimer  # noqa: E402
+
+CARS = [1, 10, 100, 500]
+TICK_NS = 10 * NS_PER_MS
+LAP_S = 15
+STATES = '2344'
+MARK_FRACTIONS = [0.2, 0.4, 0.6, 0.8]
+SEED = 1
+
+
+# Write a config of the benchmark session and return its path.
+def session_config(directory):
+    config_file_path = os.path.join(directory, 'multi_car.cfg')
+    with open(config_file_path, 'w') as config_file:
+        config_file.write('{}\n\n[misc]\nsound_delay = 0.0\n\n[marks]\n'.format(STATES))
+        for mark_id, fraction in enumerate(MARK_FRACTIONS):
+            config_file.write('mark{} = {}\n'.format(mark_id, round(LAP_S * (1 - fraction), 1)))
+    return config_file_path
+
+
+# Generate the presses of all cars by tick: {tick: ([(car, stamp)] laps, [(car, stamp)] marks)}.
+# Each car drives its own lap time. The cars start staggered.
+def session_presses(n_cars):
+    rng = random.Random(SEED)
+    presses = {}
+    end = 0
+    for car in range(n_cars):
+        lap_ns = int((LAP_S + rng.uniform(-2, 2)) * NS_PER_S)
+        stamp = NS_PER_S + car * 7 * NS_PER_MS
+        for lap_id in range(len(STATES) + 1):
+            presses.setdefault(stamp // TICK_NS, ([], []))[0].append((car, stamp))
+            if lap_id < len(STATES) and STATES[lap_id] in '34':
+                for fraction in MARK_FRACTIONS:
+                    mark = stamp + int(lap_ns * (fraction + rng.uniform(-0.01, 0.01)))
+                    presses.setdefault(mark // TICK_NS, ([], []))[1].append((car, mark))
+            stamp += int(lap_ns * (1 + rng.uniform(-0.005, 0.005)))
+        end = max(end, stamp)
+    return presses, end // TICK_NS + 1
+
+
+# Drive N independent rallies. Returns the tick costs (ns) and the audio events as (t_ns, car, name).
+def drive_rallies(config_file_path, n_cars, presses, ticks):
+    clock = VirtualClock()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rallies = [ReplayRally(clock) for _ in range(n_cars)]
+        for rally in rallies:
+            rally.read_config(config_file_path)
+
+        costs = []
+        perf_counter_ns = time.perf_counter_ns
+        for tick in range(ticks):
+            clock.set(tick * TICK_NS)
+            start = perf_counter_ns()
+            laps, marks = presses.get(tick, ((), ()))
+            for car, stamp in laps:
+                rallies[car].reg_new_lap(time_stamp=stamp)
+            for car, stamp in marks:
+                rallies[car].mark_reached(stamp)
+            for rally in rallies:
+                rally.reg_update()
+            costs.append(perf_counter_ns() - start)
+
+    events = sorted((t_ns, car, name) for car, rally in enumerate(rallies) for t_ns, name in rally.audio_events)
+    return costs, events
+
+
+# Drive one multi car engine. Returns the tick costs (ns) and the audio events as (t_ns, car, name).
+def drive_engine(config_file_path, n_cars, presses, ticks):
+    clock = VirtualClock()
+    engine = MultiCarTimer(n_cars, config_file_path, clock)
+
+    # Presses are grouped by tick as arrays beforehand, like an input thread would collect them.
+    tick_presses = {tick: tuple((np.array([car for car, _ in group], dtype=np.int64),
+                                 np.array([stamp for _, stamp in group], dtype=np.int64)) for group in groups)
+                    for tick, groups in presses.items()}
+
+    costs = []
+    fired = []
+    perf_counter_ns = time.perf_counter_ns
+    for tick in range(ticks):
+        clock.set(tick * TICK_NS)
+        start = perf_counter_ns()
+        laps, marks = tick_presses.get(tick, (None, None))
+        if laps is not None:
+            if laps[0].size:
+                engine.new_lap(*laps)
+            if marks[0].size:
+                engine.mark_reached(*marks)
+        cars, _, kinds, payloads = engine.update()
+        costs.append(perf_counter_ns() - start)
+        if cars.size:
+            fired.append((tick * TICK_NS, cars, kinds, payloads))
+
+    events = sorted((t_ns, int(car), engine.sound_name(kind, payload))
+                    for t_ns, cars, kinds, payloads in fired for car, kind, payload in zip(cars, kinds, payloads))
+    return costs, events, engine
+
+
+# Get mean and p99 (us) of tick costs.
+def cost_string(costs):
+    costs = sorted(costs)
+    return '{:9.1f} {:9.1f}'.format(sum(costs) / len(costs) / 1000, costs[int(len(costs) * 0.99)] / 1000)
+
+
+def main():
+    cars = [int(arg) for arg in sys.argv[1:]] or CARS
+
+    directory = tempfile.mkdtemp()
+    config_file_path = session_config(directory)
+
+    print('{:>5} {:>6}   {:>19}   {:>19}   {:>7}  {}'.format('cars', 'ticks', 'rallies mean/p99 us',
+                                                            'engine mean/p99 us', 'speedup', 'events'))
+    for n_cars in cars:
+        presses, ticks = session_presses(n_cars)
+        rally_costs, rally_events = drive_rallies(config_file_path, n_cars, presses, ticks)
+        engine_costs, engine_events, engine = drive_engine(config_file_path, n_cars, presses, ticks)
+
+        check = 'equal' if engine_events == rally_events else 'DIFFERENT'
+        print('{:>5} {:>6}   {}   {}   {:6.1f}x  {} {}'.format(n_cars, ticks, cost_string(rally_costs),
+                                                              cost_string(engine_costs),
+                                                              sum(rally_costs) / sum(engine_costs),
+                                                              len(engine_events), check))
+    print(engine.stats_string())
+
+    os.remove(config_file_path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
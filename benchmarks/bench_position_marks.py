@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the position triggered marks.
+# A car drives a set lap and a confirmation lap on a circular track with GPS fixes at 25 Hz. The driver presses the
+# marks at fixed places in the set lap. In the confirmation lap the car is slow in the first half and catches up in
+# the second half. The lap is driven with a virtual clock by a RegularityRally with and without the fixes, i.e. with
+# position and with time triggered marks. Reported is the distance of the car from each mark, when its call is heard.
+# Then the cost of a fix is timed for tracks with many marks, with the grid index and with a scan of all marks.
+# Run with: python benchmarks/bench_position_marks.py [FIX_HZ]
+
+import io
+import os
+import sys
+import math
+import time
+import tempfile
+import contextlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import numpy as np  # noqa: E402
+from clock import VirtualClock, NS_PER_S, NS_PER_MS, ns_to_seconds  # noqa: E402
+from gpsInput import Fix  # noqa: E402
+from replay import ReplayRally  # noqa: E402
+from positionMarks import MarkPoint, PositionMarks  # noqa: E402
+
+RADIUS = 500.0
+TRACK_LENGTH = 2 * math.pi * RADIUS
+FIX_HZ = 25
+TICK_NS = 10 * NS_PER_MS
+STEP_NS = NS_PER_MS
+START_NS = NS_PER_S
+RECEPTION_DELAY_NS = 35 * NS_PER_MS
+MARK_FRACTIONS = [0.1, 0.2, 0.3, 0.45, 0.55, 0.7, 0.8, 0.9]
+INDEX_MARKS = [8, 100, 1000]
+
+
+# Get the speed (m/s) at a distance (m) from the start. The confirmation lap is 15 % slower in the first half and
+# 20 % faster in the second half.
+def speed_at(distance):
+    lap, position = divmod(distance, TRACK_LENGTH)
+    speed = 25 + 6 * math.sin(2 * math.pi * position / TRACK_LENGTH * 3)
+    if lap == 1:
+        speed *= 0.85 if position < TRACK_LENGTH / 2 else 1.2
+    return speed
+
+
+# Get the position (x, y) and unit driving direction at a distance (m) from the start.
+def track_point(distance):
+    angle = distance / RADIUS
+    return RADIUS * math.cos(angle), RADIUS * math.sin(angle), -math.sin(angle), math.cos(angle)
+
+
+# Drive two laps. Returns (time stamps, distances) in steps, the lap start times and the fixes.
+def drive(fix_hz):
+    fix_ns = NS_PER_S // fix_hz
+    times = []
+    distances = []
+    laps = [START_NS]
+    fixes = []
+
+    t_ns = START_NS
+    distance = 0.0
+    while len(laps) < 3:
+        times.append(t_ns)
+        distances.append(distance)
+        if t_ns % fix_ns == 0:
+            x, y, _, _ = track_point(distance)
+            fixes.append(Fix(t_ns, x, y, None, None, speed_at(distance)))
+
+        last_distance = distance
+        distance += speed_at(distance) * ns_to_seconds(STEP_NS)
+        t_ns += STEP_NS
+        if distance // TRACK_LENGTH > last_distance // TRACK_LENGTH:
+            laps.append(t_ns - STEP_NS + int(STEP_NS * (distance // TRACK_LENGTH * TRACK_LENGTH - last_distance)
+                                            / (distance - last_distance)))
+
+    return np.array(times, dtype=np.int64), np.array(distances), laps, fixes
+
+
+# Write the config of the benchmark stage and return its path. The marks are set in the set lap.
+def stage_config(directory):
+    config_file_path = os.path.join(directory, 'position_marks.cfg')
+    with open(config_file_path, 'w') as config_file:
+        config_file.write('34\n\n[misc]\nsound_delay = 0.0\n\n[marks]\n')
+        for mark_id, fraction in enumerate(MARK_FRACTIONS):
+            config_file.write('mark{} = {}\n'.format(mark_id, round(100 * (1 - fraction), 1)))
+    return config_file_path
+
+
+# Run the stage with or without fixes. Returns the mark calls as (t_ns, label) and the sound lead (ns) of each label.
+def run_stage(config_file_path, times, distances, laps, fixes, with_fixes):
+    # Button presses and fixes are handled at the first tick after they arrive.
+    inputs = [(t_ns, 0, 'lap', t_ns) for t_ns in laps]
+    for fraction in MARK_FRACTIONS:
+        inputs.append((int(np.interp(fraction * TRACK_LENGTH, distances, times)), 1, 'mark', None))
+    if with_fixes:
+        inputs += [(fix.t_ns + RECEPTION_DELAY_NS, 2, 'fix', fix) for fix in fixes]
+    inputs.sort(key=lambda item: item[:2])
+
+    clock = VirtualClock()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rally = ReplayRally(clock)
+        rally.read_config(config_file_path)
+
+        input_id = 0
+        for tick_ns in range(0, laps[-1] + TICK_NS, TICK_NS):
+            clock.set(tick_ns)
+            while input_id < len(inputs) and inputs[input_id][0] <= tick_ns:
+                t_ns, _, kind, payload = inputs[input_id]
+                if kind == 'lap':
+                    rally.reg_new_lap(time_stamp=payload)
+                elif kind == 'mark':
+                    rally.mark_reached(t_ns)
+                else:
+                    rally.gps_fix(payload)
+                input_id += 1
+            rally.reg_update()
+
+    labels = ['mark{}'.format(mark_id) for mark_id in range(len(MARK_FRACTIONS))]
+    calls = [(t_ns, name) for t_ns, name in rally.audio_events if name in labels and t_ns >= laps[1]]
+    return calls, {label: rally.sound_lead_ns(label) for label in labels}
+
+
+# Get the distance (m) of the car past each mark, when its call is heard. Negative: before the mark.
+def call_errors(calls, leads, times, distances):
+    errors = []
+    for t_ns, label in calls:
+        mark_distance = TRACK_LENGTH * (1 + MARK_FRACTIONS[int(label[4:])])
+        errors.append(float(np.interp(t_ns + leads[label], times, distances)) - mark_distance)
+    return errors
+
+
+# Time the marks reached at each fix of a lap with a given number of marks on the track. Returns (us per fix with
+# the grid index, us per fix with a scan of all marks, mean marks checked per fix with the grid index).
+def time_index(n_marks, fixes):
+    points = {}
+    for mark_id in range(n_marks):
+        lap_ns = int((mark_id + 0.5) / n_marks * 100 * NS_PER_S)
+        points['mark{}'.format(mark_id)] = MarkPoint(*track_point((mark_id + 0.5) * TRACK_LENGTH / n_marks), lap_ns)
+    lead_distance = (lambda label: 2.5)
+    curlap_ns = 100 * NS_PER_S
+
+    marks = PositionMarks(points)
+    start = time.perf_counter_ns()
+    for fix in fixes:
+        marks.reached(fix.x, fix.y, curlap_ns, lead_distance)
+    index_ns = (time.perf_counter_ns() - start) / len(fixes)
+    checked = sum(len(marks.index.near(fix.x, fix.y)) for fix in fixes) / len(fixes)
+
+    # Scan of all marks with the same gate test.
+    marks = PositionMarks(points)
+    all_points = [(label, point) for label, point in points.items()]
+    marks.index.near = (lambda x, y, distance=0.0: all_points)
+    start = time.perf_counter_ns()
+    for fix in fixes:
+        marks.reached(fix.x, fix.y, curlap_ns, lead_distance)
+    scan_ns = (time.perf_counter_ns() - start) / len(fixes)
+
+    return index_ns / 1000, scan_ns / 1000, checked
+
+
+def main():
+    fix_hz = int(sys.argv[1]) if len(sys.argv) > 1 else FIX_HZ
+
+    directory = tempfile.mkdtemp()
+    config_file_path = stage_config(directory)
+    times, distances, laps, fixes = drive(fix_hz)
+    print('Track {:.0f} m, fixes at {} Hz. Set lap {:.2f} s, confirmation lap {:.2f} s'.format(
+        TRACK_LENGTH, fix_hz, ns_to_seconds(laps[1] - laps[0]), ns_to_seconds(laps[2] - laps[1])))
+
+    print('Distance of the car past the mark when its call is heard (m):')
+    print('{:<10}'.format('mark') + ''.join('{:>8}'.format(fraction) for fraction in MARK_FRACTIONS))
+    for name, with_fixes in [('time', False), ('position', True)]:
+        calls, leads = run_stage(config_file_path, times, distances, laps, fixes, with_fixes)
+        errors = call_errors(calls, leads, times, distances)
+        print('{:<10}'.format(name) + ''.join('{:8.1f}'.format(error) for error in errors)
+              + '   max |{:.1f}| m, {} calls'.format(max(abs(error) for error in errors), len(calls)))
+
+    lap_fixes = [fix for fix in fixes if laps[1] <= fix.t_ns < laps[2]]
+    print('Cost of a fix ({} fixes):'.format(len(lap_fixes)))
+    print('{:>6} {:>10} {:>10} {:>8}'.format('marks', 'grid us', 'scan us', 'checked'))
+    for n_marks in INDEX_MARKS:
+        print('{:>6} {:10.2f} {:10.2f} {:8.1f}'.format(n_marks, *time_index(n_marks, lap_fixes)))
+
+    os.remove(config_file_path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
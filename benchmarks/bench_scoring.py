@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark of the penalty scoring.
+# Writes synthetic lap journals of many cars (set laps and confirmation laps with marks) and times loading, scoring
+# and ranking them with 1 up to the number of cores as worker processes. Some confirmation laps skip a mark press
+# anywhere in the lap. It is checked, that only the skipped marks are missed and no other mark gets the capped points.
+# Run with: python benchmarks/bench_scoring.py [CARS] [RUNS]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import lapJournal  # noqa: E402
+from clock import NS_PER_S  # noqa: E402
+from scoring import DEFAULT_RULES, score_parallel, classify  # noqa: E402
+
+CARS = 2000
+RUNS = 2
+STATES = [2, 3, 4, 4, 4, 2, 3, 4, 4, 4]
+MARKS = 8
+
+
+# Write the journal of a car with several runs of the stage. Returns the number of skipped mark presses.
+def write_journal(journal_file_path, rng):
+    records = [lapJournal.RECORD.pack(lapJournal.SESSION, lapJournal.WALL_ANCHOR.size, 0)
+               + lapJournal.WALL_ANCHOR.pack(time.time_ns())]
+    payload = b'/config/stage.cfg'
+    records.append(lapJournal.RECORD.pack(lapJournal.CONFIG, len(payload), 0) + payload)
+
+    skipped_presses = 0
+    t_ns = NS_PER_S
+    for run in range(RUNS):
+        set_time = int(rng.uniform(90, 150) * NS_PER_S)
+        # Marks spread over the lap, at least a few seconds apart.
+        set_marks = [int((mark_id + rng.uniform(0.75, 1.25)) * set_time / (MARKS + 1)) for mark_id in range(MARKS)]
+        for state in STATES:
+            records.append(lapJournal.RECORD.pack(lapJournal.LAP, state, t_ns))
+            lap_time = set_time + (int(rng.gauss(0, 0.5) * NS_PER_S) if state == 4 else 0)
+            if state in (3, 4):
+                # Some missed mark presses anywhere in the confirmation laps.
+                skipped = rng.randrange(MARKS) if state == 4 and rng.random() < 0.1 else None
+                skipped_presses += skipped is not None
+                for mark in [mark for mark_id, mark in enumerate(set_marks) if mark_id != skipped]:
+                    deviation = int(rng.gauss(0, 0.3) * NS_PER_S) if state == 4 else 0
+                    records.append(lapJournal.RECORD.pack(lapJournal.MARK, 0, t_ns + mark + deviation))
+            t_ns += lap_time
+        records.append(lapJournal.RECORD.pack(lapJournal.LAP, 1, t_ns))
+        records.append(lapJournal.RECORD.pack(lapJournal.RESET, 0, t_ns + NS_PER_S))
+        t_ns += 10 * NS_PER_S
+
+    with open(journal_file_path, 'wb') as journal_file:
+        journal_file.write(b''.join(records))
+    return skipped_presses
+
+
+def main():
+    cars = int(sys.argv[1]) if len(sys.argv) > 1 else CARS
+
+    directory = tempfile.mkdtemp()
+    rng = random.Random(1)
+    skipped_presses = sum(write_journal(os.path.join(directory, 'car{:05d}.rlj'.format(car)), rng)
+                          for car in range(cars))
+
+    laps = cars * RUNS * STATES.count(4)
+    print('{} cars, {} confirmation laps x {} marks'.format(cars, laps, MARKS))
+
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        classification = classify(score_parallel([directory], DEFAULT_RULES, workers))
+        duration = time.perf_counter() - start
+        print('{:>3} workers: {:8.1f} ms ({:.1f} us per lap), winner {} with {:.0f} points'.format(
+            workers, duration * 1000, duration * 1e6 / laps, classification[0][1].car, classification[0][1].points))
+
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(2 * workers, os.cpu_count())
+
+    shutil.rmtree(directory)
+
+    # The deviations of the pressed marks are far below the cap. Capped points are only given for missed marks.
+    missed = sum(score.missed for _, score in classification)
+    capped = sum(int((details[:, :-1] >= DEFAULT_RULES.cap).sum()) for _, score in classification
+                 for details in score.details)
+    print('Skipped presses: {}, missed marks: {}, marks with capped points: {}'.format(skipped_presses, missed, capped))
+    if not skipped_presses == missed == capped:
+        raise RuntimeError('Mark passages matched to the wrong set marks.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Cold start benchmark of the LCD frontend.
+# Starts a fresh interpreter, which builds RegularityRallyLCD on the GPIO simulation without mainloop, and measures
+# from process start until the timer is ready to time and until the sounds are loaded. The time of an empty
+# interpreter start is given for reference. First the frontend is started once in debug mode (console and keys instead
+# of LCD and buttons) as a check, that this start still works.
+# Target on the Pi: ready to time in < 300 ms after interpreter start.
+# Run with: python benchmarks/bench_startup.py [RUNS]
+
+import os
+import sys
+import time
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNS = 5
+TARGET_MS = 300
+
+CHILD = """
+import sys
+sys.path.insert(0, {src!r})
+import RegularityRallyLCD
+RegularityRallyLCD.debug = {debug!r}
+lcd = RegularityRallyLCD.RegularityRallyLCD(config_file={config!r}, run=False)
+print('\\nREADY', flush=True)
+lcd.wait_audio()
+print('AUDIO', flush=True)
+lcd.stop_journal()
+"""
+
+
+# Write the LCD config with a journal in the temporary directory and return its path.
+def lcd_config(directory):
+    config_file_path = os.path.join(directory, 'LCD.cfg')
+    with open(os.path.join(ROOT_DIR, 'config', 'LCD.cfg')) as source:
+        text = source.read()
+    with open(config_file_path, 'w') as config_file:
+        config_file.write(text.replace('[misc]', '[misc]\njournal_file = {}'.format(os.path.join(directory,
+                                                                                               'journal.rlj'))))
+    return config_file_path
+
+
+# Run a child interpreter. Returns the times (ms) from start until each marker line.
+def run_child(code, env):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               env=env, universal_newlines=True)
+    times = {}
+    for line in process.stdout:
+        if line.strip() in ('READY', 'AUDIO'):
+            times[line.strip()] = (time.perf_counter() - start) * 1000
+    process.wait()
+    times['EXIT'] = (time.perf_counter() - start) * 1000
+    return times
+
+
+# Start the frontend once in debug mode. Raises RuntimeError with the error output, if it does not get ready.
+def check_debug_start(config_file_path, env):
+    code = CHILD.format(src=os.path.join(ROOT_DIR, 'src'), config=config_file_path, debug=True)
+    process = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             env=dict(env, SDL_VIDEODRIVER='dummy'), universal_newlines=True)
+    if 'READY' not in process.stdout.split():
+        raise RuntimeError('Start in debug mode failed:\n{}'.format(process.stderr))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, GPIO_SIM='1', SDL_AUDIODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    config_file_path = lcd_config(directory)
+    code = CHILD.format(src=os.path.join(ROOT_DIR, 'src'), config=config_file_path, debug=False)
+
+    check_debug_start(config_file_path, env)
+    print('Start in debug mode: ok')
+
+    empty = [run_child('pass', env)['EXIT'] for _ in range(runs)]
+    results = []
+    for _ in range(runs):
+        # Start without journal, like after a clean shutdown.
+        if os.path.isfile(os.path.join(directory, 'journal.rlj')):
+            os.remove(os.path.join(directory, 'journal.rlj'))
+        results.append(run_child(code, env))
+    shutil.rmtree(directory)
+
+    ready = statistics.median(result['READY'] for result in results)
+    audio = statistics.median(result['AUDIO'] for result in results)
+    print('Median of {} runs:'.format(runs))
+    print('  empty interpreter:  {:7.1f} ms'.format(statistics.median(empty)))
+    print('  ready to time:      {:7.1f} ms (target on the Pi: {} ms)'.format(ready, TARGET_MS))
+    print('  sounds loaded:      {:7.1f} ms'.format(audio))
+
+
+if __name__ == '__main__':
+    main()
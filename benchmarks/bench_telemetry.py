@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Load test of the telemetry publisher.
+# 100 local WebSocket subscribers are connected from a child process (the load test client): most read all frames,
+# some are slow (small receive buffer, 33 frames/s) and one is dead (never reads). A UDP receiver listens on the
+# loopback interface. The timing loop runs a RegularityRally at 1 ms ticks without and with the publisher, then posts
+# a state changing on each tick (up to 1000 frames/s) as stress. Reported are the cost of reg_update / publish and the
+# lateness of the ticks, the frames received by the subscribers and whether they rebuilt the published state.
+# Run with: python benchmarks/bench_telemetry.py [SUBSCRIBERS] [SECONDS]
+# Load test client only: python benchmarks/bench_telemetry.py --client PORT [SUBSCRIBERS]. Connects the subscribers,
+# prints CONNECTED and, when stdin is closed, the results as JSON.
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import threading
+import contextlib
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from clock import Clock, NS_PER_S, NS_PER_MS  # noqa: E402
+from regularityRally import RegularityRally  # noqa: E402
+from telemetry import TelemetryPublisher, WS_PING, WS_PONG, apply_frame, read_ws_frame, ws_accept  # noqa: E402
+
+SUBSCRIBERS = 100
+SLOW = 9
+DEAD = 1
+SECONDS = 3.0
+SLOW_FRAME_S = 0.03
+TICK_NS = NS_PER_MS
+HOST = '127.0.0.1'
+
+
+# Get a WebSocket frame from a client to the server. Client frames are masked.
+def client_frame(payload, opcode):
+    mask = os.urandom(4)
+    return bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + bytes(byte ^ mask[i % 4]
+                                                                     for i, byte in enumerate(payload))
+
+
+# Get a free local port.
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+class Subscribers(object):
+    # WebSocket subscribers of the load test client.
+
+    def __init__(self, port, n_subscribers):
+        self.port = port
+        self.kinds = ['dead'] * DEAD + ['slow'] * SLOW + ['normal'] * (n_subscribers - DEAD - SLOW)
+
+        # Per subscriber: kind, rebuilt state, frames, sequence gaps, key frames.
+        self.results = [{'kind': kind, 'state': {}, 'frames': 0, 'gaps': 0, 'keys': 0} for kind in self.kinds]
+        self.stop_event = None
+
+    # Connect all subscribers and run them until stdin is closed.
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        tasks = [loop.create_task(self.subscribe(result)) for result in self.results]
+        while sum(result.get('connected', False) for result in self.results) < len(self.results):
+            await asyncio.sleep(0.01)
+        print('CONNECTED', flush=True)
+
+        await loop.run_in_executor(None, sys.stdin.read)
+        self.stop_event.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def subscribe(self, result):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if result['kind'] != 'normal':
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, (HOST, self.port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write('GET / HTTP/1.1\r\nHost: {}:{}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n'.format(HOST, self.port, key).encode())
+        response = (await reader.readuntil(b'\r\n\r\n')).decode()
+        if not response.startswith('HTTP/1.1 101') or ws_accept(key) not in response:
+            raise RuntimeError('Handshake failed: {}'.format(response))
+        result['connected'] = True
+
+        if result['kind'] == 'dead':
+            await self.stop_event.wait()
+            return
+
+        try:
+            last_seq = None
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                if opcode == WS_PING:
+                    writer.write(client_frame(payload, WS_PONG))
+                    continue
+                frame = json.loads(payload)
+                result['frames'] += 1
+                if frame.get('k'):
+                    result['keys'] += 1
+                elif last_seq is not None and frame['q'] != last_seq + 1:
+                    result['gaps'] += 1
+                last_seq = frame['q']
+                result['state'] = apply_frame(result['state'], frame)
+                if result['kind'] == 'slow':
+                    await asyncio.sleep(SLOW_FRAME_S)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            result['closed'] = True
+        finally:
+            writer.close()
+
+
+# Receive UDP frames in a thread until the stop event is set. Returns the thread and its result.
+def udp_receiver(udp_socket, stop_event):
+    result = {'state': {}, 'frames': 0, 'gaps': 0}
+    udp_socket.settimeout(0.1)
+
+    def run():
+        last_seq = None
+        while not stop_event.is_set():
+            try:
+                payload = udp_socket.recv(65536)
+            except socket.timeout:
+                continue
+            frame = json.loads(payload)
+            result['frames'] += 1
+            if not frame.get('k') and last_seq is not None and frame['q'] != last_seq + 1:
+                result['gaps'] += 1
+            last_seq = frame['q']
+            result['state'] = apply_frame(result['state'], frame)
+
+    thread = threading.Thread(target=run, name='UdpReceiver', daemon=True)
+    thread.start()
+    return thread, result
+
+
+# Run the timing loop for a duration. step(tick) is called on each tick. Returns (step costs, tick lateness) in ns.
+def timing_loop(clock, seconds, step):
+    costs = []
+    lateness = []
+    start_ns = clock.now()
+    for tick in range(int(seconds * NS_PER_S // TICK_NS)):
+        deadline = start_ns + (tick + 1) * TICK_NS
+        delay = deadline - clock.now()
+        if delay > 0:
+            time.sleep(delay / NS_PER_S)
+        begin = clock.now()
+        lateness.append(begin - deadline)
+        step(tick)
+        costs.append(clock.now() - begin)
+    return costs, lateness
+
+
+# Get mean, p99 and max (us) of ns values.
+def us_string(values):
+    values = sorted(values)
+    return '{:8.1f} {:8.1f} {:9.1f}'.format(sum(values) / len(values) / 1000, values[int(len(values) * 0.99)] / 1000,
+                                            values[-1] / 1000)
+
+
+# Run the load test client.
+def client(port, n_subscribers):
+    subscribers = Subscribers(port, n_subscribers)
+    asyncio.run(subscribers.run())
+    print(json.dumps(subscribers.results))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--client':
+        client(int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else SUBSCRIBERS)
+        return
+
+    n_subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIBERS
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else SECONDS
+
+    clock = Clock()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rally = RegularityRally(clock, audio=False)
+        rally.read_config(os.path.join(ROOT_DIR, 'config', 'LCD.cfg'))
+    rally.state = 0
+
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.bind((HOST, 0))
+    udp_stop = threading.Event()
+    udp_thread, udp_result = udp_receiver(udp_socket, udp_stop)
+
+    ws_port = free_port()
+    telemetry = TelemetryPublisher(HOST, udp_socket.getsockname()[1], ws_port, host=HOST)
+    telemetry.PING_TIMEOUT = 3.0
+    telemetry.start()
+
+    subscribers = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--client', str(ws_port),
+                                    str(n_subscribers)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    if subscribers.stdout.readline().strip() != 'CONNECTED':
+        raise RuntimeError('Load test client failed.')
+
+    # Rally with laps and marks. One press every 2 s.
+    def rally_step(tick):
+        if tick % 2000 == 0:
+            with contextlib.redirect_stdout(io.StringIO()):
+                rally.reg_new_lap()
+        elif tick % 2000 == 1000 and rally.state in (3, 4):
+            rally.mark_reached()
+        rally.reg_update()
+
+    # Stress: a state changing on each tick.
+    def stress_step(tick):
+        state = rally.telemetry_state()
+        state['t'] = tick
+        telemetry.publish(state)
+
+    print('{} subscribers ({} slow, {} dead), {:.1f} s per phase, 1 ms ticks'.format(n_subscribers, SLOW, DEAD,
+                                                                                     seconds))
+    print('{:<28} {:>26}   {:>26}'.format('phase', 'step mean/p99/max us', 'lateness mean/p99/max us'))
+    for name, attach, step in [('rally without telemetry', False, rally_step),
+                               ('rally with telemetry', True, rally_step),
+                               ('stress 1000 frames/s', True, stress_step)]:
+        rally.telemetry = telemetry if attach else None
+        frames = telemetry.frames
+        costs, lateness = timing_loop(clock, seconds, step)
+        print('{:<28} {}   {}   {:.0f} frames/s'.format(name, us_string(costs), us_string(lateness),
+                                                        (telemetry.frames - frames) / seconds))
+
+    # Let the slow subscribers catch up and the key frame repair them. The dead subscriber is dropped by then.
+    rally.telemetry = None
+    time.sleep(telemetry.PING_TIMEOUT)
+    sent = telemetry.sent
+    results = json.loads(subscribers.communicate()[0])
+    telemetry.stop()
+    udp_stop.set()
+    udp_thread.join()
+    udp_socket.close()
+
+    print(telemetry.stats_string())
+    for kind in ('normal', 'slow', 'dead'):
+        results_of_kind = [result for result in results if result['kind'] == kind]
+        if results_of_kind:
+            n = len(results_of_kind)
+            print('{:<7} {:>3} subscribers: {:>7.0f} frames, {:>5.1f} gaps, {:>4.1f} key frames on average, '
+                  '{}/{} rebuilt the state'.format(kind, n, sum(result['frames'] for result in results_of_kind) / n,
+                                                   sum(result['gaps'] for result in results_of_kind) / n,
+                                                   sum(result['keys'] for result in results_of_kind) / n,
+                                                   sum(result['state'] == sent for result in results_of_kind), n))
+    print('UDP receiver: {} frames, {} gaps, state rebuilt: {}'.format(udp_result['frames'], udp_result['gaps'],
+                                                                       udp_result['state'] == sent))
+
+
+if __name__ == '__main__':
+    main()
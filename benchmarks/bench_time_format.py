@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Micro benchmark of the display time formatting.
+# Compares the old path (decode_seconds + str.format) with the cached integer formatter for the lap time, reference
+# time and countdown of one display update. The lap advances 10 ms per update.
+# Run with: python benchmarks/bench_time_format.py
+
+import os
+import sys
+import time
+from math import floor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from clock import NS_PER_S, ns_to_seconds  # noqa: E402
+from util import decode_seconds  # noqa: E402
+from timeFormat import CachedFormat, format_mm_ss_t, format_countdown  # noqa: E402
+
+UPDATES = 100000
+STEP_NS = NS_PER_S // 100
+SET_TIME_NS = 123456789012
+
+
+def old_path(updates):
+    set_decoded = decode_seconds(ns_to_seconds(SET_TIME_NS))
+    for update in range(updates):
+        curlap_ns = update * STEP_NS
+        curlap_decoded = decode_seconds(ns_to_seconds(curlap_ns))
+        '{:02}:{:02}.{:01}'.format(curlap_decoded[1], curlap_decoded[2], floor(curlap_decoded[3] / 100))
+        '{:02}:{:02}.{:01}'.format(set_decoded[1], set_decoded[2], floor(set_decoded[3] / 100))
+        '{:04.1f}'.format(ns_to_seconds(SET_TIME_NS - curlap_ns))
+
+
+def new_path(updates):
+    format_lap = CachedFormat(format_mm_ss_t)
+    format_ref = CachedFormat(format_mm_ss_t)
+    format_cd = CachedFormat(format_countdown, rounded=True)
+    for update in range(updates):
+        curlap_ns = update * STEP_NS
+        format_lap(curlap_ns)
+        format_ref(SET_TIME_NS)
+        format_cd(SET_TIME_NS - curlap_ns)
+
+
+# Get the time per update in ns.
+def measure(path):
+    start = time.perf_counter_ns()
+    path(UPDATES)
+    return (time.perf_counter_ns() - start) / UPDATES
+
+
+# Get the number of strings built by the cached formatter in the benchmark.
+# The old path builds three strings per update.
+def new_path_strings(updates):
+    built = [0]
+
+    def counted(format_units):
+        def wrapper(units):
+            built[0] += 1
+            return format_units(units)
+        return wrapper
+
+    format_lap = CachedFormat(counted(format_mm_ss_t))
+    format_ref = CachedFormat(counted(format_mm_ss_t))
+    format_cd = CachedFormat(counted(format_countdown), rounded=True)
+    for update in range(updates):
+        curlap_ns = update * STEP_NS
+        format_lap(curlap_ns)
+        format_ref(SET_TIME_NS)
+        format_cd(SET_TIME_NS - curlap_ns)
+
+    return built[0]
+
+
+def main():
+    print('{:<24} {:8.1f} ns/update, {} strings built'.format('decode_seconds + format', measure(old_path),
+                                                              3 * UPDATES))
+    print('{:<24} {:8.1f} ns/update, {} strings built'.format('CachedFormat', measure(new_path),
+                                                              new_path_strings(UPDATES)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Benchmark suite for the timing, rendering and config hot paths.
+# Runs on a plain Linux box: RPi.GPIO is replaced by the GPIO simulation with an emulated LCD, time.sleep of the LCD
+# module is recorded instead of slept and pygame uses the dummy audio driver.
+# Every call is timed on its own and reported as latency percentiles. Results can be saved as JSON baseline and
+# compared to a saved baseline, so regressions between versions show up.
+#
+# Usage: python benchmarks/run_benchmarks.py [--calls N] [--save FILE] [--compare FILE] [--tolerance 0.2]
+#                                    [--min-delta 500]
+
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import platform
+import tempfile
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+CALLS_DEFAULT = 2000
+LARGE_MARKS = 1000
+PERCENTILES = [50, 90, 99]
+ROUNDS = 5
+
+
+class SleepRecorder(object):
+    # Replacement of the time module of the LCD module. Sleeps are summed up instead of slept.
+    # Its perf_counter_ns runs ahead of the real clock by the recorded sleeps. It is also the clock of the emulated LCD,
+    # so the LCD sees the timing of the real bus in both LCD modes.
+
+    def __init__(self):
+        self.slept_ns = 0
+
+    def sleep(self, seconds):
+        self.slept_ns += seconds_to_ns(seconds)
+
+    def perf_counter_ns(self):
+        return time.perf_counter_ns() + self.slept_ns
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+# Use the GPIO simulation with the emulated LCD in the LCD module.
+os.environ['GPIO_SIM'] = '1'
+
+import gpioSim as GPIO  # noqa: E402
+import RegularityRallyLCD as lcd_module  # noqa: E402
+from util import decode_seconds  # noqa: E402
+from raceTimer import RaceTimer  # noqa: E402
+from regularityRally import RegularityRally  # noqa: E402
+from clock import Clock, NS_PER_S, NS_PER_MS, seconds_to_ns  # noqa: E402
+
+SLEEP = SleepRecorder()
+GPIO.clock = Clock(SLEEP.perf_counter_ns)
+lcd_module.time = SLEEP
+
+
+# Time each call on its own. Returns the latencies in ns.
+def measure(func, calls):
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(calls):
+        start = perf_counter_ns()
+        func()
+        latencies.append(perf_counter_ns() - start)
+    return latencies
+
+
+# Measure in several rounds after a warm up. Returns the statistics of the round with the lowest p50, which is the
+# least disturbed by other load on the machine.
+def bench(func, calls):
+    measure(func, max(calls // 10, 1))
+    return min([summarize(measure(func, calls)) for _ in range(ROUNDS)], key=lambda result: result['p50_ns'])
+
+
+# Get the latency statistics in ns.
+def summarize(latencies):
+    latencies = sorted(latencies)
+    result = {'calls': len(latencies),
+              'mean_ns': sum(latencies) / len(latencies),
+              'max_ns': latencies[-1]}
+    for pc in PERCENTILES:
+        result['p{}_ns'.format(pc)] = latencies[min(len(latencies) - 1, len(latencies) * pc // 100)]
+    return result
+
+
+# Bring a timer into a state by laps with time stamps in the past.
+# State 4 starts a confirmation lap 1 s ago with a set lap of 199 s, so no event fires during the benchmark.
+def enter_state(rally, state):
+    now = rally.clock.now()
+    if state == 1:
+        rally.config['states'] = []
+        rally.reg_new_lap(time_stamp=now - NS_PER_S)
+    elif state >= 2:
+        laps = {2: [300], 3: [300, 200], 4: [300, 200, 1]}[state]
+        for lap_ago in laps:
+            rally.reg_new_lap(time_stamp=now - lap_ago * NS_PER_S)
+    rally.reg_update()
+
+
+# Write a config with many marks and return its path.
+def large_config(directory, n_marks):
+    config_file_path = os.path.join(directory, 'large.cfg')
+    with open(config_file_path, 'w') as config_file:
+        config_file.write('2344223442\n\n[misc]\nsound_delay = 0.0\n\n[marks]\n')
+        for mark_id in range(n_marks):
+            config_file.write('mark{} = {}\n'.format(mark_id, n_marks - mark_id))
+    return config_file_path
+
+
+# Write the LCD config with a journal in the temporary directory and return its path.
+def lcd_config(directory):
+    config_file_path = os.path.join(directory, 'LCD.cfg')
+    with open(os.path.join(ROOT_DIR, 'config', 'LCD.cfg')) as source:
+        text = source.read()
+    with open(config_file_path, 'w') as config_file:
+        config_file.write(text.replace('[misc]', '[misc]\njournal_file = {}'.format(os.path.join(directory,
+                                                                                               'journal.rlj'))))
+    return config_file_path
+
+
+# Run all benchmarks. Returns the results by name.
+def run(calls):
+    results = {}
+    directory = tempfile.mkdtemp()
+
+    # util.decode_seconds.
+    values = [random.uniform(0, 7200) for _ in range(calls)]
+    values_iter = itertools.cycle(values)
+    results['util.decode_seconds'] = bench(lambda: decode_seconds(next(values_iter)), calls)
+
+    # RaceTimer.update in a running lap.
+    timer = RaceTimer()
+    timer.new_lap()
+    timer.state = 1
+    results['RaceTimer.update'] = bench(timer.update, calls)
+
+    # RegularityRally.reg_update in each state.
+    for state in range(5):
+        rally = RegularityRally(audio=False)
+        rally.read_config(os.path.join(ROOT_DIR, 'config', 'LCD.cfg'))
+        rally.state = 0
+        enter_state(rally, state)
+        results['RegularityRally.reg_update state {}'.format(state)] = bench(rally.reg_update, calls)
+
+    # read_config with a large mark list. Without audio, so only parsing is measured.
+    rally = RegularityRally(audio=False)
+    config_file_path = large_config(directory, LARGE_MARKS)
+    results['RegularityRally.read_config {} marks'.format(LARGE_MARKS)] = bench(
+        lambda: rally.read_config(config_file_path), max(calls // 20, 10))
+
+    # LCD frontend without mainloop.
+    lcd = lcd_module.RegularityRallyLCD(config_file=lcd_config(directory), run=False)
+    enter_state(lcd, 4)
+    results['RegularityRallyLCD.update_display_string state 4'] = bench(lcd.update_display_string, calls)
+
+    # LCD bus. GPIO writes, sleep time and bus time of the emulated LCD of one call are added to the results.
+    # A display frame is measured in both LCD modes. Its frame time includes the recorded sleeps.
+    frames = itertools.cycle([['00:12.3  01:40.2', '87.9  4 C start '], ['00:12.4  01:40.2', '87.8  4 C start ']])
+
+    def print_frame():
+        lcd.display_string = next(frames)
+        lcd.print_display()
+
+    benchmarks = [('classic', 'RegularityRallyLCD.lcd_send_byte', lambda: lcd.lcd_send_byte(0x41, GPIO.HIGH)),
+                  ('fast', 'RegularityRallyLCD.lcd_send_byte_fast', lambda: lcd.lcd_send_byte_fast(0x41, GPIO.HIGH)),
+                  ('classic', 'RegularityRallyLCD.lcd_message', lambda: lcd.lcd_message('00:00.0  00:00.0')),
+                  ('classic', 'RegularityRallyLCD.print_display classic', print_frame),
+                  ('fast', 'RegularityRallyLCD.print_display fast', print_frame)]
+    for lcd_mode, name, func in benchmarks:
+        lcd.set_lcd_mode(lcd_mode)
+        result = bench(func, calls)
+
+        GPIO.writes = 0
+        slept_ns = SLEEP.slept_ns
+        lcd.lcd_sim.reset_stats()
+        func()
+        result['gpio_writes_per_call'] = GPIO.writes
+        result['sleep_s_per_call'] = (SLEEP.slept_ns - slept_ns) / NS_PER_S
+        result['bus_ns_per_call'] = lcd.lcd_sim.bus_ns
+        result['busy_violations'] = lcd.lcd_sim.busy_violations
+        result['frame_ns'] = result['p50_ns'] + SLEEP.slept_ns - slept_ns
+        results[name] = result
+
+    # The emulated LCD must show the last frame.
+    if lcd.lcd_sim.lines() != lcd.display_string:
+        print('Emulated LCD shows {} instead of {}.'.format(lcd.lcd_sim.lines(), lcd.display_string))
+
+    lcd.stop_journal()
+    return results
+
+
+# Print the frame time speedup of the fast LCD mode.
+def print_speedup(results):
+    classic = results['RegularityRallyLCD.print_display classic']['frame_ns']
+    fast = results['RegularityRallyLCD.print_display fast']['frame_ns']
+    print('\nDisplay frame: classic {:.2f} ms, fast {:.2f} ms, speedup {:.1f}x'.format(classic / NS_PER_MS,
+                                                                                       fast / NS_PER_MS,
+                                                                                       classic / fast))
+
+
+# Compare results to a baseline. Returns the names of regressed benchmarks.
+# A benchmark regressed, if its p50 grew by more than the relative tolerance and more than min_delta_ns. The absolute
+# limit keeps sub-microsecond benchmarks, which are dominated by timer noise, from failing the comparison.
+def compare(results, baseline, tolerance, min_delta_ns):
+    regressions = []
+    print('\nComparison to baseline (p50):')
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        base_p50 = baseline['results'][name]['p50_ns']
+        ratio = result['p50_ns'] / max(base_p50, 1)
+        regressed = ratio > 1 + tolerance and result['p50_ns'] - base_p50 > min_delta_ns
+        if regressed:
+            regressions.append(name)
+        print('{:<55} {:6.2f}x {}'.format(name, ratio, 'REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the regularity rally timer.')
+    parser.add_argument('--calls', type=int, default=CALLS_DEFAULT, help='Calls per benchmark.')
+    parser.add_argument('--save', help='Save the results as baseline JSON (e.g. benchmarks/baseline.json).')
+    parser.add_argument('--compare', help='Compare the results to a baseline JSON.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative p50 increase.')
+    parser.add_argument('--min-delta', type=int, default=500, help='Allowed absolute p50 increase (ns).')
+    args = parser.parse_args()
+
+    results = run(args.calls)
+
+    print('\n{:<55} {:>10} {:>10} {:>10} {:>10}'.format('benchmark', 'p50 us', 'p90 us', 'p99 us', 'max us'))
+    for name, result in results.items():
+        print('{:<55} {:10.2f} {:10.2f} {:10.2f} {:10.2f}'.format(name, result['p50_ns'] / 1000,
+                                                                  result['p90_ns'] / 1000,
+                                                                  result['p99_ns'] / 1000,
+                                                                  result['max_ns'] / 1000))
+        if 'gpio_writes_per_call' in result:
+            print('{:<55} {} GPIO writes, {:.2f} ms sleep, {:.2f} ms bus time, {} busy violations per call'.format(
+                '',
+                result['gpio_writes_per_call'],
+                result['sleep_s_per_call'] * 1000,
+                result['bus_ns_per_call'] / NS_PER_MS,
+                result['busy_violations']))
+
+    print_speedup(results)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({'meta': {'python': platform.python_version(),
+                                'machine': platform.machine(),
+                                'platform': platform.platform(),
+                                'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+                       'results': results}, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance, args.min_delta)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
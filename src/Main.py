@@ -2,15 +2,18 @@
 # -*- coding: UTF-8 -*-
 
 import keyboard
-import time
 import sys
 
 from raceTimer import RaceTimer
+from tickScheduler import TickScheduler
 
 write = sys.stdout.write
 
 rt = RaceTimer()
 
+# Wake up at the next displayed time change, but poll the keyboard at least every 0.15 s.
+scheduler = TickScheduler(rt.clock, max_interval=0.15)
+
 while True:
     if keyboard.is_pressed('1'):
         print('Debug update.')
@@ -35,6 +38,6 @@ while True:
                                                int(rt.curlap_decoded[3]))
               , end='\r')
 
-    time.sleep(0.15)
+    scheduler.sleep_until(rt.next_deadline_ns())
 
 # rt.read_config(r'..\config\GLP_norm.cfg')
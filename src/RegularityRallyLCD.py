@@ -3,17 +3,26 @@
 
 import os
 import time
-import pygame
 import configparser
-from datetime import datetime, timedelta
-from math import floor
 
 from regularityRally import RegularityRally
+from util import changed_runs
+from lcdDisplay import LcdDisplay
+from buttonInput import ButtonInput
+from tickScheduler import TickScheduler
+from instrumentation import Instrumentation
+from lcdWriter import LcdWriter
+from gpsInput import GpsInput
+from telemetry import TelemetryPublisher
 
 # Try to import raspberry pi packages.
+# With the environment variable GPIO_SIM, the GPIO simulation with an emulated LCD is used instead.
 try:
-    # noinspection PyUnresolvedReferences
-    import RPi.GPIO as GPIO
+    if os.environ.get('GPIO_SIM'):
+        import gpioSim as GPIO
+    else:
+        # noinspection PyUnresolvedReferences
+        import RPi.GPIO as GPIO
 
     debug = False
 except ImportError:
@@ -23,25 +32,56 @@ except ImportError:
 
 class RegularityRallyLCD(RegularityRally):
     # Chars for state display.
-    STATES = {-1: 'o',  # No config (should not appear).
-              0: 'x',  # Ready
-              1: '*',  # Sprint Lap
-              2: 'U',  # Untimed Lap
-              3: 'S',  # Set Lap
-              4: 'C'}  # Confirmation Lap
+    STATES = LcdDisplay.STATES
 
     BUTTON_DEBOUNCE_TIME_DEFAULT = 0.5  # s
-
-    def __init__(self, no_button=False):
+    MAX_TICK_INTERVAL = 0.5  # s
+
+    # LCD transmission modes.
+    # classic: single pin writes and sleeps of e_pulse / e_delay around each enable pulse.
+    # fast: one multi-channel write per nibble and busy-wait pulses sized to the controller timing.
+    LCD_MODE_DEFAULT = 'classic'
+    LCD_E_PULSE_US_DEFAULT = 1
+    LCD_EXEC_US_DEFAULT = 50
+    LCD_CLEAR_US_DEFAULT = 2000
+
+    # config_file: config to read instead of config/LCD.cfg.
+    # run: enter the mainloop. Without, the instance is only initialized (e.g. for benchmarks).
+    def __init__(self, no_button=False, config_file=None, run=True):
         super().__init__()
 
         # Init variables.
         self.display_string = ['--:--.-  --:--.-', '--.- -- - ------']
 
+        # Composer of the display lines.
+        self.lcd_display = LcdDisplay()
+
+        # Shadow of the lines currently shown on the LCD. None if unknown.
+        self.lcd_shadow = [None, None]
+
         self.no_button = no_button
+        self.buttons = None
+
+        # GPS lap detection. Only with the button input, whose event queue takes the finish line crossings.
+        self.gps = None
+
+        # Emulated LCD of the GPIO simulation.
+        self.lcd_sim = None
+
+        # Writer thread of the LCD. Started with the mainloop.
+        self.lcd_writer = None
 
-        # Init time for debounce to a date in the past.
-        self.time_last_press = datetime(2021, 1, 1, 0, 0, 0, 0)
+        # Byte transmission of the selected LCD mode. Set by set_lcd_mode().
+        self.lcd_send = self.lcd_send_byte
+        self.lcd_channels = None
+        self.lcd_nibble_levels = None
+        self.lcd_ready_ns = 0
+
+        # Scheduler for display updates and audio deadlines.
+        self.scheduler = TickScheduler(self.clock, self.MAX_TICK_INTERVAL)
+
+        # GPIO config. Empty in debug mode.
+        self.gpio = {}
 
         # Actions specific for debug or no debug mode.
         if debug:
@@ -49,35 +89,101 @@ class RegularityRallyLCD(RegularityRally):
             print('{} - {}'.format(self.display_string[0], self.display_string[1]), end='')
         else:
             # Read gpio config.
-            self.gpio = {}
             self.read_gpio_cfg()
 
             # Init LCD config.
             self.lcd_init()
+            self.set_lcd_mode(self.gpio.get('lcd_mode', self.LCD_MODE_DEFAULT))
+            self.lcd_writer = LcdWriter(self.write_frame)
 
+        # Keys are read with pygame. Only its display is initialized, the mixer is initialized by the audio loader.
         if debug or self.no_button:
-            pygame.init()
+            import pygame
+            pygame.display.init()
             pygame.display.set_mode((100, 100))
 
         # Read config.
-        self.read_config(os.path.join(self.config_dir, 'LCD.cfg'))
+        self.read_config(config_file if config_file is not None else os.path.join(self.config_dir, 'LCD.cfg'))
         self.state = 0
 
+        # Swap in changes of the config between laps.
+        if run:
+            self.watch_config()
+
         # Set button debounce time.
         self.button_debounce_time = float(self.config['misc'].get('button_debounce_time',
                                                                   self.BUTTON_DEBOUNCE_TIME_DEFAULT))
 
+        # Start edge triggered button input.
+        if not debug and not self.no_button:
+            self.buttons = ButtonInput(GPIO,
+                                       {1: self.gpio['button_1'],
+                                        2: self.gpio['button_2'],
+                                        3: self.gpio['button_3']},
+                                       self.clock,
+                                       self.button_debounce_time)
+            self.buttons.start()
+
+            # Start the GPS lap detection and position triggered marks, if a receiver (or an NMEA replay file) is
+            # configured.
+            if self.gpio.get('gps_device'):
+                self.gps = GpsInput(self.gpio['gps_device'],
+                                    self.clock,
+                                    self.buttons.events,
+                                    self.gpio.get('gps_baudrate', GpsInput.BAUDRATE_DEFAULT),
+                                    fixes=True)
+                self.gps.set_finish_line(self.finish_line_coordinates)
+                self.gps.start()
+
+        # Start the telemetry broadcast, if configured.
+        if self.gpio.get('telemetry_group') or self.gpio.get('telemetry_ws_port'):
+            udp_port = self.gpio.get('telemetry_udp_port', TelemetryPublisher.UDP_PORT_DEFAULT)
+            self.telemetry = TelemetryPublisher(self.gpio.get('telemetry_group') or None, udp_port,
+                                                self.gpio.get('telemetry_ws_port') or None)
+            self.telemetry.start()
+
+        # Start the lap journal. Restores the state of an interrupted session.
+        self.start_journal(self.config['misc'].get('journal_file',
+                                                   os.path.join(self.root_dir, 'journal', 'lap_journal.rlj')),
+                           self.gpio.get('car_id') or None)
+
+        # Dump the latency histograms on SIGUSR1.
+        self.instrumentation.install_signal_handler()
+
         # Print init finished.
         if not debug:
             print('Initialization finished.')
 
-        # Run mainloop
-        self.mainloop()
+        # Run mainloop. Write the timing statistics at the end of the session.
+        if run:
+            if self.lcd_writer is not None:
+                self.lcd_writer.start()
+            try:
+                self.mainloop()
+            finally:
+                self.unwatch_config()
+                if self.lcd_writer is not None:
+                    self.lcd_writer.stop()
+                    print(self.lcd_writer.stats_string())
+                if self.gps is not None:
+                    self.gps.stop()
+                    print(self.gps.stats_string())
+                if self.telemetry is not None:
+                    self.telemetry.stop()
+                    print(self.telemetry.stats_string())
+                self.stop_journal()
+                self.write_stats()
 
     def mainloop(self):
+        if debug or self.no_button:
+            import pygame
+
         # noinspection PyBroadException
         try:
             while True:
+                # Record the loop interval.
+                render_start = self.instrumentation.tick()
+
                 # Update the string for display.
                 self.update_display_string()
 
@@ -87,28 +193,46 @@ class RegularityRallyLCD(RegularityRally):
                 # no_button and not debug: show output on display, but detect key strokes.
 
                 # Update LCD display or command line.
+                # The LCD is written by the writer thread. An error of the last write is raised here.
                 if debug:
                     self.print_display_debug()
                 else:
-                    self.print_display()
+                    error = self.lcd_writer.take_error()
+                    if error is not None:
+                        raise error
+                    self.lcd_writer.post(self.display_string)
+                self.instrumentation.record_since(Instrumentation.RENDER, render_start)
 
                 # Detect key or button press.
+                # Get the wait time until the next display change or audio deadline.
+                delay = self.scheduler.delay(self.next_deadline_ns())
+
                 if not debug and not self.no_button:
-                    # Detect button press.
-                    if GPIO.input(self.gpio['button_1']) == GPIO.HIGH and self.check_last_press():
-                        print('Button 1')
-                        self.cb_button_1()
-                    if GPIO.input(self.gpio['button_2']) == GPIO.HIGH and self.check_last_press():
-                        print('Button 2')
-                        self.cb_button_2()
-                    if GPIO.input(self.gpio['button_3']) == GPIO.HIGH and self.check_last_press():
-                        print('Button 3')
-                        self.cb_button_3()
+                    # Wait for button events until the next deadline.
+                    # Then handle all queued events with their edge time stamps.
+                    event = self.buttons.get(timeout=delay)
+                    self.scheduler.tick()
+                    while event is not None:
+                        if event[0] == GpsInput.FIX:
+                            self.gps_fix(event[1])
+                        elif event[0] == GpsInput.LAP:
+                            self.instrumentation.record_since(Instrumentation.GPS_LATENCY, event[1])
+                            self.gps_lap(event[1])
+                        else:
+                            self.instrumentation.record_since(Instrumentation.INPUT_LATENCY, event[1])
+                            self.handle_button(*event)
+                        event = self.buttons.get(timeout=0)
 
                 else:
+                    # Wait for key events until the next deadline.
+                    delay_ms = int(delay * 1000)
+                    events = [pygame.event.wait(delay_ms)] if delay_ms > 0 else []
+                    events += pygame.event.get()
+                    self.scheduler.tick()
+
                     # Detect button press.
                     # TODO: Reset to keyboard.
-                    for ev in pygame.event.get():
+                    for ev in events:
                         if ev.type == pygame.KEYDOWN:
                             if ev.key == pygame.K_KP1 or ev.key == pygame.K_1:
                                 self.cb_button_1()
@@ -116,28 +240,41 @@ class RegularityRallyLCD(RegularityRally):
                                 self.cb_button_2()
                             if ev.key == pygame.K_KP3 or ev.key == pygame.K_3:
                                 self.cb_button_3()
+                            if ev.key == pygame.K_i:
+                                self.instrumentation.dump()
 
         # Except errors and print Error in display.
         except Exception as err:
             print(err)
+            print(self.scheduler.stats_string())
+            self.instrumentation.dump()
+            if self.lcd_writer is not None:
+                print(self.lcd_writer.stats_string())
 
             # Get current ref time.
-            ref_time_str = '{:02}:{:02}.{:01}'.format(self.cur_set_time_decoded[1],
-                                                      self.cur_set_time_decoded[2],
-                                                      floor(self.cur_set_time_decoded[3] / 100))
+            ref_time_str = '--:--.-'
+            if self.cur_set_time is not None:
+                ref_time_str = self.lcd_display.format_ref(self.cur_set_time)
 
             # Update display string with error message and display it.
+            # The writer thread writes it, so the LCD bus is not used from two threads.
             self.display_string = ['ERROR!          ', 'Ref: {}    '.format(ref_time_str)]
             if debug:
                 self.print_display_debug()
             else:
-                self.print_display()
+                self.lcd_writer.post(self.display_string)
+                self.lcd_writer.flush()
 
             # If in Pi mode, enter loop again to check for restart.
             if not debug:
                 while True:
-                    # Detect Button 3 press.
-                    if GPIO.input(self.gpio['button_3']) == GPIO.HIGH and self.check_last_press():
+                    # Wait for Button 3 press. Without buttons, wait for key 3.
+                    if self.buttons is not None:
+                        button, _ = self.buttons.get()
+                    else:
+                        ev = pygame.event.wait()
+                        button = 3 if ev.type == pygame.KEYDOWN and ev.key in (pygame.K_KP3, pygame.K_3) else None
+                    if button == 3:
                         print('Button 3')
                         # Perform reset.
                         self.cb_button_3()
@@ -153,104 +290,88 @@ class RegularityRallyLCD(RegularityRally):
         self.mainloop()
 
     # Writes the display string for the LCD display.
-    # Consists of two lines with exactly 16 chars. Format as below
-    # xxxxxxxxxxxxxxxx
-    # 00:00.0  00:00.0
-    # 00.0 99 C BRIDGE
-    # xxxxxxxxxxxxxxxx
     def update_display_string(self):
-
-        # Init variables for state <=0 (No config or ready).
-        lap_time_str = '--:--.-'
-        ref_time_str = '--:--.-'
-        countdown_str = '--.-'
-        lap_count = 0
-        lap_type_char = self.STATES[self.state]
-        mark_str = '------'
-
-        # Calculate time delta of current lap.
+        # Call regularity update.
         if self.state > 0:
-
-            # Call regularity update.
             self.reg_update()
 
-            # Update current lap time display.
-            lap_time_str = '{:02}:{:02}.{:01}'.format(self.curlap_decoded[1],
-                                                      self.curlap_decoded[2],
-                                                      floor(self.curlap_decoded[3] / 100))
-
-            # Get lap count.
-            lap_count = len(self.lap_times) + 1
-
-            # Update countdown display, if confirmation lap.
-            if self.state == 4:
-                # Get countdown.
-                countdown_str = '{:04.1f}'.format(self.curlap_countdown_seconds)
-
-                # Get set time and use as ref time.
-                ref_time_str = '{:02}:{:02}.{:01}'.format(self.cur_set_time_decoded[1],
-                                                          self.cur_set_time_decoded[2],
-                                                          floor(self.cur_set_time_decoded[3] / 100))
-
-            elif len(self.lap_times):
-                # If not in confirmation lap. Show last lap as ref time.
-                ref_time_str = '{:02}:{:02}.{:01}'.format(self.lap_times_decoded[-1][1],
-                                                          self.lap_times_decoded[-1][2],
-                                                          floor(self.lap_times_decoded[-1][3] / 100))
-
-            # Get mark label.
-            if self.state in [3, 4]:
-                if self.mark_count < len(self.mark_labels):
-                    mark_str = self.mark_labels[self.mark_count][0:6]
-                else:
-                    mark_str = 'FINISH'
-
         # Compose string.
-        self.display_string = ['{}  {}'.format(lap_time_str, ref_time_str),
-                               '{} {: 2} {} {}'.format(countdown_str, lap_count, lap_type_char, mark_str)]
-
-        # Schedule next call.
-        pass
+        self.display_string = self.lcd_display.compose(self)
 
-    def print_display(self):
-        self.lcd_send_byte(self.gpio['lcd_line_1'], GPIO.LOW)
-        self.lcd_message(self.display_string[0])
-        self.lcd_send_byte(self.gpio['lcd_line_2'], GPIO.LOW)
-        self.lcd_message(self.display_string[1])
+    # Write the display string (or the given lines) to the LCD.
+    # Only the changed chars are sent. The cursor is set to the DDRAM address of each changed run.
+    def print_display(self, lines=None):
+        if lines is None:
+            lines = self.display_string
 
-    def print_display_debug(self):
-        print('\r{} - {}'.format(self.display_string[0], self.display_string[1]), end='')
+        for line_id, line_address in enumerate([self.gpio['lcd_line_1'], self.gpio['lcd_line_2']]):
+            line = lines[line_id].ljust(self.gpio['lcd_width'], " ")[:self.gpio['lcd_width']]
 
-    # Check if last press was within debounce time.
-    # Return True and reset time, if not.
-    def check_last_press(self):
-        # Get current time.
-        cur_time = datetime.now()
+            for offset, text in changed_runs(self.lcd_shadow[line_id], line):
+                self.lcd_send(line_address + offset, GPIO.LOW)
+                self.lcd_write(text)
 
-        # Calculate time delta.
-        timedelta_pressed = cur_time - self.time_last_press
+            self.lcd_shadow[line_id] = line
 
-        # Check if time delta greater than debounce time.
-        if timedelta_pressed > timedelta(seconds=self.button_debounce_time):
-            valid_press = True
-            self.time_last_press = cur_time
-        else:
-            valid_press = False
+    # Write a frame in the writer thread. After a failed write, the content of the LCD is unknown.
+    def write_frame(self, lines):
+        try:
+            self.print_display(lines)
+        except Exception:
+            self.lcd_shadow = [None, None]
+            raise
 
-        # Return result.
-        return valid_press
+    def print_display_debug(self):
+        print('\r{} - {}'.format(self.display_string[0], self.display_string[1]), end='')
 
-    def cb_button_1(self):
+    # Handle a debounced button event with the time stamp of its edge.
+    def handle_button(self, button, t_ns):
+        print('Button {}'.format(button))
+        if button == 1:
+            if self.same_lap_start(t_ns):
+                print('Lap already started at the finish line.')
+                return
+            self.cb_button_1(t_ns)
+        elif button == 2:
+            self.cb_button_2(t_ns)
+        elif button == 3:
+            self.cb_button_3()
+
+    # Start a new lap at a finish line crossing with its interpolated time stamp.
+    def gps_lap(self, t_ns):
+        print('Finish line')
+        if self.same_lap_start(t_ns):
+            print('Lap already started by button.')
+            return
+        self.reg_new_lap(time_stamp=t_ns)
+
+    # Check, if a lap start is the same finish as the last lap start. With GPS lap detection, the button and the
+    # finish line crossing both start the lap: a start within the minimum lap time of the last one is ignored.
+    def same_lap_start(self, t_ns):
+        finish_line = self.gps.finish_line if self.gps is not None else None
+        return (finish_line is not None and len(self.time_stamps) > 0
+                and abs(t_ns - self.time_stamps[-1]) < finish_line.min_lap_ns)
+
+    def cb_button_1(self, t_ns=None):
         # Perform new lap method.
-        self.reg_new_lap()
+        self.reg_new_lap(time_stamp=t_ns)
 
-    def cb_button_2(self):
+    def cb_button_2(self, t_ns=None):
         # Execute superclass method.
-        self.mark_reached()
+        self.mark_reached(t_ns)
 
+    # Reset. In ready state, where a reset changes nothing, the latency histograms are dumped.
     def cb_button_3(self):
+        if self.state == 0:
+            self.instrumentation.dump()
         self.reset_config()
 
+    # Set the working config. The GPS lap detection follows the finish line of the config.
+    def set_plan(self, plan):
+        super().set_plan(plan)
+        if self.gps is not None:
+            self.gps.set_finish_line(self.finish_line_coordinates)
+
     def read_gpio_cfg(self):
         # Init config.
         cfg = configparser.ConfigParser()
@@ -270,6 +391,9 @@ class RegularityRallyLCD(RegularityRally):
         self.gpio['lcd_line_1'] = int(self.gpio['lcd_line_1'], 16)
         self.gpio['lcd_line_2'] = int(self.gpio['lcd_line_2'], 16)
 
+        # The car id stays text (e.g. start number 007).
+        self.gpio['car_id'] = cfg.get('Main', 'car_id', fallback='')
+
     def lcd_send_byte(self, bits, mode):
         # Set Pins to LOW
         GPIO.output(self.gpio['lcd_rs'], mode)
@@ -308,6 +432,55 @@ class RegularityRallyLCD(RegularityRally):
         GPIO.output(self.gpio['lcd_e'], GPIO.LOW)
         time.sleep(self.gpio['e_delay'])
 
+    # Select the LCD transmission mode (classic or fast).
+    def set_lcd_mode(self, lcd_mode):
+        if lcd_mode == 'fast':
+            # Channels of one nibble write: RS and D4 - D7.
+            self.lcd_channels = [self.gpio['lcd_rs'],
+                                 self.gpio['lcd_data4'],
+                                 self.gpio['lcd_data5'],
+                                 self.gpio['lcd_data6'],
+                                 self.gpio['lcd_data7']]
+
+            # Pin levels of the high and low nibble of all bytes by mode (RS level).
+            self.lcd_nibble_levels = {}
+            for mode in [GPIO.LOW, GPIO.HIGH]:
+                self.lcd_nibble_levels[mode] = [([mode] + [(bits >> shift) & 1 for shift in range(4, 8)],
+                                                 [mode] + [(bits >> shift) & 1 for shift in range(0, 4)])
+                                                for bits in range(256)]
+
+            self.lcd_send = self.lcd_send_byte_fast
+        elif lcd_mode == 'classic':
+            self.lcd_send = self.lcd_send_byte
+        else:
+            raise ValueError('Unknown LCD mode: {}'.format(lcd_mode))
+
+    # Send a byte with one write per nibble (fast mode).
+    # The enable pulse is busy-waited. Instead of sleeping after each byte, the next byte waits until the controller
+    # executed the last one, so other work between two bytes is not delayed.
+    def lcd_send_byte_fast(self, bits, mode):
+        perf_counter_ns = time.perf_counter_ns
+        e_pulse_ns = self.gpio.get('e_pulse_us', self.LCD_E_PULSE_US_DEFAULT) * 1000
+        high, low = self.lcd_nibble_levels[mode][bits]
+
+        while perf_counter_ns() < self.lcd_ready_ns:
+            pass
+
+        for levels in (high, low):
+            GPIO.output(self.lcd_channels, levels)
+            GPIO.output(self.gpio['lcd_e'], GPIO.HIGH)
+            pulse_end = perf_counter_ns() + e_pulse_ns
+            while perf_counter_ns() < pulse_end:
+                pass
+            GPIO.output(self.gpio['lcd_e'], GPIO.LOW)
+
+        # Clear display and return home take much longer than the other instructions.
+        if mode == GPIO.LOW and bits < 0x04:
+            exec_us = self.gpio.get('lcd_clear_us', self.LCD_CLEAR_US_DEFAULT)
+        else:
+            exec_us = self.gpio.get('lcd_exec_us', self.LCD_EXEC_US_DEFAULT)
+        self.lcd_ready_ns = perf_counter_ns() + exec_us * 1000
+
     def lcd_init(self):
         # Set numbering to BCM and disable warnings.
         GPIO.setmode(GPIO.BCM)
@@ -326,6 +499,17 @@ class RegularityRallyLCD(RegularityRally):
         GPIO.setup(self.gpio['button_2'], GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.setup(self.gpio['button_3'], GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
+        # Connect the emulated LCD, if simulated.
+        if self.lcd_sim is None and hasattr(GPIO, 'attach_hd44780'):
+            self.lcd_sim = GPIO.attach_hd44780(self.gpio['lcd_rs'],
+                                               self.gpio['lcd_e'],
+                                               [self.gpio['lcd_data4'],
+                                                self.gpio['lcd_data5'],
+                                                self.gpio['lcd_data6'],
+                                                self.gpio['lcd_data7']],
+                                               self.gpio['lcd_width'],
+                                               echo=os.environ.get('GPIO_SIM') == 'echo')
+
         # Clear the LCD initially. (?)
         self.lcd_send_byte(0x33, GPIO.LOW)
         self.lcd_send_byte(0x32, GPIO.LOW)
@@ -334,10 +518,21 @@ class RegularityRallyLCD(RegularityRally):
         self.lcd_send_byte(0x06, GPIO.LOW)
         self.lcd_send_byte(0x01, GPIO.LOW)
 
+        # Clear takes up to 1.52 ms. Fast mode waits for it before the next byte.
+        self.lcd_ready_ns = time.perf_counter_ns() + self.gpio.get('lcd_clear_us', self.LCD_CLEAR_US_DEFAULT) * 1000
+
+        # Content after clear is unknown until the first full write.
+        self.lcd_shadow = [None, None]
+
     def lcd_message(self, message):
         message = message.ljust(self.gpio['lcd_width'], " ")
-        for i in range(self.gpio['lcd_width']):
-            self.lcd_send_byte(ord(message[i]), GPIO.HIGH)
+        self.lcd_write(message[:self.gpio['lcd_width']])
+
+    # Write chars at the current cursor position.
+    def lcd_write(self, text):
+        lcd_send = self.lcd_send
+        for char in text:
+            lcd_send(ord(char), GPIO.HIGH)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Calibration of the audio output latency.
+# Measures for every preloaded clip the lead time between calling play() and the audible onset:
+#  - gap between play() and the channel reporting busy,
+#  - output latency of the mixer buffer,
+#  - silence at the start of the clip (spoken clips have a varying onset).
+# The leads are stored per mixer mode and applied to the confirmation lap timeline.
+#
+# Calibration mode: python audioCalibration.py [config file]
+
+import os
+import sys
+import time
+import array
+import statistics
+import configparser
+
+from clock import Clock, NS_PER_S, NS_PER_MS, seconds_to_ns
+
+# Mixer settings by mixer mode. None: pygame defaults.
+# (frequency, size, channels, buffer)
+MIXER_MODES = {'default': None,
+               'low_latency': (22050, -16, 1, 256)}
+MIXER_DEFAULT_BUFFER = 512
+
+# Buffer sizes compared in calibration mode.
+CALIBRATION_BUFFERS = [256, 512, 1024, 2048, 4096]
+
+# Relative amplitude for the onset detection.
+ONSET_THRESHOLD = 0.05
+
+
+# Init the pygame mixer for a mixer mode. Only the mixer is initialized.
+def init_mixer(mixer_mode='default'):
+    import pygame
+
+    pygame.mixer.quit()
+    settings = MIXER_MODES[mixer_mode]
+    if settings is None:
+        pygame.mixer.init()
+    else:
+        pygame.mixer.init(*settings)
+
+
+# Get the buffer size of a mixer mode in samples.
+def mixer_buffer(mixer_mode):
+    settings = MIXER_MODES[mixer_mode]
+    return MIXER_DEFAULT_BUFFER if settings is None else settings[3]
+
+
+# Get the output latency of the mixer buffer in ns.
+def buffer_latency_ns(buffer, frequency):
+    return buffer * NS_PER_S // frequency
+
+
+# Get the median gap in ns between play() and the channel reporting busy.
+def play_latency_ns(sound, clock, repeat=5, timeout=0.5):
+    gaps = []
+    for _ in range(repeat):
+        start = clock.now()
+        channel = sound.play()
+        if channel is None:
+            continue
+
+        # Poll until the channel is busy.
+        while not channel.get_busy() and clock.now() - start < seconds_to_ns(timeout):
+            pass
+        gaps.append(clock.now() - start)
+
+        channel.stop()
+        time.sleep(0.01)
+
+    return int(statistics.median(gaps)) if gaps else 0
+
+
+# Get the offset in ns of the first sample above the threshold.
+def onset_offset_ns(sound, frequency, size, channels, threshold=ONSET_THRESHOLD):
+    # Only signed 16 bit samples are analysed.
+    if size != -16:
+        return 0
+
+    samples = array.array('h', sound.get_raw())
+    if not samples:
+        return 0
+
+    limit = max(abs(max(samples)), abs(min(samples))) * threshold
+    for sample_id, sample in enumerate(samples):
+        if abs(sample) > limit:
+            return sample_id // channels * NS_PER_S // frequency
+
+    return 0
+
+
+# Measure the lead times in ns of the given sounds by name.
+def calibrate(sounds, mixer_mode='default', clock=None):
+    import pygame
+
+    clock = clock or Clock()
+    frequency, size, channels = pygame.mixer.get_init()
+    buffer_ns = buffer_latency_ns(mixer_buffer(mixer_mode), frequency)
+
+    leads = {}
+    for name, sound in sounds.items():
+        leads[name] = play_latency_ns(sound, clock) + buffer_ns + onset_offset_ns(sound, frequency, size, channels)
+
+    return leads
+
+
+# Read the lead times in ns of a mixer mode from the calibration file.
+def read_calibration(calibration_file_path, mixer_mode):
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = str  # Keep case of mark labels.
+    cfg.read(calibration_file_path)
+
+    if mixer_mode not in cfg:
+        return {}
+    return {name: seconds_to_ns(cfg.getfloat(mixer_mode, name)) for name in cfg[mixer_mode]}
+
+
+# Write the lead times in ns of a mixer mode to the calibration file. Other modes are kept.
+def write_calibration(calibration_file_path, mixer_mode, leads):
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = str  # Keep case of mark labels.
+    cfg.read(calibration_file_path)
+
+    cfg[mixer_mode] = {name: '{:.6f}'.format(lead / NS_PER_S) for name, lead in leads.items()}
+
+    os.makedirs(os.path.dirname(calibration_file_path), exist_ok=True)
+    with open(calibration_file_path, 'w') as calibration_file:
+        cfg.write(calibration_file)
+
+
+# Calibration mode. Compare the buffer sizes and store the leads of the clips of a config.
+def main():
+    import pygame
+    from regularityRally import RegularityRally
+
+    rally = RegularityRally()
+    config_file_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(rally.config_dir, 'LCD.cfg')
+
+    # Compare the play latency of the beep for different buffer sizes.
+    print('Buffer  play->busy  buffer latency')
+    for buffer in CALIBRATION_BUFFERS:
+        pygame.mixer.quit()
+        pygame.mixer.init(buffer=buffer)
+        frequency = pygame.mixer.get_init()[0]
+        beep = pygame.mixer.Sound(os.path.join(rally.folder_support, 'beep_outtake.wav'))
+        print('{:>6}  {:7.2f} ms  {:11.2f} ms'.format(buffer,
+                                                      play_latency_ns(beep, rally.clock) / NS_PER_MS,
+                                                      buffer_latency_ns(buffer, frequency) / NS_PER_MS))
+
+    # Calibrate the clips of the config with the configured mixer mode.
+    # The running mixer mode is reset to force a re-init with the configured settings.
+    rally.mixer_init_mode = None
+    rally.read_config(config_file_path)
+    rally.wait_audio()
+    leads = calibrate(rally.audio_sounds(), rally.mixer_mode, rally.clock)
+    write_calibration(rally.audio_calibration_file, rally.mixer_mode, leads)
+
+    print('\nLeads ({}):'.format(rally.mixer_mode))
+    for name, lead in leads.items():
+        print('{:>10}: {:7.2f} ms'.format(name, lead / NS_PER_MS))
+    print('Written to {}'.format(rally.audio_calibration_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import queue
+
+from clock import seconds_to_ns
+
+
+class ButtonInput(object):
+    # Edge triggered input layer for the hardware buttons.
+    # GPIO edge callbacks take the time stamp first, debounce and put (button, t_ns) events on a queue.
+    # The mainloop consumes the queue, so no GPIO polling is needed and the stamp is taken at the edge.
+
+    def __init__(self, gpio_module, pins, clock, debounce_time):
+        # GPIO module (RPi.GPIO) and pins by button number, e.g. {1: 4, 2: 27, 3: 10}.
+        self.gpio_module = gpio_module
+        self.pins = pins
+        self.clock = clock
+
+        # Debounce time in ns. A press is only valid, if the last valid press is older.
+        self.debounce_ns = seconds_to_ns(debounce_time)
+        self.time_last_press = None
+
+        # Queue of (button, t_ns) events.
+        self.events = queue.Queue()
+
+        # Map from pin to button number for the callback.
+        self.buttons = {pin: button for button, pin in self.pins.items()}
+
+    # Register the edge callbacks.
+    def start(self):
+        for pin in self.pins.values():
+            self.gpio_module.add_event_detect(pin, self.gpio_module.RISING, callback=self.edge_callback)
+
+    # Remove the edge callbacks.
+    def stop(self):
+        for pin in self.pins.values():
+            self.gpio_module.remove_event_detect(pin)
+
+    # Called by the GPIO thread on a rising edge.
+    def edge_callback(self, pin):
+        # Take time stamp first to keep the error low.
+        t_ns = self.clock.now()
+
+        if self.check_last_press(t_ns):
+            self.events.put((self.buttons[pin], t_ns))
+
+    # Check if last press was within debounce time.
+    # Return True and reset time, if not.
+    def check_last_press(self, t_ns):
+        if self.time_last_press is None or t_ns - self.time_last_press > self.debounce_ns:
+            self.time_last_press = t_ns
+            return True
+        else:
+            return False
+
+    # Get the next event (button, t_ns).
+    # Waits at most timeout seconds (None: forever) and returns None, if no event occurred.
+    def get(self, timeout=None):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import time
+
+NS_PER_S = 1000000000
+NS_PER_MS = 1000000
+
+
+# Convert integer nanoseconds to float seconds. Only use at the display edge.
+def ns_to_seconds(time_ns):
+    return time_ns / NS_PER_S
+
+
+# Convert float seconds (e.g. from a config file) to integer nanoseconds.
+def seconds_to_ns(time_seconds):
+    return int(round(time_seconds * NS_PER_S))
+
+
+class Clock(object):
+    # Source of all time stamps of the timer.
+    # Returns integer nanoseconds of a monotonic clock, which does not jump when NTP or the RTC adjusts the system time.
+    # The absolute value has no meaning, only differences between two stamps are used.
+
+    def __init__(self, source=time.perf_counter_ns):
+        # Get the current time stamp in nanoseconds: now().
+        # The source is bound directly to avoid the overhead of an extra method call per stamp.
+        self.now = source
+
+
+class VirtualClock(Clock):
+    # Clock, which only advances when told. Used to replay traces faster than real time.
+
+    def __init__(self, start_ns=0):
+        self.time_ns = start_ns
+        super().__init__(self.get_time)
+
+    def get_time(self):
+        return self.time_ns
+
+    # Advance the clock by the given nanoseconds.
+    def advance(self, time_ns):
+        self.time_ns += time_ns
+
+    # Set the clock to a time stamp. The clock never runs backwards.
+    def set(self, time_ns):
+        self.time_ns = max(self.time_ns, time_ns)
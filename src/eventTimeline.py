@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from clock import NS_PER_MS, seconds_to_ns
+
+
+class EventTimeline(object):
+    # Sorted timeline of the audio events of a confirmation lap.
+    # All events are compiled once at the start of the lap with absolute deadlines (ns).
+    # dispatch() returns every event that is due, so several close events in one tick are all fired.
+
+    # Event kinds.
+    COUNTDOWN = 'countdown'
+    MARK = 'mark'
+    BEEP = 'beep'
+
+    def __init__(self, late_tolerance=0.02):
+        # Events as (deadline_ns, kind, payload), sorted by deadline.
+        self.events = []
+        self.index = 0
+
+        # Events fired later than this are counted as late.
+        self.late_tolerance_ns = seconds_to_ns(late_tolerance)
+
+        # Statistics.
+        self.fired = 0
+        self.late = 0
+        self.missed = 0
+        self.max_lateness_ns = 0
+
+    # Compile a new timeline from (deadline_ns, kind, payload) events and reset the statistics.
+    def compile(self, events):
+        # Sort stable by deadline, so events with the same deadline keep their order.
+        self.events = sorted(events, key=lambda ev: ev[0])
+        self.index = 0
+
+        self.fired = 0
+        self.late = 0
+        self.missed = 0
+        self.max_lateness_ns = 0
+
+    # Get the deadline of the next event. None if all events are done.
+    def next_deadline_ns(self):
+        if self.index < len(self.events):
+            return self.events[self.index][0]
+        else:
+            return None
+
+    # Get all events due at the given time and count their lateness.
+    def dispatch(self, now_ns):
+        due = []
+        while self.index < len(self.events) and self.events[self.index][0] <= now_ns:
+            event = self.events[self.index]
+            self.index += 1
+
+            lateness = now_ns - event[0]
+            self.fired += 1
+            if lateness > self.late_tolerance_ns:
+                self.late += 1
+            self.max_lateness_ns = max(self.max_lateness_ns, lateness)
+
+            due.append(event)
+
+        return due
+
+    # Drop all events due at the given time without firing them.
+    def skip_until(self, now_ns):
+        while self.index < len(self.events) and self.events[self.index][0] <= now_ns:
+            self.index += 1
+
+    # Close the timeline, e.g. at the end of the lap. Events not fired yet are counted as missed.
+    def close(self):
+        self.missed += len(self.events) - self.index
+        self.index = len(self.events)
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'Events: {}, fired: {}, late: {}, missed: {}, max late: {:.2f} ms'.format(len(self.events),
+                                                                                          self.fired,
+                                                                                          self.late,
+                                                                                          self.missed,
+                                                                                          self.max_lateness_ns
+                                                                                          / NS_PER_MS)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Drop-in simulation of the RPi.GPIO module.
+# Keeps the pin levels, passes output writes to attached simulated devices (e.g. Hd44780Sim) and calls the edge
+# callbacks of injected input edges, so the LCD frontend runs its real loop on a machine without GPIO.
+# Used by RegularityRallyLCD, if the environment variable GPIO_SIM is set (GPIO_SIM=echo prints the LCD lines).
+
+import threading
+
+from clock import Clock
+from hd44780Sim import Hd44780Sim
+
+# Constants of RPi.GPIO.
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+# Clock of the simulated devices. Replace before attaching a device, e.g. by a virtual clock.
+clock = Clock()
+
+# Pin state.
+mode = None
+directions = {}
+levels = {}
+edge_callbacks = {}
+
+# Simulated devices by pin.
+devices = {}
+
+# Number of output writes.
+writes = 0
+
+# Serializes injected edges from other threads with the callbacks.
+edge_lock = threading.Lock()
+
+
+def setmode(new_mode):
+    global mode
+    mode = new_mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+        directions[pin] = direction
+        if direction == OUT:
+            levels[pin] = initial if initial is not None else LOW
+        else:
+            levels[pin] = HIGH if pull_up_down == PUD_UP else LOW
+
+
+# Write one or several outputs. Like RPi.GPIO, channel and value may be lists.
+def output(channel, value):
+    global writes
+    channels = channel if isinstance(channel, (list, tuple)) else [channel]
+    values = value if isinstance(value, (list, tuple)) else [value] * len(channels)
+    if len(values) != len(channels):
+        raise RuntimeError('Number of channels != number of values')
+
+    for pin, level in zip(channels, values):
+        if directions.get(pin) != OUT:
+            raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+
+        level = HIGH if level else LOW
+        levels[pin] = level
+        writes += 1
+
+        device = devices.get(pin)
+        if device is not None:
+            device.pin_written(pin, level)
+
+
+def input(channel):
+    if channel not in directions:
+        raise RuntimeError('You must setup() the GPIO channel first')
+    return levels[channel]
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    if directions.get(channel) != IN:
+        raise RuntimeError('You must setup() the GPIO channel as an input first')
+    if channel in edge_callbacks:
+        raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+    edge_callbacks[channel] = (edge, callback)
+
+
+def remove_event_detect(channel):
+    edge_callbacks.pop(channel, None)
+
+
+def cleanup(channel=None):
+    for pin in list(directions) if channel is None else [channel]:
+        directions.pop(pin, None)
+        levels.pop(pin, None)
+        edge_callbacks.pop(pin, None)
+        devices.pop(pin, None)
+
+
+# Attach a simulated HD44780 LCD to the given pins and return it.
+def attach_hd44780(rs, e, data_pins, width=16, echo=False):
+    lcd = Hd44780Sim(rs, e, data_pins, clock, width, echo)
+    for pin in lcd.pins:
+        devices[pin] = lcd
+    return lcd
+
+
+# Set the level of an input pin. The edge callback is called in the calling thread, like in the GPIO thread.
+def set_input(pin, level):
+    with edge_lock:
+        last_level = levels.get(pin, LOW)
+        levels[pin] = level
+
+        edge, callback = edge_callbacks.get(pin, (None, None))
+        if callback is None or level == last_level:
+            return
+        if edge == BOTH or (edge == RISING and level == HIGH) or (edge == FALLING and level == LOW):
+            callback(pin)
+
+
+# Press and release a button on an input pin with pull down.
+def press(pin):
+    set_input(pin, HIGH)
+    set_input(pin, LOW)
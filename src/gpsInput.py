@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import math
+import queue
+import threading
+from functools import reduce
+from operator import xor
+from collections import namedtuple
+
+from clock import NS_PER_S, seconds_to_ns
+
+# pyserial is only needed for a serial GPS receiver. Replay files work without.
+try:
+    import serial
+except ImportError:
+    serial = None
+
+EARTH_RADIUS = 6371000.0
+KNOTS_TO_MPS = 1852.0 / 3600.0
+DAY_NS = 86400 * NS_PER_S
+
+# Parsed NMEA position sentence. utc_ns: time of the fix since midnight UTC. speed: m/s, None if not sent.
+Sentence = namedtuple('Sentence', ['kind', 'utc_ns', 'lat', 'lon', 'speed'])
+
+# Position fix. t_ns: time of the fix on the timer clock. x, y: metres east and north of the reference point.
+Fix = namedtuple('Fix', ['t_ns', 'x', 'y', 'lat', 'lon', 'speed'])
+
+
+# Check the checksum of an NMEA sentence: XOR of all chars between $ and *.
+def nmea_checksum_ok(line):
+    star = line.rfind('*')
+    if not line.startswith('$') or star < 0:
+        return False
+    return line[star + 1:star + 3].upper() == '{:02X}'.format(reduce(xor, line[1:star].encode('ascii', 'replace'), 0))
+
+
+# Convert an NMEA coordinate (ddmm.mmmm or dddmm.mmmm) and hemisphere to signed degrees.
+def nmea_degrees(value, hemisphere):
+    dot = value.find('.')
+    if dot < 0:
+        dot = len(value)
+    degrees = float(value[:dot - 2]) + float(value[dot - 2:]) / 60
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+# Convert an NMEA time (hhmmss.ss) to ns since midnight.
+def nmea_time_ns(value):
+    return seconds_to_ns(int(value[0:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:]))
+
+
+# Parse an RMC or GGA sentence with a valid position. Returns a Sentence or None for any other or invalid sentence.
+def parse_nmea(line):
+    line = line.strip()
+    if not nmea_checksum_ok(line):
+        return None
+
+    fields = line[1:line.rfind('*')].split(',')
+    kind = fields[0][2:]
+    try:
+        if kind == 'RMC' and len(fields) > 7 and fields[2] == 'A':
+            speed = float(fields[7]) * KNOTS_TO_MPS if fields[7] else None
+            return Sentence(kind, nmea_time_ns(fields[1]), nmea_degrees(fields[3], fields[4]),
+                            nmea_degrees(fields[5], fields[6]), speed)
+        elif kind == 'GGA' and len(fields) > 6 and fields[6] not in ('', '0'):
+            return Sentence(kind, nmea_time_ns(fields[1]), nmea_degrees(fields[2], fields[3]),
+                            nmea_degrees(fields[4], fields[5]), None)
+    except ValueError:
+        pass
+    return None
+
+
+class LocalProjection(object):
+    # Equirectangular projection of latitude and longitude to metres around a reference point.
+    # Accurate to a fraction of a metre within a few kilometres, which is the size of a stage.
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+        self.m_per_deg_lat = math.radians(EARTH_RADIUS)
+        self.m_per_deg_lon = self.m_per_deg_lat * math.cos(math.radians(lat))
+
+    # Get (x, y) in metres east and north of the reference point.
+    def project(self, lat, lon):
+        return (lon - self.lon) * self.m_per_deg_lon, (lat - self.lat) * self.m_per_deg_lat
+
+
+class FinishLine(object):
+    # Finish line as segment between two points (x, y in m).
+    # The track between two fixes crosses the line, if both segments intersect. The crossing time is interpolated
+    # linearly between the fixes. The direction of the first crossing is the driving direction, crossings in the
+    # other direction (e.g. turning in the paddock) are ignored.
+
+    def __init__(self, a, b, min_lap_time=10.0, max_fix_gap=1.0):
+        self.a = a
+        self.e = (b[0] - a[0], b[1] - a[1])
+
+        # Crossings within the minimum lap time after the last one are ignored.
+        self.min_lap_ns = seconds_to_ns(min_lap_time)
+        self.last_crossing_ns = None
+        self.direction = None
+
+        # No crossing is interpolated over a gap of the fixes, e.g. in a tunnel.
+        self.max_fix_gap_ns = seconds_to_ns(max_fix_gap)
+
+    # Get the interpolated time stamp (ns) of a crossing between two fixes. None if the track does not cross.
+    def crossing(self, fix_0, fix_1):
+        if fix_1.t_ns - fix_0.t_ns > self.max_fix_gap_ns:
+            return None
+
+        dx = fix_1.x - fix_0.x
+        dy = fix_1.y - fix_0.y
+        denominator = dx * self.e[1] - dy * self.e[0]
+        if denominator == 0:
+            return None
+
+        # Fraction along the track (t) and along the finish line (u) of the intersection.
+        ax = self.a[0] - fix_0.x
+        ay = self.a[1] - fix_0.y
+        t = (ax * self.e[1] - ay * self.e[0]) / denominator
+        u = (ax * dy - ay * dx) / denominator
+        if not (0 < t <= 1 and 0 <= u <= 1):
+            return None
+
+        direction = denominator > 0
+        if self.direction is None:
+            self.direction = direction
+        elif direction != self.direction:
+            return None
+
+        t_ns = fix_0.t_ns + int(round(t * (fix_1.t_ns - fix_0.t_ns)))
+        if self.last_crossing_ns is not None and t_ns - self.last_crossing_ns < self.min_lap_ns:
+            return None
+        self.last_crossing_ns = t_ns
+        return t_ns
+
+
+class GpsInput(object):
+    # GPS input layer. Reads NMEA sentences from a serial receiver or a replay file in its own thread.
+    # Each fix is stamped on the timer clock and projected to metres. A crossing of the finish line is put as lap
+    # event (LAP, t_ns) with the interpolated crossing time on the event queue, e.g. the one of the ButtonInput, so
+    # the mainloop starts the new lap like on a button press. With fixes, each fix is also put as (FIX, Fix) on the
+    # event queue, e.g. for position triggered marks.
+    #
+    # Fix times: the receiver time of a fix is exact between fixes, the reception stamp is delayed by the serial
+    # transmission. The receiver time is moved to the timer clock by the smallest delay seen so far. A remaining
+    # constant delay cancels out in the lap times.
+
+    LAP = 'lap'
+    FIX = 'fix'
+    BAUDRATE_DEFAULT = 9600
+
+    # device: serial device (e.g. /dev/ttyACM0) or NMEA replay file.
+    # realtime: replay a file with the timing of the recorded fixes. Else as fast as possible.
+    def __init__(self, device, clock, events=None, baudrate=BAUDRATE_DEFAULT, realtime=True, fixes=False):
+        self.device = device
+        self.clock = clock
+        self.baudrate = baudrate
+        self.realtime = realtime
+        self.put_fixes = fixes
+
+        # Queue of (LAP, t_ns) and (FIX, Fix) events, shared with the (button, t_ns) events of the buttons.
+        self.events = events if events is not None else queue.Queue()
+
+        # Projection to metres. Its reference is the finish line or the first fix.
+        self.projection = None
+        self.finish_line = None
+
+        # Offset from receiver time to timer clock and receiver time of the last fix. utc_day_ns counts the days
+        # passed since the first fix.
+        self.utc_offset_ns = None
+        self.utc_day_ns = 0
+        self.last_utc_ns = None
+
+        # Last fix.
+        self.fix = None
+
+        # Statistics.
+        self.sentences = 0
+        self.fixes = 0
+        self.crossings = 0
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Set the finish line from two (lat, lon) points. None or missing points: no finish line detection.
+    # Called by the mainloop, e.g. when a config is read. The new line replaces the old one at once.
+    def set_finish_line(self, coordinates, min_lap_time=10.0):
+        if not coordinates or None in coordinates:
+            self.finish_line = None
+            return
+
+        (lat_a, lon_a), (lat_b, lon_b) = coordinates
+        if self.projection is None:
+            self.projection = LocalProjection((lat_a + lat_b) / 2, (lon_a + lon_b) / 2)
+        self.finish_line = FinishLine(self.projection.project(lat_a, lon_a), self.projection.project(lat_b, lon_b),
+                                      min_lap_time)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='GpsInput', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        try:
+            if os.path.isfile(self.device):
+                self.run_replay()
+            else:
+                self.run_serial()
+        except (OSError, RuntimeError) as err:
+            print('GPS {} stopped: {}'.format(self.device, err))
+
+    # Read a serial receiver. The reception stamp is taken right after the line is read.
+    def run_serial(self):
+        if serial is None:
+            raise RuntimeError('pyserial is not installed.')
+
+        with serial.Serial(self.device, self.baudrate, timeout=0.5) as port:
+            while not self.stop_event.is_set():
+                line = port.readline()
+                recv_ns = self.clock.now()
+                if line:
+                    self.handle_line(line.decode('ascii', 'replace'), recv_ns)
+
+    # Read a replay file. The reception stamps are taken from the receiver times of the fixes.
+    def run_replay(self):
+        start_ns = self.clock.now()
+        first_utc_ns = None
+        with open(self.device, 'rb') as replay_file:
+            for line in replay_file:
+                if self.stop_event.is_set():
+                    break
+                sentence = parse_nmea(line.decode('ascii', 'replace'))
+                if sentence is None:
+                    continue
+
+                if first_utc_ns is None:
+                    first_utc_ns = sentence.utc_ns
+                recv_ns = start_ns + (sentence.utc_ns - first_utc_ns) % DAY_NS
+                if self.realtime and self.stop_event.wait(max(0, recv_ns - self.clock.now()) / NS_PER_S):
+                    break
+                self.handle_sentence(sentence, recv_ns)
+
+    # Handle an NMEA line received at the given time stamp.
+    def handle_line(self, line, recv_ns):
+        sentence = parse_nmea(line)
+        if sentence is not None:
+            self.handle_sentence(sentence, recv_ns)
+
+    # Handle a parsed sentence. Only the first sentence of each fix is used, as RMC and GGA repeat the position.
+    def handle_sentence(self, sentence, recv_ns):
+        self.sentences += 1
+        utc_ns = sentence.utc_ns + self.utc_day_ns
+        if self.last_utc_ns is not None:
+            # Midnight UTC.
+            if utc_ns < self.last_utc_ns - DAY_NS // 2:
+                self.utc_day_ns += DAY_NS
+                utc_ns += DAY_NS
+            if utc_ns <= self.last_utc_ns:
+                return
+        self.last_utc_ns = utc_ns
+
+        # Smallest delay of the reception.
+        if self.utc_offset_ns is None or recv_ns - utc_ns < self.utc_offset_ns:
+            self.utc_offset_ns = recv_ns - utc_ns
+
+        if self.projection is None:
+            self.projection = LocalProjection(sentence.lat, sentence.lon)
+        x, y = self.projection.project(sentence.lat, sentence.lon)
+        fix = Fix(utc_ns + self.utc_offset_ns, x, y, sentence.lat, sentence.lon, sentence.speed)
+        self.handle_fix(fix)
+
+    # Handle a new fix. Puts a lap event, if the track since the last fix crosses the finish line. The lap event goes
+    # first, so the fix counts to the new lap.
+    def handle_fix(self, fix):
+        self.fixes += 1
+        last_fix = self.fix
+        self.fix = fix
+
+        finish_line = self.finish_line
+        if finish_line is not None and last_fix is not None:
+            t_ns = finish_line.crossing(last_fix, fix)
+            if t_ns is not None:
+                self.crossings += 1
+                self.events.put((self.LAP, t_ns))
+
+        if self.put_fixes:
+            self.events.put((self.FIX, fix))
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'GPS sentences: {}, fixes: {}, finish line crossings: {}'.format(self.sentences, self.fixes,
+                                                                                self.crossings)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from clock import Clock, NS_PER_MS
+
+
+class Hd44780Sim(object):
+    # Emulator of a HD44780 character LCD on the GPIO simulation.
+    # Decodes the nibbles latched at the falling edge of E (8 bit mode after power on, 4 bit mode after the function
+    # set), executes the instructions and keeps the DDRAM.
+    # Bus time is accounted per transfer from the first pin write to the latching edge. Transfers during the execution
+    # time of the last instruction (busy flag) and too short E pulses are counted as violations.
+
+    # Execution times (datasheet, 270 kHz oscillator).
+    CLEAR_HOME_NS = 1520000
+    INSTRUCTION_NS = 37000
+    DATA_NS = 41000
+    E_PULSE_MIN_NS = 450
+
+    # DDRAM addresses of 2 line mode. Line 1: 0x00 - 0x27, line 2: 0x40 - 0x67.
+    LINE_ADDRESSES = [0x00, 0x40]
+    LINE_LENGTH = 0x28
+
+    def __init__(self, rs, e, data_pins, clock=None, width=16, echo=False):
+        # Pins: register select, enable and D4 - D7.
+        self.rs = rs
+        self.e = e
+        self.data_pins = list(data_pins)
+        self.pins = set([rs, e] + self.data_pins)
+        self.levels = {pin: 0 for pin in self.pins}
+
+        self.clock = clock if clock is not None else Clock()
+        self.width = width
+
+        # Print the lines after each written char.
+        self.echo = echo
+
+        # Power on state: 8 bit interface, 1 line, display off.
+        self.four_bit = False
+        self.two_lines = False
+        self.display_on = False
+        self.cursor_on = False
+        self.blink_on = False
+        self.increment = True
+        self.high_nibble = None
+
+        # Memory and address counter. The address counter points to the DDRAM or the CGRAM.
+        self.ddram = bytearray(b' ' * 0x80)
+        self.cgram = bytearray(0x40)
+        self.address = 0
+        self.cgram_mode = False
+
+        # Bus timing.
+        self.e_rise = None
+        self.transfer_start = None
+        self.busy_until = 0
+
+        # Statistics.
+        self.instructions = 0
+        self.chars = 0
+        self.nibbles = 0
+        self.bus_ns = 0
+        self.busy_violations = 0
+        self.pulse_violations = 0
+
+    # Called by the GPIO simulation on each write to one of the pins.
+    def pin_written(self, pin, level):
+        now = self.clock.now()
+        if self.transfer_start is None:
+            self.transfer_start = now
+
+        last_level = self.levels[pin]
+        self.levels[pin] = level
+
+        if pin == self.e:
+            if level and not last_level:
+                self.e_rise = now
+            elif last_level and not level:
+                if self.e_rise is not None and now - self.e_rise < self.E_PULSE_MIN_NS:
+                    self.pulse_violations += 1
+                self.latch(now)
+
+    # Latch the nibble on D4 - D7 at the falling edge of E.
+    def latch(self, now):
+        nibble = 0
+        for bit, pin in enumerate(self.data_pins):
+            if self.levels[pin]:
+                nibble |= 1 << bit
+        self.nibbles += 1
+
+        # The first nibble of a transfer must wait until the last instruction is executed.
+        if self.high_nibble is None and now < self.busy_until:
+            self.busy_violations += 1
+
+        if not self.four_bit:
+            # 8 bit mode: D0 - D3 are not connected and read as 0.
+            value = nibble << 4
+        elif self.high_nibble is None:
+            self.high_nibble = nibble
+            return
+        else:
+            value = (self.high_nibble << 4) | nibble
+            self.high_nibble = None
+
+        self.bus_ns += now - self.transfer_start
+        self.transfer_start = None
+
+        if self.levels[self.rs]:
+            self.write_data(value)
+            self.busy_until = now + self.DATA_NS
+        else:
+            self.busy_until = now + self.execute(value)
+
+    # Execute an instruction. Returns the execution time (ns).
+    def execute(self, value):
+        self.instructions += 1
+
+        if value & 0x80:
+            # Set DDRAM address.
+            self.address = value & 0x7F
+            self.cgram_mode = False
+        elif value & 0x40:
+            # Set CGRAM address.
+            self.address = value & 0x3F
+            self.cgram_mode = True
+        elif value & 0x20:
+            # Function set: interface width and number of lines.
+            self.four_bit = not value & 0x10
+            self.two_lines = bool(value & 0x08)
+        elif value & 0x10:
+            # Cursor shift. Display shift is not emulated.
+            if not value & 0x08:
+                self.move_address(1 if value & 0x04 else -1)
+        elif value & 0x08:
+            # Display control.
+            self.display_on = bool(value & 0x04)
+            self.cursor_on = bool(value & 0x02)
+            self.blink_on = bool(value & 0x01)
+        elif value & 0x04:
+            # Entry mode set. Display shift is not emulated.
+            self.increment = bool(value & 0x02)
+        elif value & 0x02:
+            # Return home.
+            self.address = 0
+            self.cgram_mode = False
+            return self.CLEAR_HOME_NS
+        elif value & 0x01:
+            # Clear display.
+            self.ddram[:] = b' ' * len(self.ddram)
+            self.address = 0
+            self.cgram_mode = False
+            self.increment = True
+            return self.CLEAR_HOME_NS
+
+        return self.INSTRUCTION_NS
+
+    # Write a char to the DDRAM or CGRAM and move the address counter.
+    def write_data(self, value):
+        self.chars += 1
+        if self.cgram_mode:
+            self.cgram[self.address] = value
+            self.address = (self.address + (1 if self.increment else -1)) % len(self.cgram)
+            return
+
+        self.ddram[self.address] = value
+        self.move_address(1 if self.increment else -1)
+
+        if self.echo:
+            print('\r{} | {}'.format(*self.lines()), end='')
+
+    # Move the DDRAM address counter. In 2 line mode, the end of a line continues on the other line.
+    def move_address(self, step):
+        if not self.two_lines:
+            self.address = (self.address + step) % 0x50
+            return
+
+        line = 1 if self.address >= self.LINE_ADDRESSES[1] else 0
+        column = self.address - self.LINE_ADDRESSES[line] + step
+        if column >= self.LINE_LENGTH:
+            line, column = 1 - line, 0
+        elif column < 0:
+            line, column = 1 - line, self.LINE_LENGTH - 1
+        self.address = self.LINE_ADDRESSES[line] + column
+
+    # Get the visible lines as strings.
+    def lines(self):
+        return [self.ddram[address:address + self.width].decode('latin-1') for address in self.LINE_ADDRESSES]
+
+    # Reset the statistics, e.g. before a measured frame.
+    def reset_stats(self):
+        self.instructions = 0
+        self.chars = 0
+        self.nibbles = 0
+        self.bus_ns = 0
+        self.busy_violations = 0
+        self.pulse_violations = 0
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'Instructions: {}, chars: {}, nibbles: {}, bus time: {:.3f} ms, busy violations: {}, ' \
+               'pulse violations: {}'.format(self.instructions,
+                                             self.chars,
+                                             self.nibbles,
+                                             self.bus_ns / NS_PER_MS,
+                                             self.busy_violations,
+                                             self.pulse_violations)
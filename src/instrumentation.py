@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import signal
+from array import array
+
+from clock import NS_PER_S, NS_PER_MS
+
+
+class LatencyHistogram(object):
+    # Fixed memory latency histogram with log-linear buckets (HDR histogram style).
+    # Values below 2^SIGNIFICANT_BITS ns get one bucket each. Above, every power of two is split into
+    # 2^(SIGNIFICANT_BITS - 1) buckets, so the relative error of a reported value is below 2^-(SIGNIFICANT_BITS - 1).
+    # Recording is a few integer operations and never allocates.
+
+    SIGNIFICANT_BITS = 7
+
+    def __init__(self, name, max_ns=10 * NS_PER_S):
+        self.name = name
+        self.half = 1 << (self.SIGNIFICANT_BITS - 1)
+
+        # Values above max_ns are counted in the last bucket. The exact maximum is kept separately.
+        self.max_ns = max_ns
+        self.counts = array('Q', bytes(8 * (self.index(max_ns) + 1)))
+
+        self.count = 0
+        self.sum_ns = 0
+        self.min_value_ns = None
+        self.max_value_ns = 0
+
+    # Get the bucket index of a value (ns).
+    def index(self, value_ns):
+        shift = value_ns.bit_length() - self.SIGNIFICANT_BITS
+        if shift <= 0:
+            return value_ns
+        return shift * self.half + (value_ns >> shift)
+
+    # Get the highest value (ns) counted in a bucket.
+    def bucket_value(self, index):
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ((index % self.half + self.half + 1) << shift) - 1
+
+    # Record a value (ns). Negative values are counted as 0.
+    def record(self, value_ns):
+        if value_ns < 0:
+            value_ns = 0
+        self.counts[self.index(min(value_ns, self.max_ns))] += 1
+
+        self.count += 1
+        self.sum_ns += value_ns
+        if self.min_value_ns is None or value_ns < self.min_value_ns:
+            self.min_value_ns = value_ns
+        if value_ns > self.max_value_ns:
+            self.max_value_ns = value_ns
+
+    # Get the value (ns) at a percentile (0..100). None if nothing was recorded.
+    def percentile(self, pc):
+        if not self.count:
+            return None
+
+        rank = max(1, -(-self.count * pc // 100))
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return min(self.bucket_value(index), self.max_value_ns)
+        return self.max_value_ns
+
+    # Clear all recorded values.
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.sum_ns = 0
+        self.min_value_ns = None
+        self.max_value_ns = 0
+
+    # Get a one line summary in ms.
+    def summary_string(self):
+        if not self.count:
+            return '{:<16} {:>8}'.format(self.name, 0)
+
+        values = [self.min_value_ns / NS_PER_MS,
+                  self.sum_ns / self.count / NS_PER_MS] + \
+                 [self.percentile(pc) / NS_PER_MS for pc in Instrumentation.PERCENTILES] + \
+                 [self.max_value_ns / NS_PER_MS]
+        return '{:<16} {:>8} '.format(self.name, self.count) + ' '.join('{:>9.3f}'.format(v) for v in values)
+
+
+class Instrumentation(object):
+    # Low overhead timing instrumentation of the frontends.
+    # Keeps a latency histogram each of:
+    #  - tick interval: time between two loop iterations,
+    #  - render: time to update and output the display,
+    #  - input latency: time from the button edge stamp until the press is handled,
+    #  - GPS latency: time from the interpolated finish line crossing until the lap is started,
+    #  - audio lateness: time from the deadline of a countdown, mark or beep until it is fired.
+    # The histograms can be dumped on SIGUSR1 or a key and are written to a stats file at session end.
+
+    TICK_INTERVAL = 'tick_interval'
+    RENDER = 'render'
+    INPUT_LATENCY = 'input_latency'
+    GPS_LATENCY = 'gps_latency'
+    AUDIO_LATENESS = 'audio_lateness'
+
+    PERCENTILES = [50, 90, 99, 99.9]
+
+    def __init__(self, clock):
+        self.clock = clock
+
+        self.histograms = {name: LatencyHistogram(name)
+                           for name in [self.TICK_INTERVAL, self.RENDER, self.INPUT_LATENCY, self.GPS_LATENCY,
+                                        self.AUDIO_LATENESS]}
+
+        # Time stamp of the last tick.
+        self.last_tick = None
+
+    # Record a loop iteration. The interval to the last iteration is recorded.
+    def tick(self):
+        now = self.clock.now()
+        if self.last_tick is not None:
+            self.histograms[self.TICK_INTERVAL].record(now - self.last_tick)
+        self.last_tick = now
+        return now
+
+    # Record a value (ns) in a histogram.
+    def record(self, name, value_ns):
+        self.histograms[name].record(value_ns)
+
+    # Record the time since a start stamp (ns) in a histogram.
+    def record_since(self, name, start_ns):
+        self.histograms[name].record(self.clock.now() - start_ns)
+
+    # Clear all histograms.
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.last_tick = None
+
+    # Get the summary table of all histograms in ms.
+    def report_string(self):
+        header = '{:<16} {:>8} '.format('histogram (ms)', 'count') + ' '.join(
+            '{:>9}'.format(name) for name in ['min', 'mean'] + ['p{:g}'.format(pc) for pc in self.PERCENTILES] +
+            ['max'])
+        return '\n'.join([header] + [histogram.summary_string() for histogram in self.histograms.values()])
+
+    # Print the summary table.
+    def dump(self):
+        print('\n' + self.report_string())
+
+    # Write the summary table and the non empty buckets of all histograms to a stats file.
+    def write(self, stats_file_path):
+        os.makedirs(os.path.dirname(stats_file_path), exist_ok=True)
+        with open(stats_file_path, 'w') as stats_file:
+            stats_file.write(self.report_string() + '\n')
+
+            # Buckets as 'highest value (ns): count' to merge or plot sessions later.
+            for histogram in self.histograms.values():
+                stats_file.write('\n[{}]\n'.format(histogram.name))
+                for index, count in enumerate(histogram.counts):
+                    if count:
+                        stats_file.write('{} = {}\n'.format(histogram.bucket_value(index), count))
+
+    # Dump the histograms on SIGUSR1 (not available on Windows).
+    def install_signal_handler(self):
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import time
+import queue
+import struct
+import threading
+
+# Record kinds.
+SESSION = 1  # Start of a process or journal file. t_ns: monotonic anchor, payload: wall clock anchor and boot id.
+CONFIG = 2  # Config file read. payload: config file path.
+LAP = 3  # New lap. value: state of the new lap.
+MARK = 4  # Mark reached.
+RESET = 5  # Reset to config.
+CAR = 6  # Car of the journal, written after each SESSION record. payload: car id.
+
+# Kinds with a payload. The value of these records is the payload length.
+PAYLOAD_KINDS = (SESSION, CONFIG, CAR)
+
+# Record header: kind, value, t_ns.
+RECORD = struct.Struct('<Biq')
+WALL_ANCHOR = struct.Struct('<q')
+
+# Boot id of the kernel. Monotonic clock stamps are only comparable within the same boot.
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+# Marker on the record queue to start a new journal file.
+ROTATE = object()
+
+
+# Get the boot id of the running kernel. Empty, if not available (e.g. not Linux).
+def boot_id():
+    try:
+        with open(BOOT_ID_FILE, 'rb') as boot_id_file:
+            return boot_id_file.read().strip()
+    except OSError:
+        return b''
+
+
+class LapJournal(object):
+    # Append-only binary journal of the timer events.
+    # The timing path only packs a record and puts it on a queue. A writer thread writes the records in batches and
+    # syncs them to disk, so a record is on disk at most batch_time plus one fsync after it was written.
+    # Time stamps are monotonic clock stamps. Each process starts with a SESSION record holding a pair of monotonic
+    # and wall clock anchors and the boot id. Within the same boot the stamps are used as they are. Only after a reboot
+    # they are moved to the clock of the later process by the wall clock anchors.
+    # At a reset the journal file is archived and a new file is started, so a restore only replays the current run.
+    # The car id is written to each file, so the archived files of a car can be grouped (e.g. by the scoring).
+    # Default car id: name of the journal file without extension.
+
+    def __init__(self, journal_file_path, clock, batch_time=0.1, car_id=None):
+        self.journal_file_path = journal_file_path
+        self.clock = clock
+        self.batch_time = batch_time
+        self.car_id = car_id or os.path.splitext(os.path.basename(journal_file_path))[0]
+
+        self.records = queue.Queue()
+        self.thread = None
+
+    # Open the journal for appending and start the writer thread.
+    def open(self):
+        os.makedirs(os.path.dirname(self.journal_file_path), exist_ok=True)
+
+        self.thread = threading.Thread(target=self._write_loop, name='LapJournal', daemon=True)
+        self.thread.start()
+
+        self.write_session()
+
+    # Write the start of a new session with the clock anchors and the boot id, followed by the car id.
+    def write_session(self):
+        self.write(SESSION, self.clock.now(), WALL_ANCHOR.pack(time.time_ns()) + boot_id())
+        self.write(CAR, payload=self.car_id.encode())
+
+    # Archive the journal file and start a new one. The records written before are kept in the archived file.
+    def rotate(self):
+        self.records.put(ROTATE)
+        self.write_session()
+
+    # Append a record. Never blocks on disk.
+    def write(self, kind, t_ns=0, payload=b'', value=0):
+        if kind in PAYLOAD_KINDS:
+            value = len(payload)
+        self.records.put(RECORD.pack(kind, value, t_ns) + payload)
+
+    # Write all pending records and stop the writer thread.
+    def close(self):
+        if self.thread is not None:
+            self.records.put(None)
+            self.thread.join()
+            self.thread = None
+
+    # Get a free path for archiving the journal file: journal name with the wall clock time.
+    def archive_path(self):
+        root, ext = os.path.splitext(self.journal_file_path)
+        archive_path = '{}-{}{}'.format(root, time.strftime('%Y%m%d-%H%M%S'), ext)
+        count = 1
+        while os.path.exists(archive_path):
+            count += 1
+            archive_path = '{}-{}-{}{}'.format(root, time.strftime('%Y%m%d-%H%M%S'), count, ext)
+        return archive_path
+
+    def _write_loop(self):
+        journal_file = open(self.journal_file_path, 'ab')
+        try:
+            running = True
+            while running:
+                # Wait for the first record of a batch. Then collect records for the batch time.
+                batch = [self.records.get()]
+                batch_end = time.monotonic() + self.batch_time
+                while batch[-1] is not None and batch[-1] is not ROTATE:
+                    try:
+                        batch.append(self.records.get(timeout=max(0.0, batch_end - time.monotonic())))
+                    except queue.Empty:
+                        break
+
+                # Stop after this batch, if closed. Start a new file after this batch, if rotated.
+                rotate = batch[-1] is ROTATE
+                if batch[-1] is None or rotate:
+                    running = batch.pop() is not None
+
+                journal_file.write(b''.join(batch))
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+                if rotate:
+                    journal_file.close()
+                    os.replace(self.journal_file_path, self.archive_path())
+                    journal_file = open(self.journal_file_path, 'ab')
+        finally:
+            journal_file.close()
+
+
+# Read the records of a journal as (kind, value, t_ns, payload).
+# Time stamps of a session of the same boot are kept, they are stamps of the same monotonic clock. Time stamps of an
+# earlier boot are moved to the given clock using the session anchors. An incomplete last record (e.g. after a power
+# loss during write) is ignored.
+def read_journal(journal_file_path, clock):
+    with open(journal_file_path, 'rb') as journal_file:
+        data = journal_file.read()
+
+    # Anchors of the current process.
+    mono_now = clock.now()
+    wall_now = time.time_ns()
+    current_boot_id = boot_id()
+
+    records = []
+    offset_ns = 0
+    position = 0
+    while position + RECORD.size <= len(data):
+        kind, value, t_ns = RECORD.unpack_from(data, position)
+        position += RECORD.size
+
+        payload = b''
+        if kind in PAYLOAD_KINDS:
+            if position + value > len(data):
+                break
+            payload = data[position:position + value]
+            position += value
+
+        if kind == SESSION:
+            # Offset of the session clock to the current clock. The wall clock is only used across reboots, it may
+            # jump (e.g. at the NTP sync of a Pi without RTC).
+            session_boot_id = payload[WALL_ANCHOR.size:]
+            if session_boot_id and session_boot_id == current_boot_id:
+                offset_ns = 0
+            else:
+                offset_ns = WALL_ANCHOR.unpack_from(payload)[0] - t_ns - wall_now + mono_now
+        else:
+            records.append((kind, value, t_ns + offset_ns, payload))
+
+    return records
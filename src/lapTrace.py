@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import math
+from array import array
+
+from positionMarks import GridIndex
+
+
+class LapTrace(object):
+    # Position and time trace of a lap. x, y: metres (see gpsInput.LocalProjection), t_ns: time from the lap start.
+    # The points are stored in arrays with the driven distance precomputed.
+    #
+    # A position of a later lap is projected onto the nearest segment of the trace. The search starts at the segment
+    # of the last position and walks along the trace, so a fix costs a few segments, whatever the length of the
+    # trace. The first position and a position far off the trace are found again through a grid index of the
+    # segments. On tracks passing a place twice, the segment with the trace time nearest to the lap time is taken.
+
+    # Minimum distance (m) between two recorded points. Fixes of a standing car are not recorded.
+    MIN_SPACING = 5.0
+    # Maximum distance (m) of a position from the trace. Also the cell size of the grid index.
+    MAX_OFFSET = 25.0
+    # Maximum number of segments walked per position.
+    MAX_WALK = 50
+
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+        self.t_ns = array('q')
+        self.distance = array('d')
+
+        # Grid index of the segments. Built by close().
+        self.index = None
+
+        # Segment of the last position. None: not located yet.
+        self.segment = None
+
+        # Statistics.
+        self.walks = 0
+        self.acquisitions = 0
+
+    def __len__(self):
+        return len(self.x)
+
+    # Add a point of the lap.
+    def add(self, x, y, t_ns):
+        if self.x:
+            step = math.hypot(x - self.x[-1], y - self.y[-1])
+            if step < self.MIN_SPACING:
+                return
+            self.distance.append(self.distance[-1] + step)
+        else:
+            self.distance.append(0.0)
+        self.x.append(x)
+        self.y.append(y)
+        self.t_ns.append(t_ns)
+
+    # Finish the recording. Builds the grid index. A segment is added at points along it, so long segments (e.g.
+    # over a gap of the fixes) are found in every cell they pass.
+    def close(self):
+        self.index = GridIndex(self.MAX_OFFSET)
+        for segment in range(len(self.x) - 1):
+            steps = int((self.distance[segment + 1] - self.distance[segment]) * 2 / self.MAX_OFFSET) + 1
+            for step in range(steps):
+                fraction = step / steps
+                self.index.add(self.x[segment] + fraction * (self.x[segment + 1] - self.x[segment]),
+                               self.y[segment] + fraction * (self.y[segment + 1] - self.y[segment]), segment)
+        self.segment = None
+
+    # Start the projection of a new lap.
+    def restart(self):
+        self.segment = None
+
+    # Get the fraction along a segment (not clamped) and the squared distance of a position from the segment.
+    def project(self, segment, x, y):
+        x0 = self.x[segment]
+        y0 = self.y[segment]
+        dx = self.x[segment + 1] - x0
+        dy = self.y[segment + 1] - y0
+        fraction = ((x - x0) * dx + (y - y0) * dy) / (dx * dx + dy * dy)
+        clamped = min(max(fraction, 0.0), 1.0)
+        ex = x0 + clamped * dx - x
+        ey = y0 + clamped * dy - y
+        return fraction, ex * ex + ey * ey
+
+    # Walk from the segment of the last position along the trace while the position is beyond the segment or the
+    # next segment is nearer. The latter passes short segments pointing backwards by the noise of the fixes.
+    # Returns (segment, fraction, squared distance). None, if the walk is too long.
+    def walk(self, x, y):
+        segment = self.segment
+        last_segment = len(self.x) - 2
+        fraction, distance_2 = self.project(segment, x, y)
+
+        steps = 0
+        while segment < last_segment and steps < self.MAX_WALK:
+            next_fraction, next_distance_2 = self.project(segment + 1, x, y)
+            if fraction <= 1 and next_distance_2 >= distance_2:
+                break
+            segment += 1
+            steps += 1
+            fraction, distance_2 = next_fraction, next_distance_2
+        if not steps:
+            while segment > 0 and steps < self.MAX_WALK:
+                prev_fraction, prev_distance_2 = self.project(segment - 1, x, y)
+                if fraction >= 0 and prev_distance_2 >= distance_2:
+                    break
+                segment -= 1
+                steps += 1
+                fraction, distance_2 = prev_fraction, prev_distance_2
+
+        if steps >= self.MAX_WALK:
+            return None
+        return segment, fraction, distance_2
+
+    # Find the segment of a position through the grid index. Returns (segment, fraction, squared distance) or None.
+    def acquire(self, x, y, lap_ns):
+        self.acquisitions += 1
+        best = None
+        best_key = None
+        for segment in set(self.index.near(x, y)):
+            fraction, distance_2 = self.project(segment, x, y)
+            if distance_2 > self.MAX_OFFSET * self.MAX_OFFSET:
+                continue
+            key = (abs(self.t_ns[segment] - lap_ns), distance_2)
+            if best_key is None or key < best_key:
+                best = segment, fraction, distance_2
+                best_key = key
+        return best
+
+    # Get the driven distance (m) and the trace time (ns) at the projection of a position.
+    # lap_ns: time of the position from the lap start. None, if the position is off the trace.
+    def locate(self, x, y, lap_ns):
+        if len(self.x) < 2 or self.index is None:
+            return None
+
+        located = None
+        if self.segment is not None:
+            self.walks += 1
+            located = self.walk(x, y)
+            if located is not None and located[2] > self.MAX_OFFSET * self.MAX_OFFSET:
+                located = None
+        if located is None:
+            located = self.acquire(x, y, lap_ns)
+            if located is None:
+                self.segment = None
+                return None
+
+        segment, fraction, _ = located
+        self.segment = segment
+        fraction = min(max(fraction, 0.0), 1.0)
+        distance = self.distance[segment] + fraction * (self.distance[segment + 1] - self.distance[segment])
+        t_ns = self.t_ns[segment] + int(fraction * (self.t_ns[segment + 1] - self.t_ns[segment]))
+        return distance, t_ns
+
+    # Get the time (ns) behind the trace at the same place: positive if slower, negative if faster. None, if the
+    # position is off the trace.
+    def delta_ns(self, x, y, lap_ns):
+        located = self.locate(x, y, lap_ns)
+        if located is None:
+            return None
+        return lap_ns - located[1]
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        length = self.distance[-1] if self.distance else 0.0
+        return 'Lap trace: {} points, {:.0f} m, {} walks, {} acquisitions'.format(len(self.x), length, self.walks,
+                                                                                 self.acquisitions)
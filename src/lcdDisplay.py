@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from timeFormat import CachedFormat, NS_PER_HUNDREDTH, format_mm_ss_t, format_countdown, format_delta
+
+
+class LcdDisplay(object):
+    # Composes the two 16 char lines of the LCD from the state of a RegularityRally.
+    # Does not touch any hardware, so it is also used for headless replay.
+
+    # Chars for state display.
+    STATES = {-1: 'o',  # No config (should not appear).
+              0: 'x',  # Ready
+              1: '*',  # Sprint Lap
+              2: 'U',  # Untimed Lap
+              3: 'S',  # Set Lap
+              4: 'C'}  # Confirmation Lap
+
+    def __init__(self):
+        # Formatters of the displayed times. Each keeps its last string until the shown value changes.
+        self.format_lap = CachedFormat(format_mm_ss_t)
+        self.format_ref = CachedFormat(format_mm_ss_t)
+        self.format_countdown = CachedFormat(format_countdown, rounded=True)
+        self.format_delta = CachedFormat(format_delta, NS_PER_HUNDREDTH, rounded=True)
+
+    # Get the display lines for the state of the timer. The timer must be updated before.
+    # Consists of two lines with exactly 16 chars. Format as below
+    # xxxxxxxxxxxxxxxx
+    # 00:00.0  00:00.0
+    # 00.0 99 C BRIDGE
+    # xxxxxxxxxxxxxxxx
+    # With GPS, the set time in a confirmation lap is replaced by the delta to the set lap at the same place, e.g.
+    # '  +1.23' if behind.
+    def compose(self, timer):
+
+        # Init variables for state <=0 (No config or ready).
+        lap_time_str = '--:--.-'
+        ref_time_str = '--:--.-'
+        countdown_str = '--.-'
+        lap_count = 0
+        lap_type_char = self.STATES[timer.state]
+        mark_str = '------'
+
+        # Calculate time delta of current lap.
+        if timer.state > 0:
+
+            # Update current lap time display.
+            lap_time_str = self.format_lap(timer.curlap_ns)
+
+            # Get lap count.
+            lap_count = len(timer.lap_times) + 1
+
+            # Update countdown display, if confirmation lap.
+            if timer.state == 4:
+                # Get countdown.
+                countdown_str = self.format_countdown(timer.curlap_countdown_ns)
+
+                # Get delta to the set lap or set time and use as ref time.
+                delta_ns = timer.live_delta_ns()
+                if delta_ns is not None:
+                    ref_time_str = '{:>7}'.format(self.format_delta(delta_ns))
+                else:
+                    ref_time_str = self.format_ref(timer.cur_set_time)
+
+            elif len(timer.lap_times):
+                # If not in confirmation lap. Show last lap as ref time.
+                ref_time_str = self.format_ref(timer.lap_times[-1])
+
+            # Get mark label.
+            if timer.state in [3, 4]:
+                if timer.mark_count < len(timer.mark_labels):
+                    mark_str = timer.mark_labels[timer.mark_count][0:6]
+                else:
+                    mark_str = 'FINISH'
+
+        # Compose string.
+        return ['{}  {}'.format(lap_time_str, ref_time_str),
+                '{} {: 2} {} {}'.format(countdown_str, lap_count, lap_type_char, mark_str)]
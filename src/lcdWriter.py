@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import threading
+
+
+class LcdWriter(object):
+    # Writer thread of the LCD with a single slot mailbox.
+    # The mainloop posts the latest frame and never waits for the LCD bus. The thread always writes the most recent
+    # frame. A frame, which is replaced before it was written, is dropped.
+    # Errors of the write function are kept for the mainloop, so it can show the error screen.
+
+    def __init__(self, write_frame):
+        # Function writing a frame (list of lines) to the LCD.
+        self.write_frame = write_frame
+
+        # Mailbox. Holds the latest frame not taken by the thread yet.
+        self.condition = threading.Condition()
+        self.frame = None
+        self.last_posted = None
+        self.writing = False
+
+        self.running = False
+        self.thread = None
+
+        # Last error of the write function. Taken by the mainloop.
+        self.error = None
+
+        # Statistics.
+        self.written = 0
+        self.dropped = 0
+
+    # Start the writer thread.
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='LcdWriter', daemon=True)
+        self.thread.start()
+
+    # Stop the writer thread after the pending frame is written.
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Post a frame. Replaces a pending frame. A frame equal to the last posted one is ignored.
+    def post(self, lines):
+        if lines == self.last_posted:
+            return
+        self.last_posted = lines
+
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = lines
+            self.condition.notify_all()
+
+    # Wait until all posted frames are written. Returns False on timeout.
+    def flush(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.frame is None and not self.writing, timeout)
+
+    # Get and clear the last error of the write function. None if there was none.
+    def take_error(self):
+        with self.condition:
+            error = self.error
+            self.error = None
+        return error
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.frame is not None or not self.running)
+                if self.frame is None:
+                    break
+                frame = self.frame
+                self.frame = None
+                self.writing = True
+
+            try:
+                self.write_frame(frame)
+                self.written += 1
+            except Exception as err:
+                # Force the next post, even if it equals the failed frame.
+                self.last_posted = None
+                with self.condition:
+                    self.error = err
+
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'Frames written: {}, dropped: {}'.format(self.written, self.dropped)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+from clock import Clock, NS_PER_S, NS_PER_MS, seconds_to_ns
+from eventTimeline import EventTimeline
+from regularityRally import RegularityRally
+from stagePlan import compile_plan
+
+# Time stamp, which is never reached. Deadline of events, which are done.
+NEVER = np.iinfo(np.int64).max
+
+
+class MultiCarTimer(object):
+    # Timing engine of many cars on the same stage.
+    # The lap states, time stamps, marks and confirmation lap events of all cars are kept in preallocated columns
+    # indexed by car id (struct of arrays). One update per tick computes the lap times and countdowns and dispatches
+    # the due events of all cars vectorized. The cost of a tick does not grow with the laps driven.
+    # The lap and mark logic is the one of RegularityRally.reg_new_lap and mark_reached, the events are the ones of
+    # RegularityRally.compile_timeline.
+    # Time stamps are integer nanoseconds. Car ids passed to one call must be unique.
+
+    DISPLAY_STEP_NS = RegularityRally.DISPLAY_STEP_NS
+    LAPS_DEFAULT = 16
+
+    # Event kinds. Index into KINDS.
+    COUNTDOWN = 0
+    MARK = 1
+    BEEP = 2
+    KINDS = (EventTimeline.COUNTDOWN, EventTimeline.MARK, EventTimeline.BEEP)
+
+    # audio_leads: calibrated lead times (ns) of the sounds by name, see RegularityRally.sound_lead_ns.
+    # laps: initial capacity of laps per car. Grown, if a car drives more laps.
+    def __init__(self, n_cars, config_file_path, clock=None, audio_leads=None, laps=LAPS_DEFAULT,
+                 late_tolerance=0.02):
+        self.clock = clock if clock is not None else Clock()
+        self.n_cars = n_cars
+        self.car_ids = np.arange(n_cars)
+        self.laps = laps
+        self.audio_leads = audio_leads if audio_leads is not None else {}
+        self.late_tolerance_ns = seconds_to_ns(late_tolerance)
+
+        self.read_config(config_file_path)
+
+    # Read a config and reset all cars.
+    # Raises stagePlan.ConfigError for a malformed config.
+    def read_config(self, config_file_path):
+        self.plan = compile_plan(config_file_path)
+        self.states = np.array(self.plan.states, dtype=np.int8)
+        self.mark_labels = [label for label, _ in self.plan.marks]
+        self.n_marks = len(self.mark_labels)
+        self.mark_columns = np.arange(self.n_marks)
+
+        # Event template of a confirmation lap: countdown calls, mark calls and the beep.
+        # Offsets before the lap end are brought forward by the lead time of each sound. The mark offsets of each car
+        # are added when its timeline is compiled.
+        countdown = RegularityRally.COUNTDOWN_TEMPLATE
+        self.template_kinds = np.array([self.COUNTDOWN] * len(countdown) + [self.MARK] * self.n_marks + [self.BEEP],
+                                       dtype=np.int8)
+        self.template_payloads = np.array(countdown + list(range(self.n_marks)) + [-1], dtype=np.int64)
+        self.template_offsets = np.array([num * NS_PER_S + self.sound_lead_ns(num) for num in countdown]
+                                         + [self.sound_lead_ns(label) for label in self.mark_labels]
+                                         + [self.sound_lead_ns(RegularityRally.BEEP_NAME)], dtype=np.int64)
+        self.mark_slice = slice(len(countdown), len(countdown) + self.n_marks)
+        self.n_events = len(self.template_kinds)
+        self.event_columns = np.arange(self.n_events)
+
+        self.reset()
+
+    # Get the lead time (ns) of a sound like RegularityRally.sound_lead_ns.
+    def sound_lead_ns(self, name):
+        default_lead = 0 if name == RegularityRally.BEEP_NAME else seconds_to_ns(RegularityRally.SOUND_DELAY)
+        return self.audio_leads.get(str(name), default_lead) + seconds_to_ns(self.plan.sound_delay)
+
+    # Reset all cars to state 0 (ready) with the marks of the config.
+    def reset(self):
+        n = self.n_cars
+
+        # Lap state (see RaceTimer) and index of the current lap in the config states.
+        self.state = np.zeros(n, dtype=np.int8)
+        self.state_count = np.full(n, -1, dtype=np.int64)
+
+        # Time stamps of all lap starts. stamp_count: number of stamps of each car.
+        self.time_stamps = np.empty((n, self.laps + 1), dtype=np.int64)
+        self.stamp_count = np.zeros(n, dtype=np.int64)
+        self.lap_start = np.zeros(n, dtype=np.int64)
+
+        # Set time and countdowns of the marks (ns before lap end). Updated by the set lap.
+        self.set_time = np.zeros(n, dtype=np.int64)
+        self.mark_offsets = np.tile(np.array([offset for _, offset in self.plan.marks], dtype=np.int64), (n, 1))
+
+        # Marks pressed in the current set lap and mark passages pressed in the current confirmation lap.
+        # mark_count also counts the mark calls of a confirmation lap, like RegularityRally.mark_count.
+        self.mark_count = np.zeros(n, dtype=np.int64)
+        self.mark_stamps = np.empty((n, self.n_marks), dtype=np.int64)
+        self.passage_count = np.zeros(n, dtype=np.int64)
+        self.passage_stamps = np.empty((n, self.n_marks), dtype=np.int64)
+
+        # Current lap time and countdown. Updated by update(). Only valid in a lap or a confirmation lap.
+        self.cur_time_stamp = None
+        self.curlap_ns = np.zeros(n, dtype=np.int64)
+        self.countdown_ns = np.zeros(n, dtype=np.int64)
+
+        # Events of the current confirmation lap, sorted by deadline. event_index: next event of each car,
+        # next_event_ns: its deadline. NEVER if all events are done.
+        self.event_deadlines = np.full((n, self.n_events), NEVER, dtype=np.int64)
+        self.event_kinds = np.empty((n, self.n_events), dtype=np.int8)
+        self.event_payloads = np.empty((n, self.n_events), dtype=np.int64)
+        self.event_index = np.full(n, self.n_events, dtype=np.int64)
+        self.next_event_ns = np.full(n, NEVER, dtype=np.int64)
+
+        # Event statistics of all cars.
+        self.fired = 0
+        self.late = 0
+        self.missed = 0
+        self.max_lateness_ns = 0
+
+    # Grow the time stamp columns, so every car can take the given number of stamps.
+    def reserve_stamps(self, stamps):
+        capacity = self.time_stamps.shape[1]
+        if stamps > capacity:
+            grown = np.empty((self.n_cars, max(stamps, 2 * capacity)), dtype=np.int64)
+            grown[:, :capacity] = self.time_stamps
+            self.time_stamps = grown
+
+    # Get the time stamps of the given cars as array. Without time stamps, the current time is taken for all.
+    def stamps_of(self, cars, time_stamps):
+        if time_stamps is None:
+            return np.full(len(cars), self.clock.now(), dtype=np.int64)
+        return np.broadcast_to(np.asarray(time_stamps, dtype=np.int64), cars.shape)
+
+    # Update all cars. To be executed continuously.
+    # Returns the events due now as arrays (cars, deadlines, kinds, payloads), sorted by deadline.
+    def update(self):
+        now = self.clock.now()
+        self.cur_time_stamp = now
+
+        # Current lap time and countdown of all cars.
+        np.subtract(now, self.lap_start, out=self.curlap_ns)
+        np.subtract(self.set_time, self.curlap_ns, out=self.countdown_ns)
+
+        # Only cars with a due event are looked at.
+        cars = np.flatnonzero(self.next_event_ns <= now)
+        if not cars.size:
+            return cars, cars, cars, cars
+
+        # The events of a car are sorted, so the due events follow its next event.
+        deadlines = self.event_deadlines[cars]
+        due = (deadlines <= now) & (self.event_columns >= self.event_index[cars, None])
+        rows, columns = np.nonzero(due)
+        event_cars = cars[rows]
+        event_deadlines = deadlines[rows, columns]
+        event_kinds = self.event_kinds[event_cars, columns]
+        event_payloads = self.event_payloads[event_cars, columns]
+
+        index = self.event_index[cars] + due.sum(axis=1)
+        self.event_index[cars] = index
+        self.next_event_ns[cars] = np.where(index < self.n_events,
+                                            deadlines[np.arange(len(cars)), np.minimum(index, self.n_events - 1)],
+                                            NEVER)
+
+        # Count the mark calls and the lateness.
+        np.add.at(self.mark_count, event_cars[event_kinds == self.MARK], 1)
+        lateness = now - event_deadlines
+        self.fired += len(lateness)
+        self.late += int(np.count_nonzero(lateness > self.late_tolerance_ns))
+        self.max_lateness_ns = max(self.max_lateness_ns, int(lateness.max()))
+
+        order = np.argsort(event_deadlines, kind='stable')
+        return event_cars[order], event_deadlines[order], event_kinds[order], event_payloads[order]
+
+    # Start a new lap of the given cars.
+    # Stops the time of the previous lap and sets the state like RegularityRally.reg_new_lap.
+    def new_lap(self, cars, time_stamps=None):
+        cars = np.atleast_1d(np.asarray(cars, dtype=np.int64))
+        time_stamps = self.stamps_of(cars, time_stamps)
+
+        # Append the stamps. The lap time is only valid for cars with a stamp before.
+        stamp_count = self.stamp_count[cars]
+        self.reserve_stamps(int(stamp_count.max()) + 1)
+        self.time_stamps[cars, stamp_count] = time_stamps
+        self.stamp_count[cars] = stamp_count + 1
+        lap_times = time_stamps - self.lap_start[cars]
+        self.lap_start[cars] = time_stamps
+
+        # Get the next lap state from the config. After the configured laps: fast lap.
+        last_state = self.state[cars]
+        state_count = self.state_count[cars] + 1
+        self.state_count[cars] = state_count
+        state = np.where(state_count < len(self.states),
+                         self.states[np.minimum(state_count, len(self.states) - 1)], 1).astype(np.int8)
+        self.state[cars] = state
+
+        # Update the set time and the countdowns of the marks passed in a finished set lap.
+        setting = last_state == 3
+        if setting.any():
+            set_cars = cars[setting]
+            self.set_time[set_cars] = lap_times[setting]
+            passed = self.mark_columns < self.mark_count[set_cars, None]
+            self.mark_offsets[set_cars] = np.where(passed,
+                                                   time_stamps[setting, None] - self.mark_stamps[set_cars],
+                                                   self.mark_offsets[set_cars])
+
+        # Close the timelines of finished confirmation laps. Events not fired yet are counted as missed.
+        closing = cars[last_state == 4]
+        if closing.size:
+            self.missed += int((self.n_events - self.event_index[closing]).sum())
+            self.event_index[closing] = self.n_events
+            self.next_event_ns[closing] = NEVER
+
+        # Compile the timelines of started confirmation laps.
+        self.compile_timelines(cars[state == 4])
+
+        # Reset the marks.
+        self.mark_count[cars] = 0
+        self.passage_count[cars] = 0
+
+    # Compile the events of confirmation laps starting at the last stamp of the given cars.
+    def compile_timelines(self, cars):
+        if not cars.size:
+            return
+
+        offsets = np.tile(self.template_offsets, (len(cars), 1))
+        offsets[:, self.mark_slice] += self.mark_offsets[cars]
+        deadlines = (self.lap_start[cars] + self.set_time[cars])[:, None] - offsets
+
+        # Sort stable by deadline, so events with the same deadline keep their order.
+        order = np.argsort(deadlines, axis=1, kind='stable')
+        self.event_deadlines[cars] = np.take_along_axis(deadlines, order, axis=1)
+        self.event_kinds[cars] = self.template_kinds[order]
+        self.event_payloads[cars] = self.template_payloads[order]
+        self.event_index[cars] = 0
+        self.next_event_ns[cars] = self.event_deadlines[cars, 0]
+
+    # Get the time stamp of a mark in state 3 (set lap) of the given cars.
+    # In state 4 (confirmation lap) the passage is recorded for analysis. Marks beyond the configured ones are counted,
+    # but not stored.
+    def mark_reached(self, cars, time_stamps=None):
+        cars = np.atleast_1d(np.asarray(cars, dtype=np.int64))
+        time_stamps = self.stamps_of(cars, time_stamps)
+        state = self.state[cars]
+
+        for lap_state, count, stamps in [(3, self.mark_count, self.mark_stamps),
+                                         (4, self.passage_count, self.passage_stamps)]:
+            in_state = state == lap_state
+            if not in_state.any():
+                continue
+            state_cars = cars[in_state]
+            index = count[state_cars]
+            stored = index < self.n_marks
+            stamps[state_cars[stored], index[stored]] = time_stamps[in_state][stored]
+            count[state_cars] = index + 1
+
+    # Get the time stamp (ns) of the next instant that visibly or audibly matters for any car.
+    # See RegularityRally.next_deadline_ns. Returns None, if no lap is running.
+    def next_deadline_ns(self, step_ns=None):
+        running = self.state != 0
+        if self.cur_time_stamp is None or not running.any():
+            return None
+
+        step_ns = step_ns or self.DISPLAY_STEP_NS
+        curlap = self.curlap_ns[running]
+        deadline = int((self.lap_start[running] + (curlap // step_ns + 1) * step_ns).min())
+
+        # Next change of the rounded countdown display and next event of the confirmation laps.
+        confirming = self.state == 4
+        if confirming.any():
+            countdown = self.countdown_ns[confirming]
+            half_step = step_ns // 2
+            changes = self.cur_time_stamp + countdown - ((countdown - half_step - 1) // step_ns * step_ns + half_step)
+            deadline = min(deadline, int(changes.min()), int(self.next_event_ns.min()))
+
+        return deadline
+
+    # Get the lap times (ns) of a car.
+    def lap_times(self, car):
+        return np.diff(self.time_stamps[car, :self.stamp_count[car]])
+
+    # Get the name of the sound of an event, like the text said by RegularityRally.
+    def sound_name(self, kind, payload):
+        if kind == self.COUNTDOWN:
+            return str(payload)
+        elif kind == self.MARK:
+            return self.mark_labels[payload]
+        return RegularityRally.BEEP_NAME
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'Cars: {}, events fired: {}, late: {}, missed: {}, max late: {:.2f} ms'.format(self.n_cars,
+                                                                                          self.fired,
+                                                                                          self.late,
+                                                                                          self.missed,
+                                                                                          self.max_lateness_ns
+                                                                                          / NS_PER_MS)
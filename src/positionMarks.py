@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import math
+from collections import namedtuple
+
+# Mark position recorded in the set lap. x, y: metres (see gpsInput.LocalProjection). hx, hy: unit driving direction
+# of the set lap at the mark, (0, 0) if unknown. lap_ns: time of the mark from the start of the set lap.
+MarkPoint = namedtuple('MarkPoint', ['x', 'y', 'hx', 'hy', 'lap_ns'])
+
+
+class GridIndex(object):
+    # Uniform grid over items at points in the plane.
+    # The items near a point are found in constant time by looking at its cell and the 8 neighbouring cells, i.e.
+    # all items within cell_size and some more. For a larger distance, more rings of cells are looked at.
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, x, y, item):
+        self.cells.setdefault(self.cell(x, y), []).append(item)
+
+    # Get the items in the cell of the point and its neighbouring cells, at least all items within distance.
+    def near(self, x, y, distance=0.0):
+        cx, cy = self.cell(x, y)
+        rings = max(1, math.ceil(distance / self.cell_size))
+        items = []
+        for ix in range(cx - rings, cx + rings + 1):
+            for iy in range(cy - rings, cy + rings + 1):
+                items += self.cells.get((ix, iy), ())
+        return items
+
+
+class PositionMarks(object):
+    # Marks of a confirmation lap triggered by position.
+    # Each mark has a gate through its set lap position, perpendicular to the driving direction of the set lap. A mark
+    # is reached at a fix, which is at most radius beside the gate and at most the lead distance of its call before
+    # it, so the call is heard at the gate. A fix just behind the gate (e.g. after a gap of the fixes) also reaches it.
+    # On tracks passing a place twice, a mark is only reached after min_fraction of its set lap time.
+
+    RADIUS = 20.0
+    MIN_FRACTION = 0.5
+
+    # points: MarkPoint by label.
+    def __init__(self, points, radius=RADIUS, min_fraction=MIN_FRACTION):
+        self.radius = radius
+        self.min_fraction = min_fraction
+
+        self.index = GridIndex(radius)
+        for label, point in points.items():
+            self.index.add(point.x, point.y, (label, point))
+        self.labels = set(points)
+
+        # Labels reached in this lap.
+        self.reached_labels = set()
+
+    # Get the labels of the marks reached at a position.
+    # curlap_ns: time since the start of the lap. lead_distance: function returning the lead distance (m) of a label.
+    # max_lead_distance: largest lead distance (m) of all labels. The marks are searched within it, so a call with a
+    # lead distance beyond the grid cells is not late.
+    def reached(self, x, y, curlap_ns, lead_distance, max_lead_distance=0.0):
+        reached = []
+        for label, point in self.index.near(x, y, math.hypot(max_lead_distance, self.radius)):
+            if label in self.reached_labels or curlap_ns < self.min_fraction * point.lap_ns:
+                continue
+
+            dx = x - point.x
+            dy = y - point.y
+            if point.hx == 0 and point.hy == 0:
+                # Without driving direction, only the distance counts.
+                hit = dx * dx + dy * dy <= self.radius * self.radius
+            else:
+                # Distance along the driving direction (negative before the gate) and beside the mark.
+                along = dx * point.hx + dy * point.hy
+                beside = abs(dx * point.hy - dy * point.hx)
+                hit = -lead_distance(label) <= along <= self.radius and beside <= self.radius
+            if hit:
+                self.reached_labels.add(label)
+                reached.append(label)
+        return reached
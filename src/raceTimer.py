@@ -1,20 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-import time
 import os
 import pathlib
 
 from util import decode_seconds
-
-
-# TODO: Add autosave file
+from clock import Clock, NS_PER_S, ns_to_seconds
 
 
 class RaceTimer(object):
+    # Resolution of the displayed lap time.
+    DISPLAY_STEP_NS = NS_PER_S // 10
 
-    def __init__(self):
+    def __init__(self, clock=None):
         # Data attribute initialization.
+        # Clock used for all time stamps. Stamps are stored as integer nanoseconds.
+        self.clock = clock if clock is not None else Clock()
+
         # Directories.
         self.root_dir = pathlib.Path(__file__).parent.parent.absolute()
         self.config_dir = os.path.join(self.root_dir, 'config')
@@ -33,6 +35,7 @@ class RaceTimer(object):
         self.state_count = -1  # Initialised with -1 to be set to 0 on start.
 
         # Coordinates.
+        # (lat, lon) of both ends of the finish line. Used by the GPS lap detection.
         self.finish_line_coordinates = [None] * 2
 
         # Times.
@@ -40,8 +43,8 @@ class RaceTimer(object):
         self.lap_times = []
         self.lap_times_decoded = []
 
+        self.curlap_ns = None
         self.curlap_seconds = None
-        self.curlap_decoded = [0.0] * 3
         self.curlap_string = None
 
         self.cur_time_stamp = None
@@ -52,29 +55,47 @@ class RaceTimer(object):
     # Method to be executed continuously.
     def update(self):
         # Get current time stamp.
-        self.cur_time_stamp = time.time()
+        self.cur_time_stamp = self.clock.now()
 
-        # Get current lap seconds.
+        # Get current lap time. Convert to seconds only for display.
         if self.state:
-            self.curlap_seconds = self.cur_time_stamp - self.time_stamps[-1]
-            self.curlap_decoded = decode_seconds(self.curlap_seconds)
+            self.curlap_ns = self.cur_time_stamp - self.time_stamps[-1]
+            self.curlap_seconds = ns_to_seconds(self.curlap_ns)
+
+    # Current lap time decoded to [hours, minutes, seconds, thousandths].
+    # Decoded on access only. The frontends format curlap_ns directly.
+    @property
+    def curlap_decoded(self):
+        if self.curlap_seconds is None:
+            return [0] * 4
+        return decode_seconds(self.curlap_seconds)
+
+    # Get the time stamp (ns) of the next change of the displayed lap time.
+    # step_ns is the resolution of the display. Returns None, if no lap is running.
+    def next_deadline_ns(self, step_ns=None):
+        if not self.state or self.curlap_ns is None:
+            return None
+
+        step_ns = step_ns or self.DISPLAY_STEP_NS
+        return self.time_stamps[-1] + (self.curlap_ns // step_ns + 1) * step_ns
 
     # Method to start a new lap.
     # Stops time for previous lap and sets state.
-    def new_lap(self):
+    # An already taken time stamp (ns) can be given, e.g. from an input edge.
+    def new_lap(self, time_stamp=None):
 
         # Append current time as stamp.
         # This must always be the first statement to keep the error low!
-        self.time_stamps.append(time.time())
+        self.time_stamps.append(self.clock.now() if time_stamp is None else time_stamp)
 
         # Get lap time if not first lap. $
         if len(self.time_stamps) > 1:
-            # Get time in seconds.
-            time_seconds = self.time_stamps[-1] - self.time_stamps[-2]
+            # Get time in nanoseconds.
+            time_ns = self.time_stamps[-1] - self.time_stamps[-2]
 
-            # Add time in seconds and decoded to the related attributes.
-            self.lap_times.append(time_seconds)
-            self.lap_times_decoded.append(decode_seconds(time_seconds))
+            # Add time in nanoseconds and decoded to the related attributes.
+            self.lap_times.append(time_ns)
+            self.lap_times_decoded.append(decode_seconds(ns_to_seconds(time_ns)))
 
     # Update lap attributes and print current time.
     def debug_update(self):
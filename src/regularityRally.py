@@ -2,52 +2,127 @@
 # -*- coding: UTF-8 -*-
 
 import os
-import time
+import math
 import subprocess
-import pygame
 import platform
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from raceTimer import RaceTimer
+from clock import NS_PER_S, ns_to_seconds, seconds_to_ns
+from timeFormat import NS_PER_TENTH, NS_PER_HUNDREDTH
+from eventTimeline import EventTimeline
+from speechCache import SpeechCache
+from audioCalibration import init_mixer, read_calibration
+from instrumentation import Instrumentation
+from stagePlan import ConfigWatcher, ConfigError, compile_plan
+from positionMarks import MarkPoint, PositionMarks
+from lapTrace import LapTrace
+import lapJournal
 
 
 class RegularityRally(RaceTimer):
     COUNTDOWN_TEMPLATE = [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
     SOUND_DELAY = 0.1
+    FINISH_TEXT = 'finish'
+    VOICE_DEFAULT = 'en'
+    BEEP_NAME = 'beep'
+    MIXER_MODE_DEFAULT = 'default'
 
-    def __init__(self):
-        super().__init__()
+    # A GPS fix older than this (s) counts as no fix. Marks are called by time then.
+    FIX_TIMEOUT = 1.0
+    # Minimum distance (m) between two fixes to get the driving direction.
+    MIN_HEADING_DISTANCE = 0.5
+
+    # Without audio (e.g. for headless replay) no sounds are loaded or played.
+    def __init__(self, clock=None, audio=True):
+        super().__init__(clock)
+        self.audio = audio
 
         # Initialization of specific attributes.
         # Current folder
         self.folder_src = os.path.dirname(__file__)
         self.folder_main = os.path.dirname(self.folder_src)
         self.folder_support = os.path.join(self.folder_main, 'supportFiles')
+        self.folder_speech_cache = os.path.join(self.folder_main, 'cache', 'speech')
+        self.audio_calibration_file = os.path.join(self.folder_main, 'cache', 'audio_calibration.cfg')
+        self.stats_file = os.path.join(self.folder_main, 'journal', 'timing_stats.txt')
 
-        # Regularity config.
+        # Regularity config. Working copy of the compiled stage plan. The marks are updated by the set lap.
+        self.plan = None
         self.config = {}
         self.mark_count = 0
         self.mark_stamps = []
         self.mark_labels = []
-        self.mark_numbers = []
+
+        # Mark passages pressed in the current confirmation lap. Only used for analysis.
+        self.mark_passages = []
 
         # Set time.
         self.cur_set_time = None
         self.cur_set_time_decoded = None
 
         # Countdown.
+        self.curlap_countdown_ns = None
         self.curlap_countdown_seconds = None
         self.curlap_countdown_text = None  # TODO: Check if needed
-        self.cur_countdown_num = 0
-        self.beep_done = False
         self.sound_delay = 0
 
-        # Speak engine.
-        self.countdown_checks = self.COUNTDOWN_TEMPLATE
+        # Timeline of countdown, mark and beep events of the confirmation lap.
+        self.timeline = EventTimeline()
+
+        # Speak engine. Preloaded clips by text.
         self.os = platform.system()
+        self.speech_clips = {}
 
         # Beep engine.
-        pygame.init()
-        self.beep_object = pygame.mixer.Sound(os.path.join(self.folder_support, 'beep_outtake.wav'))
+        # mixer_mode: configured mixer mode. mixer_init_mode: mode of the running mixer, None before it is initialized.
+        self.mixer_mode = self.MIXER_MODE_DEFAULT
+        self.mixer_init_mode = None
+        self.beep_object = None
+
+        # Audio loader. pygame is imported, only the mixer is initialized and the sounds are loaded in the background,
+        # so the timer is ready to time before. Jobs run in order of submission. audio_job is the latest one.
+        self.audio_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AudioLoader') if self.audio else None
+        self.audio_job = None
+
+        # Calibrated lead times (ns) of the sounds by name.
+        self.audio_leads = {}
+
+        # Journal of laps, marks and resets. Not written while replaying.
+        self.journal = None
+        self.replaying = False
+
+        # Latency histograms of the loop, display, input and audio events.
+        self.instrumentation = Instrumentation(self.clock)
+
+        # Watcher of the config file for changes. Started by watch_config().
+        self.config_watcher = None
+
+        # GPS. Last fix (gpsInput.Fix) and the fix before.
+        self.fix = None
+        self.prev_fix = None
+
+        # Mark positions (positionMarks.MarkPoint) by label, recorded in the set lap.
+        self.mark_points = {}
+        # Positions of the marks of the current set lap, aligned with mark_stamps. None without fix.
+        # Mark presses waiting for the next fix as (mark id, time from the lap start in ns).
+        self.mark_positions = []
+        self.pending_mark_positions = []
+
+        # Position triggered marks of the confirmation lap and the largest sound lead (ns) of their calls. Marks due
+        # by time, which are left to their position.
+        self.position_marks = None
+        self.max_mark_lead_ns = 0
+        self.deferred_marks = []
+
+        # Position and time trace of the last set lap and the one recorded in the current set lap.
+        # Time (ns) behind the set lap at the same place in the confirmation lap, at the last fix. None without.
+        self.set_trace = None
+        self.recording_trace = None
+        self.curlap_delta_ns = None
+
+        # Publisher of the timer state (telemetry.TelemetryPublisher). Set by the frontend. None: no telemetry.
+        self.telemetry = None
 
     def reg_update(self):
         # Perform timer update.
@@ -55,38 +130,196 @@ class RegularityRally(RaceTimer):
 
         # If confirmation lap, get countdown seconds.
         if self.state == 4:
-            self.curlap_countdown_seconds = self.cur_set_time - self.curlap_seconds
-
-            # Process countdown reading
-            # Check if last countdown was already read.
-            if self.cur_countdown_num is not None:
-                # Check if countdown mark is reached and say it.
-                if self.curlap_countdown_seconds <= self.cur_countdown_num + self.SOUND_DELAY:
-                    self.espeak_say(self.cur_countdown_num)
-
-                    # Check if countdown list is not empty and pop next item. Else apply None.
-                    if self.countdown_checks:
-                        self.cur_countdown_num = self.countdown_checks.pop(0)
-                    else:
-                        self.cur_countdown_num = None
-            elif not self.beep_done and self.curlap_countdown_seconds <= 0:
-                # If last mark was read, check for beep on time 0.
-                self.beep_object.play()
-                self.beep_done = True
-
-            # Process marks reading.
-            if len(self.mark_labels) > self.mark_count:
-                if self.curlap_countdown_seconds <= self.mark_numbers[self.mark_count]:
-                    self.espeak_say(self.mark_labels[self.mark_count])
-                    self.mark_count += 1
+            self.curlap_countdown_ns = self.cur_set_time - self.curlap_ns
+            self.curlap_countdown_seconds = ns_to_seconds(self.curlap_countdown_ns)
+
+            # Fire all countdown, mark and beep events that are due. Lateness is recorded after the sound is started.
+            for deadline, kind, payload in self.timeline.dispatch(self.cur_time_stamp):
+                self.fire_event(kind, payload)
+                self.instrumentation.record_since(Instrumentation.AUDIO_LATENESS, deadline)
+
+            # Call the marks left to their position by time, if the GPS fix is lost.
+            if self.deferred_marks and not self.gps_live(self.cur_time_stamp):
+                for label in self.deferred_marks:
+                    if label not in self.position_marks.reached_labels:
+                        self.position_marks.reached_labels.add(label)
+                        self.call_mark(label)
+                self.deferred_marks = []
+
+        self.publish_telemetry()
+
+    # Post the timer state to the telemetry publisher. Does not wait for the network.
+    def publish_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.publish(self.telemetry_state())
+
+    # Get the timer state, which the LCD shows, for the telemetry. Times in tenths, the delta in hundredths (see
+    # telemetry for the fields).
+    def telemetry_state(self):
+        state = {'st': self.state, 'lap': len(self.lap_times) + 1, 't': None, 'cd': None, 'set': None, 'last': None,
+                 'mk': None, 'dl': None}
+        if self.state > 0 and self.curlap_ns is not None:
+            state['t'] = self.curlap_ns // NS_PER_TENTH
+        if self.state == 4 and self.curlap_countdown_ns is not None:
+            state['cd'] = (self.curlap_countdown_ns + NS_PER_TENTH // 2) // NS_PER_TENTH
+            delta_ns = self.live_delta_ns()
+            if delta_ns is not None:
+                state['dl'] = (delta_ns + NS_PER_HUNDREDTH // 2) // NS_PER_HUNDREDTH
+        if self.cur_set_time is not None:
+            state['set'] = self.cur_set_time // NS_PER_TENTH
+        if self.lap_times:
+            state['last'] = self.lap_times[-1] // NS_PER_TENTH
+        if self.state in (3, 4):
+            state['mk'] = self.mark_labels[self.mark_count] if self.mark_count < len(self.mark_labels) else 'FINISH'
+        return state
+
+    # Fire an event of the confirmation lap timeline.
+    def fire_event(self, kind, payload):
+        if kind == EventTimeline.COUNTDOWN:
+            self.espeak_say(payload)
+        elif kind == EventTimeline.MARK:
+            if not self.left_to_position(payload):
+                self.call_mark(payload)
+        elif kind == EventTimeline.BEEP:
+            self.play_beep()
+
+    # Call a mark.
+    def call_mark(self, label):
+        self.espeak_say(label)
+        self.mark_count += 1
+
+    # Check, if the timed call of a mark is left to its position: the mark has a set lap position and was reached
+    # already or the GPS has a fix. Without fix, the mark is called by time and not at its position anymore.
+    def left_to_position(self, label):
+        if self.position_marks is None or label not in self.position_marks.labels:
+            return False
+        if label in self.position_marks.reached_labels:
+            return True
+        if self.gps_live(self.cur_time_stamp):
+            self.deferred_marks.append(label)
+            return True
+        self.position_marks.reached_labels.add(label)
+        return False
+
+    # Check, if the last GPS fix is recent.
+    def gps_live(self, now_ns):
+        return self.fix is not None and now_ns - self.fix.t_ns < seconds_to_ns(self.FIX_TIMEOUT)
+
+    # Handle a GPS fix (gpsInput.Fix).
+    # In a set lap, the positions of the marks pressed before the fix are interpolated. In a confirmation lap, the
+    # marks reached at the fix are called.
+    def gps_fix(self, fix):
+        self.prev_fix = self.fix
+        self.fix = fix
+
+        if self.state == 3:
+            while self.pending_mark_positions and self.mark_stamps[self.pending_mark_positions[0][0]] <= fix.t_ns:
+                self.resolve_mark_position(*self.pending_mark_positions.pop(0))
+            if self.recording_trace is not None and fix.t_ns >= self.time_stamps[-1]:
+                self.recording_trace.add(fix.x, fix.y, fix.t_ns - self.time_stamps[-1])
+
+        elif self.state == 4:
+            lap_ns = fix.t_ns - self.time_stamps[-1]
+            if self.set_trace is not None:
+                self.curlap_delta_ns = self.set_trace.delta_ns(fix.x, fix.y, lap_ns)
+
+            if self.position_marks is not None:
+                speed = self.fix_speed()
+                for label in self.position_marks.reached(fix.x, fix.y, lap_ns,
+                                                         lambda name: speed * ns_to_seconds(self.sound_lead_ns(name)),
+                                                         speed * ns_to_seconds(self.max_mark_lead_ns)):
+                    self.call_mark(label)
+
+    # Get the time (ns) behind the set lap at the same place in a confirmation lap. None without recent fix or set
+    # lap trace.
+    def live_delta_ns(self):
+        if self.state != 4 or self.curlap_delta_ns is None or not self.gps_live(self.cur_time_stamp):
+            return None
+        return self.curlap_delta_ns
+
+    # Get the speed (m/s) at the last fix. Taken from the receiver or from the last two fixes.
+    def fix_speed(self):
+        if self.fix.speed is not None:
+            return self.fix.speed
+        if self.prev_fix is None or self.fix.t_ns <= self.prev_fix.t_ns:
+            return 0.0
+        return math.hypot(self.fix.x - self.prev_fix.x, self.fix.y - self.prev_fix.y) / ns_to_seconds(
+            self.fix.t_ns - self.prev_fix.t_ns)
+
+    # Set the position of a mark of the set lap, interpolated between the last two fixes at the time of the press.
+    # No position, if there is no recent fix.
+    def resolve_mark_position(self, mark_id, lap_ns):
+        t_ns = self.mark_stamps[mark_id]
+        fix_0, fix_1 = self.prev_fix, self.fix
+        if fix_1 is None or abs(fix_1.t_ns - t_ns) > seconds_to_ns(self.FIX_TIMEOUT):
+            return
+
+        if fix_0 is None or fix_1.t_ns - fix_0.t_ns > seconds_to_ns(self.FIX_TIMEOUT) or fix_1.t_ns == fix_0.t_ns:
+            self.mark_positions[mark_id] = MarkPoint(fix_1.x, fix_1.y, 0.0, 0.0, lap_ns)
+            return
+
+        fraction = min(max((t_ns - fix_0.t_ns) / (fix_1.t_ns - fix_0.t_ns), 0.0), 1.0)
+        dx = fix_1.x - fix_0.x
+        dy = fix_1.y - fix_0.y
+        distance = math.hypot(dx, dy)
+        hx, hy = (dx / distance, dy / distance) if distance >= self.MIN_HEADING_DISTANCE else (0.0, 0.0)
+        self.mark_positions[mark_id] = MarkPoint(fix_0.x + fraction * dx, fix_0.y + fraction * dy, hx, hy, lap_ns)
+
+    # Play the beep at the end of the confirmation lap.
+    def play_beep(self):
+        if self.beep_object is not None:
+            self.beep_object.play()
+
+    # Get the lead time (ns) of a sound: calibrated lead plus the configured sound delay.
+    # Uncalibrated spoken clips use SOUND_DELAY.
+    def sound_lead_ns(self, name):
+        default_lead = 0 if name == self.BEEP_NAME else seconds_to_ns(self.SOUND_DELAY)
+        return self.audio_leads.get(str(name), default_lead) + seconds_to_ns(self.sound_delay)
+
+    # Compile the countdown, mark and beep events of a confirmation lap starting now.
+    # Deadlines are absolute time stamps (ns), brought forward by the lead time of each sound.
+    def compile_timeline(self):
+        lap_end = self.time_stamps[-1] + self.cur_set_time
+
+        events = [(lap_end - num * NS_PER_S - self.sound_lead_ns(num), EventTimeline.COUNTDOWN, num)
+                  for num in self.COUNTDOWN_TEMPLATE]
+        events += [(lap_end - offset - self.sound_lead_ns(label), EventTimeline.MARK, label)
+                   for label, offset in self.config['marks'].items()]
+        events.append((lap_end - self.sound_lead_ns(self.BEEP_NAME), EventTimeline.BEEP, None))
+
+        self.timeline.compile(events)
+
+    # Get the time stamp (ns) of the next instant that visibly or audibly matters.
+    # Adds the next countdown display change, countdown call, mark call and the beep in a confirmation lap.
+    def next_deadline_ns(self, step_ns=None):
+        deadline = super().next_deadline_ns(step_ns)
+
+        if self.state == 4 and self.curlap_countdown_ns is not None:
+            step_ns = step_ns or self.DISPLAY_STEP_NS
+            deadlines = [deadline]
+
+            # Next change of the rounded countdown display.
+            countdown = self.curlap_countdown_ns
+            half_step = step_ns // 2
+            deadlines.append(self.cur_time_stamp + countdown - (((countdown - half_step - 1) // step_ns) * step_ns
+                                                                 + half_step))
+
+            # Next countdown call, mark call or beep.
+            deadlines.append(self.timeline.next_deadline_ns())
+
+            deadline = min(dl for dl in deadlines if dl is not None)
+
+        return deadline
 
     # Start new lap.
-    def reg_new_lap(self, *args):
+    # The optional time stamp (ns) is passed to new_lap.
+    def reg_new_lap(self, *args, time_stamp=None):
         # Save last state.
         last_state = self.state
 
         # Run basic new_lap method.
-        self.new_lap()
+        self.new_lap(time_stamp)
+        time_stamp = self.time_stamps[-1]
 
         # Increment state count.
         self.state_count += 1
@@ -108,33 +341,76 @@ class RegularityRally(RaceTimer):
                 # If nothing is given, start normal lap.
                 self.state = 1
 
+        # Swap in a changed config at this lap boundary.
+        if self.config_watcher is not None and not self.replaying:
+            self.swap_pending_plan()
+
         # Update set time if applicable.
         if last_state == 3:
             self.cur_set_time = self.lap_times[-1]
             self.cur_set_time_decoded = self.lap_times_decoded[-1]
 
-            # Also set calculate countdown times for marks.
+            # The trace of the set lap is the reference of the delta in the confirmation laps.
+            if self.recording_trace is not None and len(self.recording_trace) >= 2:
+                self.recording_trace.close()
+                self.set_trace = self.recording_trace
+
+            # Marks pressed after the last fix get the position of the last fix.
+            for mark_id, lap_ns in self.pending_mark_positions:
+                self.resolve_mark_position(mark_id, lap_ns)
+            self.pending_mark_positions = []
+
+            # Also set calculate countdown times and positions for marks.
             for ma_id, ma in enumerate(self.config['marks']):
                 if len(self.mark_stamps) > ma_id:
                     self.config['marks'][ma] = self.time_stamps[-1] - self.mark_stamps[ma_id]
+                    if self.mark_positions[ma_id] is not None:
+                        self.mark_points[ma] = self.mark_positions[ma_id]
                 else:
                     break
 
-        # Reset countdown template at start of confirmation lap.
+        # Journal the new lap with its state.
+        self.journal_write(lapJournal.LAP, time_stamp, value=self.state)
+
+        # Close timeline of the finished confirmation lap and report its events.
+        if last_state == 4:
+            self.timeline.close()
+            print(self.timeline.stats_string())
+            if self.set_trace is not None:
+                print(self.set_trace.stats_string())
+
+        # Compile the event timeline at start of confirmation lap. Marks with a set lap position are called there.
+        self.position_marks = None
+        self.deferred_marks = []
+        self.curlap_delta_ns = None
         if self.state == 4:
-            self.countdown_checks = self.COUNTDOWN_TEMPLATE.copy()
-            self.cur_countdown_num = self.countdown_checks.pop(0)
-            self.beep_done = False
-            if self.config['marks']:
-                self.mark_numbers = list(self.config['marks'].values())
+            self.compile_timeline()
+            if self.mark_points:
+                self.position_marks = PositionMarks(self.mark_points)
+                self.max_mark_lead_ns = max(self.sound_lead_ns(label) for label in self.mark_points)
+            if self.set_trace is not None:
+                self.set_trace.restart()
 
         # Reset mark count.
         self.mark_count = 0
+        self.mark_passages = []
         if self.state == 3:
             self.mark_stamps = []
+            self.mark_positions = []
+            self.pending_mark_positions = []
+        self.recording_trace = LapTrace() if self.state == 3 else None
+
+        self.publish_telemetry()
 
+    # Say a text. Use the preloaded clip if available, else start eSpeak.
     def espeak_say(self, text):
-        if self.os == 'Windows':
+        if not self.audio:
+            return
+
+        clip = self.speech_clips.get(str(text))
+        if clip is not None:
+            clip.play()
+        elif self.os == 'Windows':
             subprocess.Popen('{} {}'.format(self.config['misc']['espeakpath'],
                                             text))
         else:
@@ -142,56 +418,238 @@ class RegularityRally(RaceTimer):
             pass
             # subprocess.Popen('espeak {}'.format(text))
 
+    # Synthesize (if not cached yet) and preload the clips of all texts of a stage plan. Returns the clips by text.
+    def load_speech_clips(self, plan):
+        # Get the eSpeak command. The configured path is only valid on Windows.
+        if self.os == 'Windows' and 'espeakpath' in plan.misc:
+            espeak_command = plan.misc['espeakpath'].strip('"')
+        else:
+            espeak_command = plan.misc.get('espeak_command', 'espeak')
+
+        speech_cache = SpeechCache(self.folder_speech_cache,
+                                   espeak_command,
+                                   plan.misc.get('voice', self.VOICE_DEFAULT))
+
+        # Countdown numbers, mark labels and finish.
+        texts = self.COUNTDOWN_TEMPLATE + [label for label, _ in plan.marks] + [self.FINISH_TEXT]
+
+        import pygame
+        return {text: pygame.mixer.Sound(path) for text, path in speech_cache.get_all(texts).items()}
+
+    # Get all preloaded sounds by name.
+    def audio_sounds(self):
+        sounds = {self.BEEP_NAME: self.beep_object}
+        sounds.update(self.speech_clips)
+        return sounds
+
+    # (Re-)init the mixer, if it does not run in the configured mixer mode, and reload the beep.
+    def update_mixer_mode(self):
+        import pygame
+
+        mixer_mode = self.mixer_mode
+        if mixer_mode != self.mixer_init_mode:
+            init_mixer(mixer_mode)
+            self.mixer_init_mode = mixer_mode
+            self.beep_object = pygame.mixer.Sound(os.path.join(self.folder_support, 'beep_outtake.wav'))
+
+    # Run an audio job in the audio loader. Returns its future. The result of a failed job is None.
+    def load_audio(self, function, *args):
+        self.audio_job = self.audio_loader.submit(self.run_audio_job, function, *args)
+        return self.audio_job
+
+    def run_audio_job(self, function, *args):
+        # noinspection PyBroadException
+        try:
+            return function(*args)
+        except Exception as err:
+            print('Audio not available: {}'.format(err))
+            return None
+
+    # Init the mixer and load the sounds of a stage plan. Runs in the audio loader.
+    def load_plan_audio(self, plan):
+        self.update_mixer_mode()
+        self.speech_clips = self.load_speech_clips(plan)
+
+    # Wait until all submitted audio jobs are done. Returns False on timeout.
+    def wait_audio(self, timeout=None):
+        if self.audio_job is None:
+            return True
+        return not wait([self.audio_job], timeout).not_done
+
     # Get the time stamp of a mark for state 3 (set lap).
-    def mark_reached(self):
+    # In state 4 (confirmation lap) the passage is recorded for analysis. The mark calls are not changed.
+    def mark_reached(self, time_stamp=None):
         if self.state == 3:
-            self.mark_stamps.append(time.time())
+            self.mark_stamps.append(self.clock.now() if time_stamp is None else time_stamp)
             self.mark_count += 1
 
-    # Reset the timer to the currently loaded configuration.
+            # The position is taken at the next fix.
+            self.mark_positions.append(None)
+            self.pending_mark_positions.append((len(self.mark_stamps) - 1, self.mark_stamps[-1] - self.time_stamps[-1]))
+            self.journal_write(lapJournal.MARK, self.mark_stamps[-1])
+        elif self.state == 4:
+            self.mark_passages.append(self.clock.now() if time_stamp is None else time_stamp)
+            self.journal_write(lapJournal.MARK, self.mark_passages[-1])
+
+    # Start the journal. An existing journal is replayed first to restore the state.
+    # car_id: id of the car in the journal. None: name of the journal file.
+    def start_journal(self, journal_file_path, car_id=None):
+        if os.path.isfile(journal_file_path):
+            self.restore_journal(journal_file_path)
+
+        self.journal = lapJournal.LapJournal(journal_file_path, self.clock, car_id=car_id)
+        self.journal.open()
+
+        # Journal the current config, so a replay reads the same config.
+        if self.config_file is not None:
+            self.journal_write(lapJournal.CONFIG, payload=self.config_file.encode())
+
+    # Stop the journal. All records are written.
+    def stop_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # Write a record to the journal, if started and not replaying.
+    def journal_write(self, kind, t_ns=0, payload=b'', value=0):
+        if self.journal is not None and not self.replaying:
+            self.journal.write(kind, t_ns, payload, value)
+
+    # Start a new journal file with the current config, if started and not replaying. The last run is archived.
+    def rotate_journal(self):
+        if self.journal is not None and not self.replaying:
+            self.journal.rotate()
+            if self.config_file is not None:
+                self.journal.write(lapJournal.CONFIG, payload=self.config_file.encode())
+
+    # Write the latency histograms to the stats file. The config may set another file (misc: stats_file).
+    def write_stats(self):
+        stats_file_path = self.stats_file
+        if self.config:
+            stats_file_path = self.config['misc'].get('stats_file', stats_file_path)
+        self.instrumentation.write(stats_file_path)
+        print('Timing statistics written to {}.'.format(stats_file_path))
+
+    # Restore the timer state by replaying a journal.
+    def restore_journal(self, journal_file_path):
+        self.replaying = True
+        try:
+            for kind, value, t_ns, payload in lapJournal.read_journal(journal_file_path, self.clock):
+                if kind == lapJournal.CONFIG:
+                    config_file_path = payload.decode()
+                    if config_file_path != self.config_file and os.path.isfile(config_file_path):
+                        try:
+                            self.read_config(config_file_path)
+                        except ConfigError as err:
+                            print('Config {} of the journal not restored: {}'.format(config_file_path, err))
+                elif kind == lapJournal.LAP:
+                    self.reg_new_lap(value, time_stamp=t_ns)
+                elif kind == lapJournal.MARK:
+                    self.mark_reached(t_ns)
+                elif kind == lapJournal.RESET:
+                    self.reset_config()
+        finally:
+            self.replaying = False
+
+        # Do not fire the events of a running confirmation lap, which are already past.
+        if self.state == 4:
+            self.timeline.skip_until(self.clock.now())
+            self.mark_count = sum(1 for ev in self.timeline.events[:self.timeline.index]
+                                  if ev[1] == EventTimeline.MARK)
+
+        print('Journal restored: {} laps, state {}.'.format(len(self.lap_times), self.state))
+
+    # Reset the timer to the currently loaded configuration. A changed config is swapped in.
     def reset_config(self):
         self.state = 0
         self.state_count = -1
+        self.timeline.close()
         self.time_stamps = []
         self.lap_times = []
         self.cur_set_time = None
         self.cur_set_time_decoded = None
+        self.position_marks = None
+        self.deferred_marks = []
+        self.recording_trace = None
+        self.curlap_delta_ns = None
+        self.journal_write(lapJournal.RESET, self.clock.now())
+        self.rotate_journal()
 
-    # Read a config from a config file.
-    def read_config(self, config_file_path):
-        # TODO: Except wrong format.
+        if self.config_watcher is not None:
+            pending = self.config_watcher.take()
+            if pending is not None:
+                self.swap_plan(*pending)
 
-        # Select and open a configuration.
-        with open(config_file_path) as config_file:
-            config_text = config_file.readlines()
+        self.publish_telemetry()
 
-        # Re-Init config attribute.
-        self.config = {'states': [],
-                       'marks': {},
-                       'misc': {},
+    # Read a config from a config file.
+    # The config is compiled into a stage plan. Raises stagePlan.ConfigError for a malformed config.
+    def read_config(self, config_file_path):
+        plan = compile_plan(config_file_path)
+        self.set_plan(plan)
+
+        # Init the configured mixer mode and load the sounds in the background. The clips of the last config are
+        # played until then. A swapped in config keeps the mixer.
+        self.mixer_mode = plan.misc.get('mixer_mode', self.MIXER_MODE_DEFAULT)
+        self.audio_leads = read_calibration(self.audio_calibration_file, self.mixer_mode)
+        if self.audio:
+            self.load_audio(self.load_plan_audio, plan)
+
+        # Journal the config change.
+        self.journal_write(lapJournal.CONFIG, payload=self.config_file.encode())
+
+    # Set the working config from a stage plan.
+    def set_plan(self, plan):
+        self.plan = plan
+        self.config_file = plan.config_file
+        self.config = {'states': list(plan.states),
+                       'marks': dict(plan.marks),
+                       'misc': dict(plan.misc),
                        }
-
-        # Read basic state config.
-        for k in config_text[0].strip():
-            self.config['states'].append(int(k))
-
-        # Read advanced config sections.
-        section = ''
-        for li in config_text:
-            line = li.strip()
-            # New section.
-            if line.startswith('['):
-                section = line[1:-1]
-
-            # New Key-Value pair.
-            elif '=' in line:
-                line_split = line.split('=')
-
-                if section in self.config:
-                    self.config[section][line_split[0].strip()] = line_split[1].strip()
-
-        if self.config['marks']:
-            self.mark_labels = list(self.config['marks'].keys())
-
-        if 'sound_delay' in self.config['misc']:
-            self.sound_delay = float(self.config['misc']['sound_delay'])
+        self.mark_labels = [label for label, _ in plan.marks]
+        self.mark_points = {}
+        self.set_trace = None
+        self.sound_delay = plan.sound_delay
+        self.finish_line_coordinates = list(plan.finish_line) if plan.finish_line is not None else [None] * 2
+
+    # Preload the spoken clips of a plan and read the calibrated lead times of the mixer mode.
+    # Returns (speech_clips, audio_leads). Does not change the timer, so it also runs in the config watcher thread.
+    # The clips are loaded by the audio loader, after the mixer is initialized.
+    def prepare_plan(self, plan):
+        speech_clips = (self.load_audio(self.load_speech_clips, plan).result() or {}) if self.audio else {}
+        return speech_clips, read_calibration(self.audio_calibration_file, self.mixer_mode)
+
+    # Swap in a compiled and prepared plan.
+    def swap_plan(self, plan, prepared):
+        self.set_plan(plan)
+        self.speech_clips, self.audio_leads = prepared
+        self.journal_write(lapJournal.CONFIG, payload=self.config_file.encode())
+        print('Config {} swapped in.'.format(self.config_file))
+
+    # Swap in a changed config at a lap boundary, if the watcher compiled one.
+    # Only done, where the marks of the last set lap are not needed anymore: at the start of a set lap or before the
+    # first set lap. Otherwise the plan stays pending. The state of the new lap is taken from the new plan.
+    def swap_pending_plan(self):
+        pending = self.config_watcher.take()
+        if pending is None:
+            return
+
+        plan = pending[0]
+        state = plan.states[self.state_count] if self.state_count < len(plan.states) else 1
+        if state == 3 or (self.cur_set_time is None and state != 4):
+            self.swap_plan(*pending)
+            self.state = state
+        else:
+            self.config_watcher.put_back(pending)
+
+    # Watch the config file and swap in changes between laps.
+    def watch_config(self, interval=1.0):
+        self.unwatch_config()
+        self.config_watcher = ConfigWatcher(self.config_file, self.prepare_plan, interval)
+        self.config_watcher.start()
+
+    # Stop watching the config file.
+    def unwatch_config(self):
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+            self.config_watcher = None
@@ -3,12 +3,16 @@
 
 import os
 import pathlib
-from math import floor
-from tkinter import Tk, Menu, Label, Text, filedialog
+from tkinter import Tk, Menu, Label, Text, TclError, filedialog, messagebox
 from tkinter.ttk import Progressbar, Style
 import tkinter.font as tk_font
 
 from regularityRally import RegularityRally
+from stagePlan import ConfigError
+from clock import NS_PER_S
+from tickScheduler import TickScheduler
+from instrumentation import Instrumentation
+from timeFormat import CachedFormat, NS_PER_HUNDREDTH, format_hh_mm_ss_t, format_countdown_hundredths, format_delta
 
 
 class RegularityRallyGUI(RegularityRally):
@@ -19,6 +23,12 @@ class RegularityRallyGUI(RegularityRally):
               3: 'Set Lap',
               4: 'Confirmation Lap'}
 
+    # Resolution of the countdown display in a confirmation lap.
+    COUNTDOWN_STEP_NS = NS_PER_S // 100
+
+    # Length of the progress bar (px). The bar value is the countdown in px.
+    BAR_LENGTH = 1000
+
     def __init__(self):
         super().__init__()
 
@@ -45,6 +55,18 @@ class RegularityRallyGUI(RegularityRally):
         self.bar_progress = None
         self.style_progress = None
 
+        # Values currently shown by the widgets. A widget is only configured, if its value changes.
+        self.shown = {}
+
+        # Formatters of the displayed times.
+        self.format_lap = CachedFormat(format_hh_mm_ss_t)
+        self.format_set_lap = CachedFormat(format_hh_mm_ss_t)
+        self.format_countdown = CachedFormat(format_countdown_hundredths, NS_PER_HUNDREDTH, rounded=True)
+        self.format_delta = CachedFormat(format_delta, NS_PER_HUNDREDTH, rounded=True)
+
+        # Scheduler for GUI updates. Ready states are checked every max_interval.
+        self.scheduler = TickScheduler(self.clock, max_interval=0.1)
+
         # Get start time.
         self.time_stamps = []
 
@@ -56,8 +78,11 @@ class RegularityRallyGUI(RegularityRally):
         self.master = Tk()
         self.master.title('Regularity Rally Timer')
 
-        # Resize window.
-        self.master.state('zoomed')
+        # Resize window. The zoomed state is only known on Windows.
+        try:
+            self.master.state('zoomed')
+        except TclError:
+            self.master.attributes('-zoomed', True)
         self.w = self.master.winfo_screenwidth()
         self.h = self.master.winfo_screenheight()
 
@@ -119,8 +144,8 @@ class RegularityRallyGUI(RegularityRally):
                                                    ("LabeledProgressbar.label",  # label inside the bar
                                                     {"sticky": ""})],
                                       'sticky': 'nswe'})])
-        self.bar_progress = Progressbar(self.master, orient='horizontal', length=1000, mode='determinate',
-                                        style="LabeledProgressbar")
+        self.bar_progress = Progressbar(self.master, orient='horizontal', length=self.BAR_LENGTH, mode='determinate',
+                                        maximum=self.BAR_LENGTH, style="LabeledProgressbar")
         self.bar_progress.grid(row=row_count, column=0, columnspan=3, ipady=25)
 
         # Column configuration.
@@ -130,12 +155,28 @@ class RegularityRallyGUI(RegularityRally):
         # Define Binds.
         self.master.bind('1', self.one_cb)
         self.master.bind('2', self.two_cb)
+        self.master.bind('i', lambda _: self.instrumentation.dump())
+
+        # Dump the latency histograms on SIGUSR1.
+        self.instrumentation.install_signal_handler()
 
         # Start master mainloop.
         self.master.after(10, self.gui_update)
-        self.master.mainloop()
+        try:
+            self.master.mainloop()
+        finally:
+            # Print scheduler statistics, write the pending journal records and the timing statistics after the
+            # window is closed.
+            print(self.scheduler.stats_string())
+            self.unwatch_config()
+            self.stop_journal()
+            self.write_stats()
 
     def gui_update(self):
+        # Record the scheduled tick and the loop interval.
+        self.scheduler.tick()
+        render_start = self.instrumentation.tick()
+
         # Calculate time delta of current lap.
         if self.state > 0:
 
@@ -143,28 +184,48 @@ class RegularityRallyGUI(RegularityRally):
             self.reg_update()
 
             # Update current lap time display.
-            self.l_cur_lap_disp['text'] = '{:02}:{:02}:{:02}.{}'.format(self.curlap_decoded[0],
-                                                                        self.curlap_decoded[1],
-                                                                        self.curlap_decoded[2],
-                                                                        floor(self.curlap_decoded[3]/100))
+            self.show(self.l_cur_lap_disp, 'text', self.format_lap(self.curlap_ns))
 
             # Update countdown display, if confirmation lap.
             if self.state == 4:
                 # Update progress bar.
-                self.bar_progress['value'] = self.curlap_countdown_seconds
-                self.style_progress.configure("LabeledProgressbar", text='{:.2f}'.format(self.curlap_countdown_seconds))
-                self.bar_progress.update()
+                self.show(self.bar_progress, 'value',
+                          max(0, self.curlap_countdown_ns * self.BAR_LENGTH // self.cur_set_time))
+                # With GPS, the delta to the set lap at the same place is shown next to the countdown.
+                delta_ns = self.live_delta_ns()
+                if delta_ns is not None:
+                    self.show_countdown('{}   {} s'.format(self.format_countdown(self.curlap_countdown_ns),
+                                                           self.format_delta(delta_ns)))
+                else:
+                    self.show_countdown(self.format_countdown(self.curlap_countdown_ns))
 
                 # Update mark label.
                 if self.mark_count < len(self.mark_labels):
-                    self.l_mark['text'] = self.mark_labels[self.mark_count]
+                    self.show(self.l_mark, 'text', self.mark_labels[self.mark_count])
 
             else:
-                self.bar_progress['value'] = 0
-                self.style_progress.configure("LabeledProgressbar", text='')
+                self.show(self.bar_progress, 'value', 0)
+                self.show_countdown('')
 
-        # Schedule next call.
-        self.master.after(10, self.gui_update)
+        self.instrumentation.record_since(Instrumentation.RENDER, render_start)
+
+        # Schedule next call at the next display change.
+        # The countdown is shown with hundredths in a confirmation lap.
+        step_ns = self.COUNTDOWN_STEP_NS if self.state == 4 else None
+        self.master.after(self.scheduler.delay_ms(self.next_deadline_ns(step_ns)), self.gui_update)
+
+    # Configure an option of a widget, if the shown value changed.
+    def show(self, widget, option, value):
+        key = (str(widget), option)
+        if self.shown.get(key) != value:
+            self.shown[key] = value
+            widget[option] = value
+
+    # Show a countdown text in the progress bar, if it changed.
+    def show_countdown(self, text):
+        if self.shown.get('countdown') != text:
+            self.shown['countdown'] = text
+            self.style_progress.configure("LabeledProgressbar", text=text)
 
     # Method called, when new race should be created.
     def new_cb(self):
@@ -173,12 +234,19 @@ class RegularityRallyGUI(RegularityRally):
                                                     title='Select file',
                                                     filetypes=(('Configuration', "*.cfg"), ("all files", "*.*"))))
 
-        # Read configuration.
-        self.read_config(conf_file.name)
+        # Read configuration. A malformed config is not loaded.
+        try:
+            self.read_config(conf_file.name)
+        except ConfigError as err:
+            messagebox.showerror('Configuration', 'Invalid configuration {}:\n{}'.format(conf_file.name, err))
+            return
+
+        # Swap in changes of the config between laps.
+        self.watch_config()
 
         # Write state.
         self.state = 0
-        self.l_state['text'] = 'Ready'
+        self.show(self.l_state, 'text', 'Ready')
 
     # Method for new lap.
     # Only update displays here. Set data in regularityRally.reg_new_lap()
@@ -193,36 +261,31 @@ class RegularityRallyGUI(RegularityRally):
             self.reg_new_lap()
 
             # Change label.
-            self.l_state['text'] = self.STATES[self.state]
+            self.show(self.l_state, 'text', self.STATES[self.state])
 
             if self.state in [3, 4]:
                 marks = list(self.config['marks'].keys())
-                self.l_mark['text'] = marks[0]
+                self.show(self.l_mark, 'text', marks[0])
+
+            # Append the finished lap to the lap times text field.
+            if len(self.time_stamps) > 1:
+                lt_id = len(self.lap_times_decoded) - 1
+                lt = self.lap_times_decoded[-1]
 
-            # Update lap times text field.
-            self.t_laps.delete(1.0, 'end')
-            for lt_id, lt in enumerate(self.lap_times_decoded):
                 # Get text char from config. If id out of config, set 'F.
                 if lt_id < len(self.config['states']):
                     state_char = self.STATES[self.config['states'][lt_id]][0]
                 else:
                     state_char = 'F'
 
-                # Set char for each lap.
+                # Set char for the lap.
                 self.t_laps.insert('end', '{:>2}: {:02}:{:02}:{:02}.{:03} {}\n'.format(lt_id + 1,
                                                                                        lt[0], lt[1], lt[2], lt[3],
                                                                                        state_char))
 
-            # Update GUI items related to set lap.
+            # Update shown set time.
             if self.cur_set_time is not None:
-                # Update shown set time.
-                self.l_set_lap_disp['text'] = '{:02}:{:02}:{:02}.{:01}'.format(self.cur_set_time_decoded[0],
-                                                                               self.cur_set_time_decoded[1],
-                                                                               self.cur_set_time_decoded[2],
-                                                                               floor(self.cur_set_time_decoded[3]/100))
-
-                # Update progressbar maximum to set lap time to show countdown.
-                self.bar_progress['maximum'] = self.cur_set_time
+                self.show(self.l_set_lap_disp, 'text', self.format_set_lap(self.cur_set_time))
 
     def two_cb(self, _):
         # Execute superclass method.
@@ -231,9 +294,9 @@ class RegularityRallyGUI(RegularityRally):
         # Write next mark to label.
         marks = list(self.config['marks'].keys())
         if len(marks) > self.mark_count:
-            self.l_mark['text'] = marks[self.mark_count]
+            self.show(self.l_mark, 'text', marks[self.mark_count])
         else:
-            self.l_mark['text'] = 'countdown'
+            self.show(self.l_mark, 'text', 'countdown')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Headless replay of button traces with a virtual clock.
+# The timer core runs without audio and display hardware. The virtual clock jumps from one deadline (display change,
+# countdown, mark, beep) or button press to the next, so a full rally runs much faster than real time.
+# Every display frame and audio event is recorded with its time stamp.
+#
+# Usage: python replay.py CONFIG [JOURNAL]
+# Without journal, a scripted trace is generated from the config.
+
+import sys
+import time
+
+import lapJournal
+from clock import Clock, VirtualClock, NS_PER_S, NS_PER_MS
+from regularityRally import RegularityRally
+from lcdDisplay import LcdDisplay
+
+# Buttons of a trace.
+BUTTON_LAP = 1
+BUTTON_MARK = 2
+BUTTON_RESET = 3
+
+
+class ReplayRally(RegularityRally):
+    # RegularityRally without audio, which records the audio events instead of playing them.
+
+    def __init__(self, clock):
+        super().__init__(clock, audio=False)
+
+        # Audio events as (t_ns, text). The beep is recorded as BEEP_NAME.
+        self.audio_events = []
+
+    def espeak_say(self, text):
+        self.audio_events.append((self.clock.now(), str(text)))
+
+    def play_beep(self):
+        self.audio_events.append((self.clock.now(), self.BEEP_NAME))
+
+
+class ReplayDriver(object):
+    # Runs a trace of (t_ns, button) presses against a config with a virtual clock.
+
+    def __init__(self, config_file_path, trace, step_ns=None):
+        self.config_file_path = config_file_path
+        self.trace = sorted(trace)
+        self.step_ns = step_ns
+
+        self.clock = VirtualClock()
+        self.rally = None
+        self.display = LcdDisplay()
+
+        # Display frames as (t_ns, [line_1, line_2]). Only changed frames are recorded.
+        self.frames = []
+
+    # Run the trace until the given time (ns). Default: time of the last press.
+    # Returns the recorded display frames.
+    def run(self, until_ns=None):
+        if until_ns is None:
+            until_ns = self.trace[-1][0] if self.trace else 0
+
+        self.rally = ReplayRally(self.clock)
+        self.rally.read_config(self.config_file_path)
+        self.rally.state = 0
+
+        trace_id = 0
+        while True:
+            # Update the timer and record the frame, like the LCD mainloop.
+            if self.rally.state > 0:
+                self.rally.reg_update()
+            lines = self.display.compose(self.rally)
+            if not self.frames or lines != self.frames[-1][1]:
+                self.frames.append((self.clock.now(), lines))
+
+            # Jump to the next press or deadline. A deadline at the same time as a press is handled first.
+            next_press = self.trace[trace_id][0] if trace_id < len(self.trace) else None
+            next_deadline = self.rally.next_deadline_ns(self.step_ns)
+
+            if next_press is not None and (next_deadline is None or next_press < next_deadline):
+                self.clock.set(next_press)
+                self.press(self.trace[trace_id][1], next_press)
+                trace_id += 1
+            elif next_deadline is not None and next_deadline <= until_ns:
+                # Make sure the clock advances, also for a deadline which is already due.
+                self.clock.set(max(next_deadline, self.clock.now() + 1))
+            else:
+                break
+
+        return self.frames
+
+    # Get the recorded audio events as (t_ns, text).
+    def audio_events(self):
+        return self.rally.audio_events
+
+    # Handle a button press like the LCD frontend.
+    def press(self, button, t_ns):
+        if button == BUTTON_LAP:
+            self.rally.reg_new_lap(time_stamp=t_ns)
+        elif button == BUTTON_MARK:
+            self.rally.mark_reached(t_ns)
+        elif button == BUTTON_RESET:
+            self.rally.reset_config()
+
+
+# Get a trace from the records of a journal. Times are relative to the first record.
+def trace_from_journal(journal_file_path):
+    buttons = {lapJournal.LAP: BUTTON_LAP, lapJournal.MARK: BUTTON_MARK, lapJournal.RESET: BUTTON_RESET}
+    records = [(t_ns, buttons[kind]) for kind, _, t_ns, _ in lapJournal.read_journal(journal_file_path, Clock())
+               if kind in buttons]
+    if not records:
+        return []
+
+    start = records[0][0]
+    return [(t_ns - start, button) for t_ns, button in records]
+
+
+# Get a scripted trace for a list of lap states.
+# Every lap takes lap_ns. In set laps, the marks are pressed at the given countdown offsets (ns before lap end).
+def scripted_trace(states, lap_ns, mark_offsets_ns):
+    trace = [(0, BUTTON_LAP)]
+    for lap_id, state in enumerate(states):
+        lap_start = lap_id * lap_ns
+        if state == 3:
+            trace += [(lap_start + lap_ns - offset, BUTTON_MARK) for offset in mark_offsets_ns]
+        trace.append((lap_start + lap_ns, BUTTON_LAP))
+    return trace
+
+
+def main():
+    config_file_path = sys.argv[1]
+
+    if len(sys.argv) > 2:
+        trace = trace_from_journal(sys.argv[2])
+    else:
+        config = RegularityRally(audio=False)
+        config.read_config(config_file_path)
+        trace = scripted_trace(config.config['states'], 100 * NS_PER_S, list(config.config['marks'].values()))
+
+    start = time.perf_counter_ns()
+    driver = ReplayDriver(config_file_path, trace)
+    frames = driver.run()
+    duration = time.perf_counter_ns() - start
+
+    print('Replayed {} presses in {:.1f} ms: {} frames, {} audio events.'.format(len(trace),
+                                                                                 duration / NS_PER_MS,
+                                                                                 len(frames),
+                                                                                 len(driver.audio_events())))
+    for t_ns, text in driver.audio_events():
+        print('{:10.3f} s  {}'.format(t_ns / NS_PER_S, text))
+
+
+if __name__ == '__main__':
+    main()
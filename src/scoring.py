@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Penalty scoring and classification of many competitors.
+# Each confirmation lap and each mark passage is compared to the last set lap of the same driver before it, like the
+# set time and mark countdowns of RegularityRally.reg_new_lap. The deviations are converted to penalty points by
+# configurable rules:
+#  - points per unit (e.g. tenth of a second) of deviation, counting full, started or nearest units,
+#  - cap of the points of a single measurement,
+#  - fixed points for a mark pressed in the set lap, but not in the confirmation lap.
+# The cars are loaded and scored in chunks across a process pool. The classification ranks them by their total
+# points. Equal points are ranked by the number of measurements without points.
+#
+# Input: lap journals (*.rlj) and CSV files. A journal is named by its car id, else by its file name. The journals of
+# a car (e.g. archived runs) are merged. A CSV file has one lap per row in lap order. The header is car,state,lap_time
+# followed by one column per mark. Times are seconds from the lap start, an empty mark was not pressed.
+#
+# Usage: python scoring.py JOURNAL_OR_DIR_OR_CSV [...] [--rules RULES.cfg] [--workers N] [--csv OUT.csv]
+#                          [--details DETAILS.csv]
+
+import os
+import csv
+import glob
+import argparse
+import configparser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from clock import seconds_to_ns
+from sessionAnalytics import SessionArrays, read_car_runs, confirmation_rows
+
+# Penalty rules.
+# resolution: unit of the deviation in seconds. points: points per unit. rounding: units counted 'down' (full
+# units), 'up' (started units) or 'nearest' (half units up). cap: maximum points of one measurement, 0 for no cap.
+# missed_mark: points of a missed mark.
+PenaltyRules = namedtuple('PenaltyRules', ['resolution', 'points', 'rounding', 'cap', 'missed_mark'])
+DEFAULT_RULES = PenaltyRules(0.1, 1.0, 'down', 100.0, 100.0)
+ROUNDINGS = ('down', 'up', 'nearest')
+
+# Tolerance of the unit count for float errors, e.g. 0.3 s / 0.1 s = 2.9999999999999996.
+UNIT_EPSILON = 1e-6
+
+# Score of a car. points: total penalty points. measurements: scored marks and laps. zeros: measurements without
+# points. missed: missed marks. details: penalty points per confirmation lap as (laps x marks + 1) arrays, the last
+# column is the lap. NaN: not measured (mark not pressed in the set lap).
+CarScore = namedtuple('CarScore', ['car', 'laps', 'measurements', 'zeros', 'missed', 'points', 'details'])
+
+CLASSIFICATION_FIELDS = ['rank', 'car', 'points', 'laps', 'measurements', 'zeros', 'missed']
+
+
+# Read penalty rules from the [penalties] section of a config file. Missing settings keep their default.
+def read_rules(rules_file_path):
+    cfg = configparser.ConfigParser()
+    if not cfg.read(rules_file_path):
+        raise OSError('Rules file {} not found.'.format(rules_file_path))
+
+    rules = DEFAULT_RULES._replace(**{key: cfg.getfloat('penalties', key)
+                                      for key in ['resolution', 'points', 'cap', 'missed_mark']
+                                      if cfg.has_option('penalties', key)})
+    rules = rules._replace(rounding=cfg.get('penalties', 'rounding', fallback=rules.rounding))
+    if rules.rounding not in ROUNDINGS:
+        raise ValueError('Rounding must be one of {}: {!r}.'.format(ROUNDINGS, rules.rounding))
+    if rules.resolution <= 0:
+        raise ValueError('Resolution must be positive: {}.'.format(rules.resolution))
+    return rules
+
+
+# Get the penalty points of deviations (s). NaN stays NaN.
+def penalty_points(deviation, rules):
+    units = np.abs(deviation) / rules.resolution
+    if rules.rounding == 'down':
+        units = np.floor(units + UNIT_EPSILON)
+    elif rules.rounding == 'up':
+        units = np.ceil(units - UNIT_EPSILON)
+    else:
+        # Half units are rounded up.
+        units = np.floor(units + 0.5 + UNIT_EPSILON)
+
+    points = units * rules.points
+    if rules.cap > 0:
+        points = np.minimum(points, rules.cap)
+    return points
+
+
+# Get the penalty points of all confirmation laps. (laps x marks + 1), the last column is the lap.
+# Marks not pressed in the set lap are not measured (NaN). Marks pressed in the set lap, but not in the confirmation
+# lap, get the missed mark points.
+def score_arrays(arrays, rules):
+    missed = ~np.isnan(arrays.set_marks) & np.isnan(arrays.conf_marks)
+    mark_points = np.where(missed, rules.missed_mark, penalty_points(arrays.mark_deviation(), rules))
+    lap_points = penalty_points(arrays.lap_error(), rules)
+    return np.concatenate([mark_points, lap_points[:, None]], axis=1), missed
+
+
+# Score cars given as (car, runs) with runs as returned by sessionAnalytics.read_runs. Returns a list of CarScore.
+def score_cars(cars, rules):
+    rows = []
+    row_counts = []
+    for car, runs in cars:
+        car_rows = confirmation_rows(runs)
+        rows += car_rows
+        row_counts.append(len(car_rows))
+
+    arrays = SessionArrays(rows)
+    points, missed = score_arrays(arrays, rules)
+
+    # Sum up per car. The rows of a car are contiguous.
+    car_index = np.repeat(np.arange(len(cars)), row_counts)
+    measured = ~np.isnan(points)
+    totals = {'points': np.where(measured, points, 0.0).sum(axis=1),
+              'measurements': measured.sum(axis=1),
+              'zeros': (measured & (points == 0)).sum(axis=1),
+              'missed': missed.sum(axis=1)}
+    totals = {key: np.bincount(car_index, weights=values, minlength=len(cars)) for key, values in totals.items()}
+
+    ends = np.cumsum(row_counts)
+    return [CarScore(car, row_counts[car_id], int(totals['measurements'][car_id]), int(totals['zeros'][car_id]),
+                     int(totals['missed'][car_id]), float(totals['points'][car_id]),
+                     [points[ends[car_id] - row_counts[car_id]:ends[car_id]]])
+            for car_id, (car, _) in enumerate(cars)]
+
+
+# Load and score journals. The car of a journal is named by its car id, else by the file name.
+def score_journals(journal_files, rules):
+    cars = []
+    for journal_file in journal_files:
+        car_id, runs = read_car_runs(journal_file)
+        cars.append((car_id or os.path.splitext(os.path.basename(journal_file))[0], runs))
+    return score_cars(cars, rules)
+
+
+# Read the laps of a CSV file. Returns a list of (car, runs) in order of appearance. Each car has one run.
+def read_csv_cars(csv_file_path):
+    config_name = os.path.basename(csv_file_path)
+    cars = {}
+    with open(csv_file_path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None or [field.strip() for field in header[:3]] != ['car', 'state', 'lap_time']:
+            raise ValueError('{}: Header must start with car,state,lap_time.'.format(csv_file_path))
+
+        for row in reader:
+            if not row:
+                continue
+            marks = [seconds_to_ns(float(mark)) for mark in row[3:] if mark.strip()]
+            cars.setdefault(row[0].strip(), []).append((int(row[1]), seconds_to_ns(float(row[2])), marks))
+
+    return [(car, [(config_name, laps)]) for car, laps in cars.items()]
+
+
+# Split items into about the given number of chunks.
+def chunks(items, n_chunks):
+    size = max(1, -(-len(items) // n_chunks))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+# Score journals and CSV files across a process pool. Returns the scores of all chunks.
+# Journals are loaded in the workers, CSV files are read before and their cars are sent in chunks.
+def score_parallel(paths, rules, workers=None):
+    workers = workers or os.cpu_count() or 1
+
+    journal_files = []
+    csv_cars = []
+    for path in paths:
+        if os.path.isdir(path):
+            journal_files += sorted(glob.glob(os.path.join(path, '*.rlj')))
+        elif path.lower().endswith('.csv'):
+            csv_cars += read_csv_cars(path)
+        else:
+            journal_files.append(path)
+
+    # Several chunks per worker balance the load.
+    tasks = ([(score_journals, chunk) for chunk in chunks(journal_files, 4 * workers)]
+             + [(score_cars, chunk) for chunk in chunks(csv_cars, 4 * workers)])
+
+    if workers == 1:
+        results = [function(chunk, rules) for function, chunk in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(function, chunk, rules) for function, chunk in tasks]
+            results = [future.result() for future in futures]
+
+    return [score for result in results for score in result]
+
+
+# Merge the scores of the same car (car id), e.g. from several journals, and rank the cars.
+# Returns a list of (rank, CarScore). Cars without scored laps are not classified (rank None) and listed last.
+def classify(scores):
+    merged = {}
+    for score in scores:
+        if score.car in merged:
+            other = merged[score.car]
+            score = CarScore(score.car, other.laps + score.laps, other.measurements + score.measurements,
+                             other.zeros + score.zeros, other.missed + score.missed, other.points + score.points,
+                             other.details + score.details)
+        merged[score.car] = score
+
+    ranked = sorted(merged.values(), key=lambda sc: (sc.laps == 0, sc.points, -sc.zeros, sc.car))
+    classification = []
+    for position, score in enumerate(ranked, 1):
+        if score.laps == 0:
+            rank = None
+        elif classification and (classification[-1][1].points, classification[-1][1].zeros) == (score.points,
+                                                                                             score.zeros):
+            # Tie.
+            rank = classification[-1][0]
+        else:
+            rank = position
+        classification.append((rank, score))
+
+    return classification
+
+
+# Write the classification as CSV.
+def write_csv(classification, csv_file_path):
+    with open(csv_file_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(CLASSIFICATION_FIELDS)
+        for rank, score in classification:
+            writer.writerow(['' if rank is None else rank, score.car, score.points, score.laps, score.measurements,
+                             score.zeros, score.missed])
+
+
+# Write the penalty points of each confirmation lap, mark and lap, as CSV.
+def write_details(classification, csv_file_path):
+    with open(csv_file_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['car', 'lap', 'item', 'points'])
+        for _, score in classification:
+            lap_id = 0
+            for details in score.details:
+                for lap_points in details:
+                    lap_id += 1
+                    for item, points in enumerate(lap_points[:-1], 1):
+                        if not np.isnan(points):
+                            writer.writerow([score.car, lap_id, item, points])
+                    writer.writerow([score.car, lap_id, 'lap', lap_points[-1]])
+
+
+# Print the classification as table.
+def print_table(classification):
+    print('{:>5} {:<16} {:>9} {:>5} {:>6} {:>6} {:>7}'.format(*CLASSIFICATION_FIELDS))
+    for rank, score in classification:
+        print('{:>5} {:<16} {:>9.1f} {:>5} {:>6} {:>6} {:>7}'.format('NC' if rank is None else rank, score.car[:16],
+                                                                    score.points, score.laps, score.measurements,
+                                                                    score.zeros, score.missed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Penalty scoring and classification of regularity rally cars.')
+    parser.add_argument('paths', nargs='+', help='Journal files, directories with *.rlj journals or CSV files.')
+    parser.add_argument('--rules', help='Config file with a [penalties] section.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes. Default: number of cores.')
+    parser.add_argument('--csv', help='Write the classification to this CSV file.')
+    parser.add_argument('--details', help='Write the penalty points of each lap and mark to this CSV file.')
+    args = parser.parse_args()
+
+    rules = read_rules(args.rules) if args.rules else DEFAULT_RULES
+    classification = classify(score_parallel(args.paths, rules, args.workers))
+
+    print_table(classification)
+    if args.csv:
+        write_csv(classification, args.csv)
+    if args.details:
+        write_details(classification, args.details)
+
+
+if __name__ == '__main__':
+    main()
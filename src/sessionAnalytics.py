@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Batch analytics over recorded sessions (lap journals).
+# All confirmation laps of all sessions are loaded into contiguous arrays (laps x marks) and the statistics are
+# computed vectorized:
+#  - deviation of each mark passage from the set lap,
+#  - deviation of each segment (previous mark to mark, last mark to finish),
+#  - confirmation lap error distribution,
+#  - aggregates per config.
+#
+# Usage: python sessionAnalytics.py JOURNAL_OR_DIR [JOURNAL_OR_DIR ...] [--csv OUT.csv]
+
+import os
+import csv
+import glob
+import argparse
+
+import numpy as np
+
+import lapJournal
+from clock import Clock, NS_PER_S
+
+PERCENTILES = [5, 50, 95]
+
+# Maximum deviation of a mark passage from its set mark. A passage farther from all set marks is not matched.
+MARK_WINDOW_NS = 10 * NS_PER_S
+STAT_FIELDS = ['count', 'mean', 'std', 'mean_abs'] + ['p{}'.format(pc) for pc in PERCENTILES]
+
+
+class SessionArrays(object):
+    # Confirmation laps of many sessions. One row per confirmation lap, one column per mark.
+    # Times are seconds from the start of the lap. Missing marks are NaN. The passages of a confirmation lap are
+    # matched to the set marks by match_marks, so a skipped press only misses its own mark.
+    # n_marks: number of mark columns. Marks beyond are dropped. None: most set marks of a lap.
+
+    def __init__(self, rows, n_marks=None):
+        # rows: (config_name, session_id, set_time_ns, set_marks_ns, conf_time_ns, conf_marks_ns)
+        self.n_marks = n_marks if n_marks is not None else max([len(row[3]) for row in rows] + [0])
+        n_laps = len(rows)
+
+        self.config_names = sorted(set(row[0] for row in rows))
+        config_ids = {name: config_id for config_id, name in enumerate(self.config_names)}
+
+        self.config_index = np.empty(n_laps, dtype=np.int64)
+        self.session_index = np.empty(n_laps, dtype=np.int64)
+        self.set_time = np.empty(n_laps, dtype=np.float64)
+        self.conf_time = np.empty(n_laps, dtype=np.float64)
+        self.set_marks = np.full((n_laps, self.n_marks), np.nan)
+        self.conf_marks = np.full((n_laps, self.n_marks), np.nan)
+
+        for lap_id, (config_name, session_id, set_time, set_marks, conf_time, conf_marks) in enumerate(rows):
+            self.config_index[lap_id] = config_ids[config_name]
+            self.session_index[lap_id] = session_id
+            self.set_time[lap_id] = set_time
+            self.conf_time[lap_id] = conf_time
+            set_marks = set_marks[:self.n_marks]
+            self.set_marks[lap_id, :len(set_marks)] = set_marks
+            matched = match_marks(rows[lap_id][3], conf_marks)[:self.n_marks]
+            self.conf_marks[lap_id, :len(matched)] = [np.nan if mark is None else mark for mark in matched]
+
+        # Convert to seconds.
+        self.set_time /= NS_PER_S
+        self.conf_time /= NS_PER_S
+        self.set_marks /= NS_PER_S
+        self.conf_marks /= NS_PER_S
+
+    # Get the number of confirmation laps.
+    def __len__(self):
+        return len(self.set_time)
+
+    # Get the deviation (s) of each mark passage from the set lap. (laps x marks)
+    def mark_deviation(self):
+        return self.conf_marks - self.set_marks
+
+    # Get the deviation (s) of each confirmation lap from the set lap.
+    def lap_error(self):
+        return self.conf_time - self.set_time
+
+    # Get the deviation (s) of each segment from the set lap. (laps x marks + 1)
+    # Segment k ends at mark k. The last column is the segment from the last set mark to the finish.
+    def segment_deviation(self):
+        n_laps = len(self)
+        zeros = np.zeros((n_laps, 1))
+
+        set_segments = np.diff(np.concatenate([zeros, self.set_marks], axis=1), axis=1)
+        conf_segments = np.diff(np.concatenate([zeros, self.conf_marks], axis=1), axis=1)
+
+        # Last set mark of each lap. Laps without marks end at 0.
+        n_set_marks = np.count_nonzero(~np.isnan(self.set_marks), axis=1)
+        last_id = np.maximum(n_set_marks - 1, 0)[:, None]
+        has_marks = n_set_marks > 0
+        set_last = np.where(has_marks, np.take_along_axis(self.set_marks, last_id, axis=1)[:, 0], 0.0)
+        conf_last = np.where(has_marks, np.take_along_axis(self.conf_marks, last_id, axis=1)[:, 0], 0.0)
+
+        finish = (self.conf_time - conf_last) - (self.set_time - set_last)
+        return np.concatenate([conf_segments - set_segments, finish[:, None]], axis=1)
+
+
+# Match the mark passages of a confirmation lap to the set marks (ns from the lap start, both in lap order).
+# The order is kept and a passage is only matched to a set mark within window_ns. Of all matchings, the one with the
+# lowest sum of deviations is taken, an unmatched set mark or passage costs the window.
+# Returns the matched passage of each set mark, None if missed.
+def match_marks(set_marks, passages, window_ns=MARK_WINDOW_NS):
+    # Common case: one passage for each set mark within the window.
+    if len(passages) == len(set_marks) and all(abs(passage - mark) <= window_ns
+                                               for mark, passage in zip(set_marks, passages)):
+        return list(passages)
+
+    # Alignment by dynamic programming. cost[i][j]: lowest cost of the first i set marks and the first j passages.
+    n_marks = len(set_marks)
+    n_passages = len(passages)
+    cost = [[(i + j) * window_ns for j in range(n_passages + 1)] for i in range(n_marks + 1)]
+    for i in range(1, n_marks + 1):
+        for j in range(1, n_passages + 1):
+            best = min(cost[i - 1][j], cost[i][j - 1]) + window_ns
+            deviation = abs(passages[j - 1] - set_marks[i - 1])
+            if deviation <= window_ns:
+                best = min(best, cost[i - 1][j - 1] + deviation)
+            cost[i][j] = best
+
+    # Trace back the matching.
+    matched = [None] * n_marks
+    i = n_marks
+    j = n_passages
+    while i > 0 and j > 0:
+        deviation = abs(passages[j - 1] - set_marks[i - 1])
+        if deviation <= window_ns and cost[i][j] == cost[i - 1][j - 1] + deviation:
+            matched[i - 1] = passages[j - 1]
+            i -= 1
+            j -= 1
+        elif cost[i][j] == cost[i - 1][j] + window_ns:
+            i -= 1
+        else:
+            j -= 1
+    return matched
+
+
+# Get the statistics of each column of a (laps x columns) array as dict of arrays. NaN is ignored.
+def column_statistics(values):
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+
+    stats = {'count': count}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        filled = np.where(valid, values, 0.0)
+        mean = filled.sum(axis=0) / count
+        stats['mean'] = mean
+        stats['std'] = np.sqrt(np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0) / count)
+        stats['mean_abs'] = np.abs(filled).sum(axis=0) / count
+
+    # Percentiles of the sorted columns. NaN sorts last, so the valid values are the first count values.
+    sorted_values = np.sort(values, axis=0)
+    for pc in PERCENTILES:
+        position = np.maximum(count - 1, 0) * pc / 100
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(count - 1, 0))
+        columns = np.arange(values.shape[1])
+        weight = position - low
+        result = sorted_values[low, columns] * (1 - weight) + sorted_values[high, columns] * weight
+        stats['p{}'.format(pc)] = np.where(count > 0, result, np.nan)
+
+    return stats
+
+
+# Get the statistics rows of all marks, segments and the lap error of one group of laps.
+# deviations: (kind, laps x columns array) of all laps, mask: laps of the group. Columns without values (e.g. marks
+# beyond the marks of the config) are left out.
+def group_rows(deviations, mask, config_name):
+    rows = []
+    for kind, all_values in deviations:
+        values = all_values[mask]
+        stats = column_statistics(values)
+        for column in range(values.shape[1]):
+            if not stats['count'][column]:
+                continue
+            if kind == 'segment' and column == values.shape[1] - 1:
+                name = 'finish'
+            elif kind == 'lap':
+                name = 'lap'
+            else:
+                name = str(column + 1)
+
+            row = {'config': config_name, 'kind': kind, 'item': name}
+            row.update({field: stats[field][column] for field in STAT_FIELDS})
+            rows.append(row)
+
+    return rows
+
+
+# Get the statistics rows of each config and the lap error of all laps.
+# Marks and segments are only aggregated per config: mark k of one config is not the same place as mark k of another.
+def analyse(arrays):
+    deviations = [('mark', arrays.mark_deviation()),
+                  ('segment', arrays.segment_deviation()),
+                  ('lap', arrays.lap_error()[:, None])]
+
+    rows = group_rows(deviations[-1:], np.ones(len(arrays), dtype=bool), 'all')
+    for config_id, config_name in enumerate(arrays.config_names):
+        rows += group_rows(deviations, arrays.config_index == config_id, config_name)
+    return rows
+
+
+# Read the runs of a journal. A run ends with a reset.
+# Returns a list of (config_name, laps) with laps as (state, lap_time_ns, [mark offset from lap start in ns]).
+def read_runs(journal_file_path):
+    return read_car_runs(journal_file_path)[1]
+
+
+# Read the car id and the runs of a journal. Returns (car_id, runs), car_id is None for a journal without car record.
+def read_car_runs(journal_file_path):
+    car_id = None
+    runs = []
+    config_name = ''
+    laps = []
+    lap_start = None
+    lap_state = 0
+    lap_marks = []
+
+    for kind, value, t_ns, payload in lapJournal.read_journal(journal_file_path, Clock()):
+        if kind == lapJournal.CAR:
+            car_id = payload.decode()
+        elif kind == lapJournal.CONFIG:
+            config_name = os.path.basename(payload.decode())
+        elif kind == lapJournal.LAP:
+            if lap_start is not None and lap_state:
+                laps.append((lap_state, t_ns - lap_start, [mark - lap_start for mark in lap_marks]))
+            lap_start = t_ns
+            lap_state = value
+            lap_marks = []
+        elif kind == lapJournal.MARK:
+            lap_marks.append(t_ns)
+        elif kind == lapJournal.RESET:
+            if laps:
+                runs.append((config_name, laps))
+            laps = []
+            lap_start = None
+            lap_state = 0
+            lap_marks = []
+
+    if laps:
+        runs.append((config_name, laps))
+
+    return car_id, runs
+
+
+# Get the confirmation lap rows of runs for SessionArrays.
+# Each confirmation lap is compared to the last set lap before it.
+def confirmation_rows(runs, first_session_id=0):
+    rows = []
+    for session_id, (config_name, laps) in enumerate(runs, first_session_id):
+        set_lap = None
+        for state, lap_time, marks in laps:
+            if state == 3:
+                set_lap = (lap_time, marks)
+            elif state == 4 and set_lap is not None:
+                rows.append((config_name, session_id, set_lap[0], set_lap[1], lap_time, marks))
+    return rows
+
+
+# Load all journals of the given files and directories.
+def load_sessions(paths):
+    journal_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            journal_files += sorted(glob.glob(os.path.join(path, '*.rlj')))
+        else:
+            journal_files.append(path)
+
+    runs = []
+    for journal_file in journal_files:
+        runs += read_runs(journal_file)
+
+    return SessionArrays(confirmation_rows(runs))
+
+
+# Write the statistics rows as CSV.
+def write_csv(rows, csv_file_path):
+    with open(csv_file_path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['config', 'kind', 'item'] + STAT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# Print the statistics rows as table.
+def print_table(rows):
+    print('{:<16} {:<8} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('config', 'kind', 'item',
+                                                                             *STAT_FIELDS))
+    for row in rows:
+        print('{:<16} {:<8} {:>6} {:>6} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f}'.format(
+            row['config'][:16], row['kind'], row['item'], *[row[field] for field in STAT_FIELDS]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Statistics of recorded regularity rally sessions.')
+    parser.add_argument('paths', nargs='+', help='Journal files or directories with *.rlj journals.')
+    parser.add_argument('--csv', help='Write the statistics to this CSV file.')
+    args = parser.parse_args()
+
+    arrays = load_sessions(args.paths)
+    rows = analyse(arrays)
+
+    print('{} confirmation laps, {} configs.'.format(len(arrays), len(arrays.config_names)))
+    print_table(rows)
+    if args.csv:
+        write_csv(rows, args.csv)
+
+
+if __name__ == '__main__':
+    main()
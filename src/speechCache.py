@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import hashlib
+import subprocess
+
+
+class SpeechCache(object):
+    # Disk cache of spoken clips synthesized with eSpeak.
+    # Each text is synthesized once to a WAV file. The file name is a hash of text, voice and engine version, so a
+    # changed voice or eSpeak update creates new clips.
+
+    def __init__(self, cache_dir, espeak_command='espeak', voice='en'):
+        self.cache_dir = cache_dir
+        self.espeak_command = espeak_command
+        self.voice = voice
+
+        self._engine_version = None
+
+    # Get the eSpeak version string. Empty string if eSpeak can not be run.
+    def engine_version(self):
+        if self._engine_version is None:
+            try:
+                result = subprocess.run([self.espeak_command, '--version'],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=5)
+                self._engine_version = result.stdout.decode(errors='replace').strip()
+            except (OSError, subprocess.SubprocessError):
+                self._engine_version = ''
+
+        return self._engine_version
+
+    # Get the path of the cached clip of a text.
+    def clip_path(self, text):
+        key = '{}|{}|{}'.format(text, self.voice, self.engine_version())
+        return os.path.join(self.cache_dir, '{}.wav'.format(hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+    # Get the path of the clip of a text. Synthesize it, if not cached yet.
+    def get(self, text):
+        path = self.clip_path(text)
+
+        if not os.path.isfile(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Write to a temporary file first, so no partial clip is left in the cache.
+            path_tmp = path + '.tmp'
+            subprocess.run([self.espeak_command, '-v', self.voice, '-w', path_tmp, str(text)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30, check=True)
+            os.replace(path_tmp, path)
+
+        return path
+
+    # Get the clip paths of many texts by text.
+    # Texts, which can not be synthesized, are left out.
+    def get_all(self, texts):
+        clips = {}
+        for text in texts:
+            try:
+                clips[str(text)] = self.get(text)
+            except FileNotFoundError:
+                # eSpeak is not installed. No clip can be synthesized.
+                print('Speech clips not available: {} not found.'.format(self.espeak_command))
+                break
+            except (OSError, subprocess.SubprocessError) as err:
+                print('Speech clip "{}" not available: {}'.format(text, err))
+
+        return clips
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import threading
+from types import MappingProxyType
+from collections import namedtuple
+
+from clock import seconds_to_ns
+from audioCalibration import MIXER_MODES
+
+# Immutable compiled config of a stage.
+# states: lap states (1: fast, 2: untimed, 3: set, 4: confirmation) as tuple of int.
+# marks: (label, countdown offset in ns before lap end) in passing order.
+# misc: read-only mapping of the misc settings as strings. sound_delay is parsed to seconds.
+# finish_line: ((lat, lon), (lat, lon)) of the finish line for GPS lap detection (misc: finish_line). None if not set.
+StagePlan = namedtuple('StagePlan', ['config_file', 'states', 'marks', 'misc', 'sound_delay', 'finish_line'])
+
+LAP_STATES = (1, 2, 3, 4)
+
+# Misc settings, which must be numbers.
+NUMERIC_MISC = ['sound_delay', 'button_debounce_time', 'debounce_time', 'countdown']
+
+
+class ConfigError(ValueError):
+    # Malformed or inconsistent config file.
+    pass
+
+
+# Parse a config file into states, marks and misc settings as read from the file.
+def parse_config(config_text):
+    if not config_text or not config_text[0].strip():
+        raise ConfigError('First line must contain the lap states.')
+
+    config = {'states': config_text[0].strip(),
+              'marks': [],
+              'misc': {},
+              }
+
+    section = ''
+    for line_id, li in enumerate(config_text[1:], 2):
+        line = li.strip()
+        # New section.
+        if line.startswith('['):
+            if not line.endswith(']'):
+                raise ConfigError('Line {}: Unterminated section header.'.format(line_id))
+            section = line[1:-1]
+
+        # New Key-Value pair.
+        elif '=' in line:
+            key, value = [part.strip() for part in line.split('=', 1)]
+            if section == 'marks':
+                config['marks'].append((line_id, key, value))
+            elif section == 'misc':
+                config['misc'][key] = value
+
+    return config
+
+
+# Compile a config file into a validated stage plan.
+# Raises ConfigError for a malformed config and OSError, if the file can not be read.
+def compile_plan(config_file_path):
+    with open(config_file_path) as config_file:
+        config = parse_config(config_file.readlines())
+
+    # Lap states. A confirmation lap needs a set lap before.
+    states = []
+    for char in config['states']:
+        if not char.isdigit() or int(char) not in LAP_STATES:
+            raise ConfigError('Invalid lap state {!r}. Valid states: {}.'.format(char, LAP_STATES))
+        if int(char) == 4 and 3 not in states:
+            raise ConfigError('Confirmation lap (4) without set lap (3) before.')
+        states.append(int(char))
+
+    # Marks. Labels must be unique and the countdowns decreasing, i.e. in passing order.
+    marks = []
+    labels = set()
+    for line_id, label, value in config['marks']:
+        if not label:
+            raise ConfigError('Line {}: Mark without label.'.format(line_id))
+        if label in labels:
+            raise ConfigError('Line {}: Duplicate mark {!r}.'.format(line_id, label))
+        labels.add(label)
+        try:
+            offset = seconds_to_ns(float(value))
+        except ValueError:
+            raise ConfigError('Line {}: Countdown of mark {!r} is not a number: {!r}.'.format(line_id, label, value))
+        if offset < 0:
+            raise ConfigError('Line {}: Negative countdown of mark {!r}.'.format(line_id, label))
+        if marks and offset >= marks[-1][1]:
+            raise ConfigError('Line {}: Countdown of mark {!r} must be lower than of {!r}.'.format(line_id, label,
+                                                                                                 marks[-1][0]))
+        marks.append((label, offset))
+
+    # Misc settings.
+    for key in NUMERIC_MISC:
+        if key in config['misc']:
+            try:
+                float(config['misc'][key])
+            except ValueError:
+                raise ConfigError('Setting {} is not a number: {!r}.'.format(key, config['misc'][key]))
+    if config['misc'].get('mixer_mode', 'default') not in MIXER_MODES:
+        raise ConfigError('Invalid mixer_mode {!r}. Valid modes: {}.'.format(config['misc']['mixer_mode'],
+                                                                          ', '.join(MIXER_MODES)))
+
+    # Finish line as lat, lon, lat, lon.
+    finish_line = None
+    if config['misc'].get('finish_line'):
+        try:
+            coordinates = [float(value) for value in config['misc']['finish_line'].split(',')]
+        except ValueError:
+            coordinates = []
+        if len(coordinates) != 4:
+            raise ConfigError('Setting finish_line must be lat, lon, lat, lon: {!r}.'.format(
+                config['misc']['finish_line']))
+        finish_line = (tuple(coordinates[:2]), tuple(coordinates[2:]))
+
+    return StagePlan(os.path.abspath(config_file_path),
+                     tuple(states),
+                     tuple(marks),
+                     MappingProxyType(dict(config['misc'])),
+                     float(config['misc'].get('sound_delay', 0)),
+                     finish_line)
+
+
+class ConfigWatcher(object):
+    # Watches a config file by polling its modification time and size.
+    # A changed file is compiled in the watcher thread. A valid plan is kept in a single slot until the timer takes it
+    # at a lap boundary. A malformed file is rejected and the running plan stays.
+
+    def __init__(self, config_file_path, prepare=None, interval=1.0):
+        self.config_file_path = config_file_path
+        self.interval = interval
+
+        # Optional function preparing a compiled plan in the watcher thread, e.g. loading its sounds.
+        # Its result is passed with the plan.
+        self.prepare = prepare
+
+        self.signature = self.file_signature()
+        self.pending = None
+        self.lock = threading.Lock()
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Get the modification time and size of the file. None if it does not exist.
+    def file_signature(self):
+        try:
+            stat = os.stat(self.config_file_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='ConfigWatcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    # Compile the file, if it changed. Returns True, if a new plan is pending.
+    def check(self):
+        signature = self.file_signature()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+
+        try:
+            plan = compile_plan(self.config_file_path)
+            prepared = self.prepare(plan) if self.prepare is not None else None
+        except (ConfigError, OSError) as err:
+            print('Config {} rejected: {}'.format(self.config_file_path, err))
+            return False
+
+        with self.lock:
+            self.pending = (plan, prepared)
+        print('Config {} changed. Swapped in between laps.'.format(self.config_file_path))
+        return True
+
+    # Take the pending (plan, prepared) tuple. None if there is none.
+    def take(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = None
+        return pending
+
+    # Put a taken (plan, prepared) tuple back, e.g. if it can not be swapped in yet. A newer plan is kept.
+    def put_back(self, pending):
+        with self.lock:
+            if self.pending is None:
+                self.pending = pending
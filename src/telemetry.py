@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+# Telemetry broadcast of the timer state, e.g. to the tablet of the co-driver and the pit.
+# The state is sent as compact JSON frames to a UDP (multicast) group and to WebSocket subscribers. A frame only holds
+# the fields changed since the last frame, a key frame holds all fields:
+#   {"q":17,"t":523,"cd":412}            delta frame: sequence number and changed fields
+#   {"q":18,"k":1,"st":4,"lap":3,...}    key frame
+# A subscriber keeps the fields of the last key frame and updates them with each delta frame (see apply_frame). A gap
+# in the sequence numbers means lost frames, the next key frame (sent every KEY_INTERVAL) repairs the state.
+# Fields: st: state, lap: lap count, t: lap time (tenths), cd: countdown (tenths), set: set time (tenths), last: last
+# lap time (tenths), mk: next mark label, dl: delta to the set lap (hundredths). null: not available.
+
+import json
+import base64
+import socket
+import asyncio
+import hashlib
+import ipaddress
+import threading
+from collections import deque
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT = 0x1
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+WS_MAX_PAYLOAD = 4096
+
+# Marker of a field missing in the last state.
+MISSING = object()
+
+
+# Get the fields of a state changed since the last state as frame. Without last state, a key frame of all fields.
+def delta_frame(last_state, state, seq):
+    if last_state is None:
+        frame = dict(state)
+        frame['k'] = 1
+    else:
+        frame = {field: value for field, value in state.items() if last_state.get(field, MISSING) != value}
+        frame.update({field: None for field in last_state if field not in state})
+    frame['q'] = seq
+    return frame
+
+
+# Apply a received frame to the state of a subscriber. Returns the new state.
+def apply_frame(state, frame):
+    if frame.get('k'):
+        state = {}
+    state.update((field, value) for field, value in frame.items() if field not in ('q', 'k'))
+    return state
+
+
+# Encode a frame as compact JSON.
+def encode_frame(frame):
+    return json.dumps(frame, separators=(',', ':')).encode()
+
+
+# Get a WebSocket frame (server to client, unmasked).
+def ws_frame(payload, opcode=WS_TEXT):
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, 'big')
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, 'big')
+    return header + payload
+
+
+# Read a WebSocket frame. Returns (opcode, payload). Fragmented messages are not supported, they are not needed for
+# the control frames of the subscribers.
+async def read_ws_frame(reader):
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    if length > WS_MAX_PAYLOAD:
+        raise ValueError('WebSocket frame too long: {} bytes.'.format(length))
+
+    mask = await reader.readexactly(4) if head[1] & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return opcode, payload
+
+
+# Get the Sec-WebSocket-Accept value of a Sec-WebSocket-Key.
+def ws_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+
+
+class Subscriber(object):
+    # WebSocket subscriber with a bounded queue of frames.
+    # If the queue is full, the subscriber does not keep up. The queue is replaced by a key frame, so it catches up
+    # with the current state instead of old frames.
+
+    def __init__(self, writer, max_pending, now):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.resyncs = 0
+
+        # Loop time of the last frame (e.g. a pong) received from the subscriber.
+        self.last_seen = now
+
+    # Queue a frame. key_data: function returning the current key frame, only called on overflow.
+    def push(self, data, key_data):
+        if len(self.frames) >= self.max_pending:
+            self.frames.clear()
+            data = key_data()
+            self.resyncs += 1
+        self.frames.append(data)
+        self.ready.set()
+
+
+class TelemetryPublisher(object):
+    # Publisher of the timer state on an asyncio loop in its own thread.
+    # The timing loop posts the latest state into a single slot mailbox and never waits for the network: a post only
+    # replaces the slot. The loop takes the slot every SEND_INTERVAL, so the timing loop does not wake it (a wake-up
+    # would run the sending in the middle of a tick). It sends the changes to the UDP group and queues them for each
+    # WebSocket subscriber. Each subscriber has its own writer task, so a slow subscriber only delays itself. A
+    # subscriber, which does not take a frame for WRITE_TIMEOUT or does not answer the pings with the key frames for
+    # PING_TIMEOUT (e.g. a tablet out of the network), is dropped.
+
+    GROUP_DEFAULT = '239.255.42.99'
+    UDP_PORT_DEFAULT = 5099
+    WS_PORT_DEFAULT = 8765
+
+    # Interval (s) of sending the posted state and of key frames.
+    SEND_INTERVAL = 0.02
+    KEY_INTERVAL = 1.0
+    # Maximum queued frames of a subscriber.
+    MAX_PENDING = 64
+    # Timeouts (s) of the WebSocket handshake, of a write to a subscriber and of the answer to a ping.
+    HANDSHAKE_TIMEOUT = 5.0
+    WRITE_TIMEOUT = 5.0
+    PING_TIMEOUT = 10.0
+
+    # group: UDP group (or unicast) address, None for no UDP. ws_port: WebSocket port, None for no WebSocket.
+    def __init__(self, group=GROUP_DEFAULT, udp_port=UDP_PORT_DEFAULT, ws_port=WS_PORT_DEFAULT, host='0.0.0.0', ttl=1):
+        self.group = group
+        self.udp_port = udp_port
+        self.ws_port = ws_port
+        self.host = host
+        self.ttl = ttl
+
+        # Mailbox. Latest posted state.
+        self.state = None
+
+        # State of the last frame and its sequence number. Only used on the loop.
+        self.sent = None
+        self.seq = 0
+
+        self.loop = None
+        self.stop_event = None
+        self.ready = threading.Event()
+        self.thread = None
+        self.udp_socket = None
+        self.server = None
+        self.subscribers = set()
+
+        # Writers of the open connections by their handler task.
+        self.connections = {}
+
+        # Statistics.
+        self.posted = 0
+        self.frames = 0
+        self.bytes = 0
+        self.udp_errors = 0
+        self.connected = 0
+        self.dropped = 0
+        self.resyncs = 0
+
+    # Start the loop thread. Returns, when the sockets are open.
+    def start(self):
+        self.ready.clear()
+        self.thread = threading.Thread(target=self.run, name='Telemetry', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    # Stop the loop thread. Closes the connections of all subscribers.
+    def stop(self):
+        if self.loop is not None and self.stop_event is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                pass
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve(loop))
+        except OSError as err:
+            print('Telemetry stopped: {}'.format(err))
+        finally:
+            self.loop = None
+            self.ready.set()
+            loop.close()
+
+    async def serve(self, loop):
+        self.stop_event = asyncio.Event()
+        try:
+            if self.group:
+                self.udp_socket = self.open_udp_socket()
+            if self.ws_port:
+                self.server = await asyncio.start_server(self.handle_subscriber, self.host, self.ws_port)
+        except OSError:
+            self.close_sockets()
+            raise
+
+        self.loop = loop
+        self.ready.set()
+        loop.create_task(self.send_states())
+
+        await self.stop_event.wait()
+
+        # Close the server and all connections. The handlers end on the closed connections, then the remaining
+        # tasks (key frames, writers) are cancelled.
+        self.close_sockets()
+        for writer in self.connections.values():
+            writer.transport.abort()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Open the non-blocking UDP socket. Multicast packets stay in the local network by the TTL.
+    def open_udp_socket(self):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        udp_socket.setblocking(False)
+        if ipaddress.ip_address(self.group).is_multicast:
+            udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        return udp_socket
+
+    def close_sockets(self):
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+            self.udp_socket = None
+        if self.server is not None:
+            self.server.close()
+
+    # Post the timer state (dict of JSON values). Called by the timing loop. Never blocks.
+    # A state equal to the last posted one is ignored.
+    def publish(self, state):
+        if state != self.state:
+            self.state = state
+            self.posted += 1
+
+    # Send the latest posted state every SEND_INTERVAL and a key frame every KEY_INTERVAL.
+    async def send_states(self):
+        loop = asyncio.get_running_loop()
+        key_time = loop.time()
+        while True:
+            await asyncio.sleep(self.SEND_INTERVAL)
+            state = self.state
+            if loop.time() - key_time >= self.KEY_INTERVAL:
+                key_time = loop.time()
+                if state is not None:
+                    self.send(delta_frame(None, state, self.seq + 1), state)
+                self.ping_subscribers(key_time)
+            elif state is not None and state is not self.sent:
+                self.send(delta_frame(self.sent, state, self.seq + 1), state)
+
+    # Send a frame to the UDP group and queue it for all subscribers.
+    def send(self, frame, state):
+        if len(frame) == 1:
+            # Only the sequence number. Nothing changed.
+            return
+        self.seq = frame['q']
+        self.sent = state
+        data = encode_frame(frame)
+        self.frames += 1
+        self.bytes += len(data)
+
+        if self.udp_socket is not None:
+            try:
+                self.udp_socket.sendto(data, (self.group, self.udp_port))
+            except OSError:
+                # Full send buffer or no route. The frame is lost like any UDP packet.
+                self.udp_errors += 1
+
+        for subscriber in self.subscribers:
+            subscriber.push(data, self.key_data)
+
+    # Ping all subscribers. Drops the subscribers, which did not answer for PING_TIMEOUT.
+    def ping_subscribers(self, now):
+        for subscriber in list(self.subscribers):
+            if now - subscriber.last_seen > self.PING_TIMEOUT:
+                self.dropped += 1
+                self.subscribers.discard(subscriber)
+                subscriber.writer.transport.abort()
+            else:
+                subscriber.writer.write(ws_frame(b'', WS_PING))
+
+    # Get the key frame of the last state with the current sequence number.
+    def key_data(self):
+        return encode_frame(delta_frame(None, self.sent, self.seq))
+
+    # Handle a connection. Closed on errors of the connection or the protocol.
+    async def handle_subscriber(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            await self.serve_subscriber(reader, writer)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError,
+                ValueError):
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    # Serve a WebSocket subscriber. Frames of the subscriber are only read for close, ping and pong.
+    async def serve_subscriber(self, reader, writer):
+        request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.HANDSHAKE_TIMEOUT)
+
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None or 'websocket' not in headers.get('upgrade', '').lower():
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return
+
+        writer.write('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Accept: {}\r\n\r\n'.format(ws_accept(key)).encode())
+
+        loop = asyncio.get_running_loop()
+        subscriber = Subscriber(writer, self.MAX_PENDING, loop.time())
+        self.subscribers.add(subscriber)
+        self.connected += 1
+        if self.sent is not None:
+            subscriber.push(self.key_data(), self.key_data)
+        write_task = loop.create_task(self.write_subscriber(subscriber))
+
+        try:
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                subscriber.last_seen = loop.time()
+                if opcode == WS_CLOSE:
+                    writer.write(ws_frame(payload[:2], WS_CLOSE))
+                    break
+                elif opcode == WS_PING:
+                    writer.write(ws_frame(payload, WS_PONG))
+        finally:
+            self.subscribers.discard(subscriber)
+            self.resyncs += subscriber.resyncs
+            write_task.cancel()
+
+    # Write the queued frames of a subscriber. Drops the subscriber, if a write does not finish in WRITE_TIMEOUT.
+    async def write_subscriber(self, subscriber):
+        writer = subscriber.writer
+        while True:
+            await subscriber.ready.wait()
+            subscriber.ready.clear()
+            while subscriber.frames:
+                writer.write(ws_frame(subscriber.frames.popleft()))
+            try:
+                await asyncio.wait_for(writer.drain(), self.WRITE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                self.subscribers.discard(subscriber)
+                writer.transport.abort()
+                return
+            except ConnectionError:
+                # Closed by the subscriber. The handler ends on it.
+                return
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return ('Telemetry: {} states posted, {} frames ({} bytes) sent, {} UDP errors, {} subscribers connected, '
+                '{} dropped, {} resyncs'.format(self.posted, self.frames, self.bytes, self.udp_errors, self.connected,
+                                                self.dropped,
+                                                self.resyncs + sum(sub.resyncs for sub in list(self.subscribers))))
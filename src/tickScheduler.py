@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import time
+
+from clock import NS_PER_S, NS_PER_MS, seconds_to_ns
+
+
+class TickScheduler(object):
+    # Deadline based tick scheduler shared by all frontends.
+    # The frontend asks the timer for the next instant that visibly or audibly matters (next_deadline_ns) and waits
+    # until it. Waits are computed from absolute deadlines, so there is no accumulating drift. The measured wake up
+    # latency is subtracted from each wait (drift correction) and late ticks are counted.
+
+    WAKE_LATENCY_GAIN = 0.125
+    WAKE_LATENCY_MAX = 0.002  # s
+
+    def __init__(self, clock, max_interval=0.5, late_tolerance=0.005):
+        self.clock = clock
+
+        # Longest wait, if there is no deadline or it is far away.
+        self.max_interval_ns = seconds_to_ns(max_interval)
+
+        # Ticks later than this are counted as missed.
+        self.late_tolerance_ns = seconds_to_ns(late_tolerance)
+
+        # Estimated wake up latency of the waits. Subtracted from each wait.
+        self.wake_latency_ns = 0
+        self.wake_latency_max_ns = seconds_to_ns(self.WAKE_LATENCY_MAX)
+
+        # Deadline of the current wait.
+        self.deadline = None
+
+        # Statistics.
+        self.ticks = 0
+        self.missed = 0
+        self.early_wakes = 0
+        self.max_lateness_ns = 0
+        self.sum_lateness_ns = 0
+
+    # Get the time in seconds to wait for the given deadline (ns) and store it for tick().
+    # Without deadline or for a far deadline, max_interval is used.
+    def delay(self, deadline_ns):
+        now = self.clock.now()
+
+        if deadline_ns is None or deadline_ns - now > self.max_interval_ns:
+            deadline_ns = now + self.max_interval_ns
+        self.deadline = deadline_ns
+
+        return max(0, deadline_ns - now - self.wake_latency_ns) / NS_PER_S
+
+    # Get the time in ms to wait for the given deadline. For Tk after().
+    def delay_ms(self, deadline_ns):
+        return int(self.delay(deadline_ns) * NS_PER_S) // NS_PER_MS
+
+    # Wait until the given deadline and record the tick.
+    def sleep_until(self, deadline_ns, sleep=time.sleep):
+        sleep(self.delay(deadline_ns))
+        return self.tick()
+
+    # Record a wake up. Must be called directly after the wait.
+    # A wake up within the latency correction before the deadline spins until the deadline.
+    # Returns False, if it was an early wake up (e.g. by an input event) before the deadline.
+    def tick(self):
+        wake = self.clock.now()
+
+        # Woken up before the corrected deadline. Not a scheduled tick.
+        if self.deadline is None or wake < self.deadline - self.wake_latency_ns:
+            self.early_wakes += 1
+            return False
+
+        # Correct the wake up latency estimate by the lateness of the wake up.
+        self.wake_latency_ns += int((wake - self.deadline) * self.WAKE_LATENCY_GAIN)
+        self.wake_latency_ns = min(max(self.wake_latency_ns, 0), self.wake_latency_max_ns)
+
+        # Spin the remaining time until the deadline.
+        now = wake
+        while now < self.deadline:
+            now = self.clock.now()
+
+        # Update statistics.
+        lateness = now - self.deadline
+        self.ticks += 1
+        if lateness > self.late_tolerance_ns:
+            self.missed += 1
+        self.sum_lateness_ns += lateness
+        self.max_lateness_ns = max(self.max_lateness_ns, lateness)
+
+        self.deadline = None
+        return True
+
+    # Get a short statistics summary.
+    def stats_string(self):
+        return 'Ticks: {}, missed: {}, early wakes: {}, mean late: {:.2f} ms, max late: {:.2f} ms'.format(
+            self.ticks,
+            self.missed,
+            self.early_wakes,
+            self.sum_lateness_ns / max(self.ticks, 1) / NS_PER_MS,
+            self.max_lateness_ns / NS_PER_MS)
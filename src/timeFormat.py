@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from clock import NS_PER_S
+
+NS_PER_TENTH = NS_PER_S // 10
+NS_PER_HUNDREDTH = NS_PER_S // 100
+
+# Precomputed digit strings.
+DIGITS = [str(i) for i in range(10)]
+TWO_DIGITS = ['{:02}'.format(i) for i in range(100)]
+
+
+# Format tenths as 'MM:SS.t'. Hours are dropped like in the decoded display.
+def format_mm_ss_t(tenths):
+    seconds, tenth = divmod(tenths, 10)
+    minutes, seconds = divmod(seconds, 60)
+    return TWO_DIGITS[minutes % 60] + ':' + TWO_DIGITS[seconds] + '.' + DIGITS[tenth]
+
+
+# Format tenths as 'HH:MM:SS.t'.
+def format_hh_mm_ss_t(tenths):
+    seconds, tenth = divmod(tenths, 10)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return TWO_DIGITS[hours % 100] + ':' + TWO_DIGITS[minutes] + ':' + TWO_DIGITS[seconds] + '.' + DIGITS[tenth]
+
+
+# Format tenths as countdown 'SS.t' (same as '{:04.1f}' of the seconds). Negative after the set time.
+def format_countdown(tenths):
+    sign = '-' if tenths < 0 else ''
+    seconds, tenth = divmod(abs(tenths), 10)
+    if sign or seconds >= 100:
+        return sign + str(seconds) + '.' + DIGITS[tenth]
+    return TWO_DIGITS[seconds] + '.' + DIGITS[tenth]
+
+
+# Format hundredths as countdown 'S.hh' (same as '{:.2f}' of the seconds).
+def format_countdown_hundredths(hundredths):
+    sign = '-' if hundredths < 0 else ''
+    seconds, hundredth = divmod(abs(hundredths), 100)
+    return sign + str(seconds) + '.' + TWO_DIGITS[hundredth]
+
+
+# Format hundredths as signed delta '+S.hh'. Limited to +-99.99, so it fits the LCD.
+def format_delta(hundredths):
+    sign = '-' if hundredths < 0 else '+'
+    seconds, hundredth = divmod(min(abs(hundredths), 9999), 100)
+    return sign + str(seconds) + '.' + TWO_DIGITS[hundredth]
+
+
+class CachedFormat(object):
+    # Formatter of integer nanoseconds for the display.
+    # The time is reduced to display units (e.g. tenths) with integer division and only formatted again, if the units
+    # changed. A reference time, which does not change during a lap, is formatted once.
+
+    def __init__(self, format_units, unit_ns=NS_PER_TENTH, rounded=False):
+        self.format_units = format_units
+        self.unit_ns = unit_ns
+
+        # Offset to round to the nearest unit instead of truncating.
+        self.offset = unit_ns // 2 if rounded else 0
+
+        self.units = None
+        self.string = None
+
+    def __call__(self, time_ns):
+        units = (time_ns + self.offset) // self.unit_ns
+        if units != self.units:
+            self.units = units
+            self.string = self.format_units(units)
+        return self.string
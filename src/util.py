@@ -17,3 +17,30 @@ def decode_seconds(time_seconds):
     time_decoded[3] = floor((seconds_float - floor(seconds_float)) * 1000)
 
     return time_decoded
+
+
+# Get the runs of changed chars between two strings of equal length.
+# Returns a list of (offset, text) with the new text of each run.
+# Runs separated by at most max_gap unchanged chars are merged, as resending them is not more expensive than
+# addressing a new run.
+# If old is None (unknown content), the whole new string is one run.
+def changed_runs(old, new, max_gap=1):
+    if old is None or len(old) != len(new):
+        return [(0, new)]
+
+    runs = []
+    start = None
+    end = None
+    for i, (old_char, new_char) in enumerate(zip(old, new)):
+        if old_char != new_char:
+            if start is None:
+                start = i
+            elif i - end - 1 > max_gap:
+                runs.append((start, new[start:end + 1]))
+                start = i
+            end = i
+
+    if start is not None:
+        runs.append((start, new[start:end + 1]))
+
+    return runs
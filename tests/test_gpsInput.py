@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from clock import NS_PER_S, NS_PER_MS
+from gpsInput import Fix, FinishLine
+
+
+# Get a fix at a time (s) and position (m).
+def fix(t, x, y=5.0):
+    return Fix(int(t * NS_PER_S), x, y, 0.0, 0.0, 10.0)
+
+
+# Finish line along the y axis from 0 m to 10 m.
+def finish_line(min_lap_time=10.0, max_fix_gap=1.0):
+    return FinishLine((0.0, 0.0), (0.0, 10.0), min_lap_time, max_fix_gap)
+
+
+# The crossing time is interpolated between the fixes.
+def test_crossing_interpolated():
+    assert finish_line().crossing(fix(1.0, -2.0), fix(1.2, 8.0)) == 1040 * NS_PER_MS
+
+
+def test_no_crossing():
+    line = finish_line()
+    # Before the line.
+    assert line.crossing(fix(1.0, -8.0), fix(1.2, -2.0)) is None
+    # Beside the line.
+    assert line.crossing(fix(1.0, -2.0, 15.0), fix(1.2, 8.0, 15.0)) is None
+    # Parallel to the line.
+    assert line.crossing(fix(1.0, 0.0, 2.0), fix(1.2, 0.0, 8.0)) is None
+    assert line.last_crossing_ns is None
+
+
+# A fix on the line is crossed once, by the track ending on it.
+def test_fix_on_line():
+    line = finish_line()
+    assert line.crossing(fix(1.0, -2.0), fix(1.2, 0.0)) == 1200 * NS_PER_MS
+    assert finish_line().crossing(fix(1.2, 0.0), fix(1.4, 2.0)) is None
+
+
+# No crossing is interpolated over a gap of the fixes.
+def test_fix_gap():
+    assert finish_line().crossing(fix(1.0, -2.0), fix(2.5, 8.0)) is None
+    assert finish_line(max_fix_gap=2.0).crossing(fix(1.0, -2.0), fix(2.5, 8.0)) is not None
+
+
+# Crossings in the other direction than the first one are ignored.
+def test_direction():
+    line = finish_line()
+    assert line.crossing(fix(1.0, -2.0), fix(1.2, 8.0)) is not None
+    assert line.crossing(fix(20.0, 2.0), fix(20.2, -2.0)) is None
+    assert line.crossing(fix(40.0, -2.0), fix(40.2, 2.0)) == 40100 * NS_PER_MS
+
+
+# Crossings within the minimum lap time after the last one are ignored.
+def test_min_lap_time():
+    line = finish_line()
+    assert line.crossing(fix(1.0, -2.0), fix(1.2, 8.0)) == 1040 * NS_PER_MS
+    assert line.crossing(fix(5.0, -2.0), fix(5.2, 2.0)) is None
+    assert line.last_crossing_ns == 1040 * NS_PER_MS
+    assert line.crossing(fix(11.0, -2.0), fix(11.2, 2.0)) == 11100 * NS_PER_MS
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+
+import lapJournal
+from clock import VirtualClock, NS_PER_S
+
+
+# Write records with a journal on a virtual clock and close it.
+def write_journal(journal_file_path, records, car_id=None):
+    journal = lapJournal.LapJournal(journal_file_path, VirtualClock(NS_PER_S), batch_time=0, car_id=car_id)
+    journal.open()
+    for record in records:
+        journal.write(*record)
+    journal.close()
+    return journal
+
+
+# Get the kinds of read records.
+def kinds(records):
+    return [kind for kind, _, _, _ in records]
+
+
+# Records are read back in order with their stamps. The SESSION record is not returned.
+def test_round_trip(tmp_path):
+    journal_file_path = str(tmp_path / 'journal.rlj')
+    write_journal(journal_file_path, [(lapJournal.CONFIG, 0, b'/config/LCD.cfg'),
+                                      (lapJournal.LAP, 2 * NS_PER_S, b'', 3),
+                                      (lapJournal.MARK, 3 * NS_PER_S),
+                                      (lapJournal.RESET, 4 * NS_PER_S)])
+
+    records = lapJournal.read_journal(journal_file_path, VirtualClock(10 * NS_PER_S))
+    assert records == [(lapJournal.CAR, 7, 0, b'journal'),
+                       (lapJournal.CONFIG, 15, 0, b'/config/LCD.cfg'),
+                       (lapJournal.LAP, 3, 2 * NS_PER_S, b''),
+                       (lapJournal.MARK, 0, 3 * NS_PER_S, b''),
+                       (lapJournal.RESET, 0, 4 * NS_PER_S, b'')]
+
+
+# An incomplete last record, e.g. after a power loss during write, is ignored.
+def test_torn_last_record(tmp_path):
+    journal_file_path = str(tmp_path / 'journal.rlj')
+    write_journal(journal_file_path, [(lapJournal.LAP, 2 * NS_PER_S, b'', 3),
+                                      (lapJournal.CONFIG, 0, b'/config/LCD.cfg')])
+    size = os.path.getsize(journal_file_path)
+
+    # Torn payload.
+    with open(journal_file_path, 'r+b') as journal_file:
+        journal_file.truncate(size - 4)
+    assert kinds(lapJournal.read_journal(journal_file_path, VirtualClock())) == [lapJournal.CAR, lapJournal.LAP]
+
+    # Torn header.
+    with open(journal_file_path, 'r+b') as journal_file:
+        journal_file.truncate(size - len(b'/config/LCD.cfg') - 3)
+    assert kinds(lapJournal.read_journal(journal_file_path, VirtualClock())) == [lapJournal.CAR, lapJournal.LAP]
+
+
+# Stamps of the same boot are kept, even if the wall clock jumped.
+def test_same_boot_keeps_stamps(tmp_path, monkeypatch):
+    journal_file_path = str(tmp_path / 'journal.rlj')
+    monkeypatch.setattr(lapJournal, 'boot_id', lambda: b'boot-1')
+    write_journal(journal_file_path, [(lapJournal.LAP, 2 * NS_PER_S, b'', 1)])
+
+    wall_ns = lapJournal.time.time_ns()
+    monkeypatch.setattr(lapJournal.time, 'time_ns', lambda: wall_ns + 3600 * NS_PER_S)
+    records = lapJournal.read_journal(journal_file_path, VirtualClock(50 * NS_PER_S))
+    assert records[-1][2] == 2 * NS_PER_S
+
+
+# Stamps of another boot are moved to the current clock by the wall clock anchors.
+def test_other_boot_moves_stamps(tmp_path, monkeypatch):
+    journal_file_path = str(tmp_path / 'journal.rlj')
+    monkeypatch.setattr(lapJournal, 'boot_id', lambda: b'boot-1')
+    wall_ns = 1000 * NS_PER_S
+    monkeypatch.setattr(lapJournal.time, 'time_ns', lambda: wall_ns)
+    write_journal(journal_file_path, [(lapJournal.LAP, 2 * NS_PER_S, b'', 1)])
+
+    # Read 60 s later on the wall clock, in a boot whose clock is at 5 s.
+    monkeypatch.setattr(lapJournal, 'boot_id', lambda: b'boot-2')
+    wall_ns += 60 * NS_PER_S
+    records = lapJournal.read_journal(journal_file_path, VirtualClock(5 * NS_PER_S))
+
+    # The session started 60 s ago by the wall clock, at 5 s - 60 s on the current clock. The lap is 1 s after it.
+    assert records[-1][2] == 5 * NS_PER_S - 60 * NS_PER_S + NS_PER_S
+
+
+# A rotation archives the records written before and starts a new file with a SESSION and CAR record.
+def test_rotate(tmp_path):
+    journal_file_path = str(tmp_path / 'lap_journal.rlj')
+    journal = lapJournal.LapJournal(journal_file_path, VirtualClock(NS_PER_S), batch_time=0, car_id='007')
+    journal.open()
+    journal.write(lapJournal.LAP, 2 * NS_PER_S, value=3)
+    journal.write(lapJournal.RESET, 3 * NS_PER_S)
+    journal.rotate()
+    journal.write(lapJournal.LAP, 4 * NS_PER_S, value=1)
+    journal.close()
+
+    archives = [name for name in os.listdir(str(tmp_path)) if name != 'lap_journal.rlj']
+    assert len(archives) == 1 and archives[0].startswith('lap_journal-') and archives[0].endswith('.rlj')
+
+    archived = lapJournal.read_journal(str(tmp_path / archives[0]), VirtualClock())
+    assert kinds(archived) == [lapJournal.CAR, lapJournal.LAP, lapJournal.RESET]
+    current = lapJournal.read_journal(journal_file_path, VirtualClock())
+    assert current == [(lapJournal.CAR, 3, 0, b'007'), (lapJournal.LAP, 1, 4 * NS_PER_S, b'')]
+
+
+# Archive names do not collide within the same second.
+def test_archive_path_is_free(tmp_path):
+    journal = lapJournal.LapJournal(str(tmp_path / 'lap_journal.rlj'), VirtualClock())
+    first = journal.archive_path()
+    open(first, 'wb').close()
+    assert journal.archive_path() != first
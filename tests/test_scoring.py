@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+import pytest
+
+from clock import seconds_to_ns
+from scoring import DEFAULT_RULES, CarScore, penalty_points, score_cars, classify, read_rules
+
+
+# Get a run of a set lap (state 3) and a confirmation lap (state 4) from times in seconds.
+def run(set_time, set_marks, conf_time, conf_marks):
+    return ('stage.cfg', [(3, seconds_to_ns(set_time), [seconds_to_ns(mark) for mark in set_marks]),
+                          (4, seconds_to_ns(conf_time), [seconds_to_ns(mark) for mark in conf_marks])])
+
+
+# Get a score with the given points, laps and zeros.
+def score(car, points, laps=1, zeros=0):
+    return CarScore(car, laps, 2 * laps, zeros, 0, points, [])
+
+
+@pytest.mark.parametrize('rounding, expected', [
+    ('down', [0, 0, 1, 2, 3, 3]),
+    ('up', [0, 1, 1, 3, 3, 4]),
+    ('nearest', [0, 1, 1, 3, 3, 4]),
+])
+def test_rounding(rounding, expected):
+    deviations = np.array([0.0, 0.05, -0.1, 0.25, 0.3, 0.35])
+    points = penalty_points(deviations, DEFAULT_RULES._replace(rounding=rounding))
+    assert points.tolist() == expected
+
+
+# Exact unit multiples are not moved to the next unit by float errors, e.g. 0.3 / 0.1 = 2.9999999999999996.
+def test_float_error():
+    for rounding in ('down', 'up'):
+        assert penalty_points(np.array([0.3, 0.7]), DEFAULT_RULES._replace(rounding=rounding)).tolist() == [3, 7]
+
+
+def test_nan_and_cap():
+    rules = DEFAULT_RULES._replace(points=2.0, cap=10.0)
+    points = penalty_points(np.array([np.nan, 0.4, 3.0]), rules)
+    assert np.isnan(points[0]) and points[1:].tolist() == [8, 10]
+
+    # No cap.
+    assert penalty_points(np.array([3.0]), rules._replace(cap=0)).tolist() == [60]
+
+
+# A mark pressed in the set lap, but not in the confirmation lap, gets the missed mark points. A mark not pressed in
+# the set lap is not measured.
+def test_score_cars():
+    scores = score_cars([('007', [run(60, [10, 20], 60.25, [10.1])]),
+                         ('008', [run(60, [20], 60, [10, 20])])], DEFAULT_RULES)
+
+    assert scores[0].car == '007'
+    assert (scores[0].points, scores[0].measurements, scores[0].zeros, scores[0].missed) == (103, 3, 0, 1)
+    assert scores[0].details[0].tolist() == [[1, 100, 2]]
+
+    assert (scores[1].points, scores[1].measurements, scores[1].zeros, scores[1].missed) == (0, 2, 2, 0)
+
+
+# The scores of a car are merged. Equal points are ranked by zeros, full ties share the rank.
+def test_classify():
+    classification = classify([score('a', 5), score('b', 3, zeros=1), score('c', 3), score('a', 1),
+                               score('d', 3, zeros=1), score('e', 0, laps=0)])
+    assert [(rank, sc.car) for rank, sc in classification] == [(1, 'b'), (1, 'd'), (3, 'c'), (4, 'a'), (None, 'e')]
+    assert (classification[3][1].points, classification[3][1].laps) == (6, 2)
+
+
+def test_read_rules(tmp_path):
+    rules_file_path = tmp_path / 'rules.cfg'
+    rules_file_path.write_text('[penalties]\nresolution = 0.01\nrounding = nearest\n')
+    assert read_rules(str(rules_file_path)) == DEFAULT_RULES._replace(resolution=0.01, rounding='nearest')
+
+
+@pytest.mark.parametrize('text, message', [
+    ('[penalties]\nrounding = half\n', 'Rounding'),
+    ('[penalties]\nresolution = 0\n', 'Resolution'),
+])
+def test_rejected_rules(tmp_path, text, message):
+    rules_file_path = tmp_path / 'rules.cfg'
+    rules_file_path.write_text(text)
+    with pytest.raises(ValueError, match=message):
+        read_rules(str(rules_file_path))
+
+
+def test_missing_rules(tmp_path):
+    with pytest.raises(OSError):
+        read_rules(str(tmp_path / 'missing.cfg'))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+from clock import NS_PER_S
+from sessionAnalytics import MARK_WINDOW_NS, SessionArrays, match_marks
+
+SET_MARKS = [10 * NS_PER_S, 20 * NS_PER_S, 30 * NS_PER_S, 40 * NS_PER_S]
+
+
+# Get passages off the set marks by the given deviations (s).
+def passages(deviations, marks=SET_MARKS):
+    return [mark + int(deviation * NS_PER_S) for mark, deviation in zip(marks, deviations)]
+
+
+def test_all_marks_pressed():
+    pressed = passages([0.2, -0.3, 0.1, 0.0])
+    assert match_marks(SET_MARKS, pressed) == pressed
+
+
+# A skipped press only misses its own mark, the later passages keep their marks.
+def test_skipped_middle_mark():
+    pressed = passages([0.2, 0.1, 0.3], SET_MARKS[:1] + SET_MARKS[2:])
+    assert match_marks(SET_MARKS, pressed) == [pressed[0], None, pressed[1], pressed[2]]
+
+
+def test_skipped_first_and_last_mark():
+    pressed = passages([0.1, -0.2], SET_MARKS[1:3])
+    assert match_marks(SET_MARKS, pressed) == [None, pressed[0], pressed[1], None]
+
+
+# An extra press is not matched.
+def test_extra_press():
+    pressed = passages([0.1, 0.2, 0.3, 0.4])
+    extra = sorted(pressed + [25 * NS_PER_S])
+    assert match_marks(SET_MARKS, extra) == pressed
+
+
+# A passage farther than the window from all set marks is not matched.
+def test_passage_outside_window():
+    pressed = [SET_MARKS[0] + MARK_WINDOW_NS + NS_PER_S]
+    assert match_marks(SET_MARKS[:1], pressed) == [None]
+
+
+def test_no_passages():
+    assert match_marks(SET_MARKS, []) == [None] * len(SET_MARKS)
+    assert match_marks([], passages([0.1])) == []
+
+
+# A skipped middle mark is NaN in its column only.
+def test_arrays_skipped_middle_mark():
+    pressed = passages([0.5, 0.5, 0.5], SET_MARKS[:1] + SET_MARKS[2:])
+    arrays = SessionArrays([('stage.cfg', 0, 50 * NS_PER_S, SET_MARKS, 51 * NS_PER_S, pressed)])
+    assert np.isnan(arrays.mark_deviation()[0]).tolist() == [False, True, False, False]
+    assert np.allclose(arrays.mark_deviation()[0, [0, 2, 3]], 0.5)
+
+
+# Marks beyond an explicit number of mark columns are dropped.
+def test_arrays_clip_marks():
+    arrays = SessionArrays([('stage.cfg', 0, 50 * NS_PER_S, SET_MARKS, 50 * NS_PER_S, passages([0.1] * 4))], n_marks=2)
+    assert arrays.set_marks.shape == (1, 2)
+    assert np.allclose(arrays.mark_deviation(), 0.1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import pytest
+
+from clock import NS_PER_S
+from stagePlan import ConfigError, compile_plan
+
+VALID = """23434
+
+[misc]
+sound_delay = 0.2
+finish_line = 47.0, 8.0, 47.0001, 8.0
+
+[marks]
+start = 90
+bridge = 52.5
+curb = 28
+"""
+
+
+# Write a config file and return its path.
+def config_file(tmp_path, text):
+    config_file_path = tmp_path / 'stage.cfg'
+    config_file_path.write_text(text)
+    return str(config_file_path)
+
+
+# Replace a line of the valid config.
+def with_line(old, new):
+    assert old in VALID
+    return VALID.replace(old, new)
+
+
+def test_valid_config(tmp_path):
+    plan = compile_plan(config_file(tmp_path, VALID))
+    assert plan.states == (2, 3, 4, 3, 4)
+    assert plan.marks == (('start', 90 * NS_PER_S), ('bridge', 52500000000), ('curb', 28 * NS_PER_S))
+    assert plan.sound_delay == 0.2
+    assert plan.finish_line == ((47.0, 8.0), (47.0001, 8.0))
+
+    # The misc settings are read-only.
+    with pytest.raises(TypeError):
+        plan.misc['sound_delay'] = '1'
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', 'First line'),
+    ('\n[marks]\n', 'First line'),
+    (with_line('23434', '23534'), 'Invalid lap state'),
+    (with_line('23434', '2x'), 'Invalid lap state'),
+    (with_line('23434', '243'), 'without set lap'),
+    (with_line('[marks]', '[marks'), 'Unterminated section'),
+    (with_line('bridge = 52.5', '= 52.5'), 'Mark without label'),
+    (with_line('bridge = 52.5', 'start = 52.5'), 'Duplicate mark'),
+    (with_line('bridge = 52.5', 'bridge = soon'), 'not a number'),
+    (with_line('curb = 28', 'curb = -1'), 'Negative countdown'),
+    (with_line('bridge = 52.5', 'bridge = 95'), 'must be lower'),
+    (with_line('sound_delay = 0.2', 'sound_delay = fast'), 'sound_delay is not a number'),
+    (with_line('finish_line = 47.0, 8.0, 47.0001, 8.0', 'finish_line = 47.0, 8.0'), 'finish_line'),
+    (with_line('finish_line = 47.0, 8.0, 47.0001, 8.0', 'finish_line = a, b, c, d'), 'finish_line'),
+    (with_line('sound_delay = 0.2', 'mixer_mode = low_latncy'), 'Invalid mixer_mode'),
+])
+def test_rejected_config(tmp_path, text, message):
+    with pytest.raises(ConfigError, match=message):
+        compile_plan(config_file(tmp_path, text))
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(OSError):
+        compile_plan(str(tmp_path / 'missing.cfg'))
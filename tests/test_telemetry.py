@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import asyncio
+
+import pytest
+
+from telemetry import WS_TEXT, WS_CLOSE, WS_MAX_PAYLOAD, delta_frame, apply_frame, encode_frame, ws_frame, ws_accept
+from telemetry import read_ws_frame
+
+STATE = {'lap': 3, 'state': 4, 'mark': 'bridge', 'countdown': 12.5}
+
+
+def test_key_frame():
+    assert delta_frame(None, STATE, 1) == dict(STATE, k=1, q=1)
+
+
+# Only changed fields are sent. Removed fields are sent as None.
+def test_delta_frame():
+    state = dict(STATE, countdown=11.5)
+    del state['mark']
+    assert delta_frame(STATE, state, 2) == {'countdown': 11.5, 'mark': None, 'q': 2}
+    assert delta_frame(state, state, 3) == {'q': 3}
+
+
+# A subscriber applying the frames gets the states.
+def test_apply_frames():
+    states = [STATE, dict(STATE, countdown=11.5), dict(STATE, lap=4, mark='curb'), {'lap': 4}]
+    subscriber_state = {}
+    last_state = None
+    for seq, state in enumerate(states):
+        subscriber_state = apply_frame(subscriber_state, delta_frame(last_state, state, seq))
+        assert {field: value for field, value in subscriber_state.items() if value is not None} == state
+        last_state = state
+
+
+# A key frame replaces the state, e.g. after frames were dropped.
+def test_key_frame_resets_state():
+    state = apply_frame({'stale': 1, 'lap': 2}, delta_frame(None, STATE, 5))
+    assert state == STATE
+
+
+def test_encode_frame():
+    assert encode_frame({'lap': 3, 'q': 1}) == b'{"lap":3,"q":1}'
+
+
+# Example of RFC 6455.
+def test_ws_accept():
+    assert ws_accept('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+# Read a WebSocket frame from bytes.
+def read_bytes(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_ws_frame(reader)
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize('length', [0, 125, 126, 4096])
+def test_ws_frame_round_trip(length):
+    payload = bytes(i % 256 for i in range(length))
+    assert read_bytes(ws_frame(payload, WS_CLOSE)) == (WS_CLOSE, payload)
+
+
+# Client frames are masked.
+def test_read_masked_frame():
+    mask = b'\x37\xfa\x21\x3d'
+    payload = b'Hello'
+    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    assert read_bytes(bytes([0x81, 0x80 | len(payload)]) + mask + masked) == (WS_TEXT, payload)
+
+
+def test_read_too_long_frame():
+    with pytest.raises(ValueError):
+        read_bytes(ws_frame(bytes(WS_MAX_PAYLOAD + 1)))